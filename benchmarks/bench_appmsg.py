@@ -0,0 +1,507 @@
+"""
+appmsg（msgType 49）解析基准：旧版（每个字段一次 xpath 字符串求值 + if/elif 链）对比新版
+（预编译 XPath、一次遍历取常用字段、按类型查表），覆盖 type 5/19/57/2000/51/63，并校验两者输出一致
+
+    python benchmarks/bench_appmsg.py [--messages 20000] [--repeat 3]
+"""
+import argparse
+import contextlib
+import io
+import random
+import re
+import time
+from functools import partial
+from traceback import print_exc
+from xml.sax.saxutils import escape
+
+from lxml import etree
+from ehforwarderbot import MsgType, coordinator
+from ehforwarderbot.message import Message, LinkAttribute
+from ehforwarderbot.types import MessageID
+
+from efb_wechat_comwechat_slave.MsgDeco import efb_share_link_wrapper, efb_mp_post_wrapper, qutoed_text
+from bench_chat_history import legacy_parse_chat_history
+
+SELF_WXID = "wxid_bench_self"
+
+
+def legacy_share_link_wrapper(message: dict, chat) -> Message:
+    """
+    处理msgType49消息 - 复合xml, xml 中 //appmsg/type 指示具体消息类型.
+    /msg/appmsg/type
+    已知：
+    //appmsg/type = 1 : 百度网盘分享
+    //appmsg/type = 2 : 微信运动
+    //appmsg/type = 3 : 音乐分享
+    //appmsg/type = 4 : 小红书分享
+    //appmsg/type = 5 : 链接（公众号文章）
+    //appmsg/type = 6 : 文件 （收到文件的第二个提示【文件下载完成】)，也有可能 msgType = 10000 【【提示文件有风险】没有任何有用标识，无法判断是否与前面哪条消息有关联】
+    //appmsg/type = 8 : 未解析图片消息
+    //appmsg/type = 17 : 实时位置共享
+    //appmsg/type = 19 : 合并转发的聊天记录
+    //appmsg/type = 21 : 微信运动
+    //appmsg/type = 24 : 从收藏中分享的笔记
+    //appmsg/type = 33 : 美团外卖
+    //appmsg/type = 35 : 消息同步
+    //appmsg/type = 36 : 京东农场，滴滴打车
+    //appmsg/type = 51 : 视频（微信视频号分享）
+    //appmsg/type = 53 : 转账过期退还通知
+    //appmsg/type = 57 : 引用(回复)消息，未细致研究哪个参数是被引用的消息 id
+    //appmsg/type = 63 : 直播（微信视频号分享）
+    //appmsg/type = 74 : 文件 (收到文件的第一个提示)
+    //appmsg/type = 87 : 群公告
+    //appmsg/type = 2000 : 转账
+    :param message: The message
+    :return: EFB Message
+    """
+
+    text: str = message['message']
+    xml = etree.fromstring(text)
+    result_text = ""
+    try:
+        type = int(xml.xpath('/msg/appmsg/type/text()')[0])
+        if type in [ 1 , 2 ]:
+            title = xml.xpath('/msg/appmsg/title/text()')[0]
+            des = xml.xpath('/msg/appmsg/des/text()')[0]
+            efb_msg = Message(
+                type = MsgType.Text,
+                text = title if title==des else title+" :\n"+des,
+            )
+        elif type == 3: #音乐分享
+            try:
+                music_name = xml.xpath('/msg/appmsg/title/text()')[0]
+                music_singer = xml.xpath('/msg/appmsg/des/text()')[0]
+            except:
+                efb_msg = Message(
+                    type = MsgType.Text,
+                    text = "- - - - - - - - - - - - - - - \n无效的音乐分享",
+                )
+            try:
+                thumb_url = xml.xpath('/msg/appmsg/url/text()')[0]
+                attribute = LinkAttribute(
+                    title = music_name + ' / ' + music_singer,
+                    description = None,
+                    url = thumb_url ,
+                    image = None
+                )
+                efb_msg = Message(
+                    attributes=attribute,
+                    type=MsgType.Link,
+                    text= None,
+                    vendor_specific={ "is_mp": False }
+                )
+            except:
+                pass
+        elif type in [ 4 , 36 ]: # 至少包含小红书分享 , 京东农场 , 滴滴打车
+            title = xml.xpath('/msg/appmsg/title/text()')[0]
+            try:
+                des = xml.xpath('/msg/appmsg/des/text()')[0]
+            except:
+                des = ""
+            url = xml.xpath('/msg/appmsg/url/text()')[0]
+            app = xml.xpath('/msg/appinfo/appname/text()')[0]
+            description = f"{des}\n---- from {app}"
+            attribute = LinkAttribute(
+                title = title,
+                description = description,
+                url = url ,
+                image = None
+            )
+            efb_msg = Message(
+                attributes=attribute,
+                type=MsgType.Link,
+                text= None,
+                vendor_specific={ "is_mp": False }
+            )
+        elif type == 5: # xml链接
+            if len(xml.xpath('/msg/appmsg/showtype/text()'))!=0:
+                showtype = int(xml.xpath('/msg/appmsg/showtype/text()')[0])
+            else:
+                showtype = 0
+            if showtype == 0: # 消息对话中的(测试的是从公众号转发给好友, 不排除其他情况)
+                title = url = des = thumburl = None # 初始化
+                try:
+                    try:
+                        title = xml.xpath('/msg/appmsg/title/text()')[0]
+                    except:
+                        title = "[xml 消息解析，点击查看详情]"
+                    if '<' in title and '>' in title:
+                        subs = re.findall('<[\s\S]+?>', title)
+                        for sub in subs:
+                            title = title.replace(sub, '')
+                    url = xml.xpath('/msg/appmsg/url/text()')[0]
+                    if len(xml.xpath('/msg/appmsg/des/text()'))!=0:
+                        des = xml.xpath('/msg/appmsg/des/text()')[0]
+                    if len(xml.xpath('/msg/appmsg/thumburl/text()'))!=0:
+                        thumburl = xml.xpath('/msg/appmsg/thumburl/text()')[0]
+                    if len(xml.xpath('/msg/appinfo/appname/text()'))!=0:
+                        app = xml.xpath('/msg/appinfo/appname/text()')[0]
+                        des = f"{des}\n---- from {app}"
+
+                    if len(xml.xpath('/msg/appmsg/sourceusername/text()'))!=0:
+                        sourceusername = xml.xpath('/msg/appmsg/sourceusername/text()')[0]
+                        try:
+                            sourcedisplayname = xml.xpath('/msg/appmsg/sourcedisplayname/text()')[0]
+                            result_text += f"\n转发自公众号[{sourcedisplayname}(id: {sourceusername})]\n\n"
+                        except:
+                            result_text += f"\n转发自公众号[{sourcedisplayname}]\n\n"
+                except Exception as e:
+                    print_exc()
+                if title is not None and url is not None:
+                    attribute = LinkAttribute(
+                        title=title,
+                        description=des,
+                        url=url,
+                        image=thumburl
+                    )
+                    efb_msg = Message(
+                        attributes=attribute,
+                        type=MsgType.Link,
+                        text=result_text,
+                        vendor_specific={ "is_mp": True }
+                    )
+            elif showtype == 1: # 公众号发的推送
+                items = xml.xpath('//item')
+                show_name = xml.xpath('//publisher/nickname/text()')[0] if '@app' in text else ''
+                efb_msg = list(map(partial(efb_mp_post_wrapper, show_name=show_name), items))
+        elif type == 8:
+            efb_msg = Message(
+                type=MsgType.Unsupported,
+                text='未解密表情消息 ，请在手机端查看',
+            )
+        elif type == 17:
+            msg_title = xml.xpath('/msg/appmsg/title/text()')[0]
+            efb_msg = Message(
+                type=MsgType.Text,
+                text=msg_title,
+            )
+        elif type == 19: # 合并转发的聊天记录
+            try:
+                msg_title = xml.xpath('/msg/appmsg/title/text()')[0]
+            except:
+                msg_title = ""
+            try:
+                recorditem_element = xml.find('.//recorditem')
+                inner_xml_string = recorditem_element.text
+                recordinfo_root = etree.fromstring(inner_xml_string.encode('utf-8'))
+                texts = []
+                for data in legacy_parse_chat_history(recordinfo_root):
+                    texts.append(data['formatted'])
+                forward_content = "\n".join(texts)
+            except Exception as e:
+                forward_content = xml.xpath('/msg/appmsg/des/text()')[0]
+
+            result_text += f"{msg_title}\n\n{forward_content}"
+            efb_msg = Message(
+                type=MsgType.Text,
+                text= result_text,
+                vendor_specific={ "is_forwarded": True }
+            )
+        elif type == 21: # 微信运动
+            msg_title = xml.xpath('/msg/appmsg/title/text()')[0].strip("<![CDATA[夺得").strip("冠军]]>")
+            if '排行' not in msg_title:
+                msg_title = msg_title.strip()
+                efb_msg = Message(
+                    type=MsgType.Text,
+                    text= msg_title ,
+                )
+            else:
+                rank = xml.xpath('/msg/appmsg/hardwareinfo/messagenodeinfo/rankinfo/rank/rankdisplay/text()')[0].strip("<![CDATA[").strip("]]>")
+                steps = xml.xpath('/msg/appmsg/hardwareinfo/messagenodeinfo/rankinfo/score/scoredisplay/text()')[0].strip("<![CDATA[").strip("]]>")
+                result_text += f"{msg_title}\n\n排名: {rank}\n步数: {steps}"
+                efb_msg = Message(
+                    type=MsgType.Text,
+                    text=result_text,
+                    vendor_specific={ "is_wechatsport": True }
+                )
+        elif type == 24:
+            desc = xml.xpath('/msg/appmsg/des/text()')[0]
+            recorditem = xml.xpath('/msg/appmsg/recorditem/text()')[0]
+            xml = etree.fromstring(recorditem)
+            datadesc = xml.xpath('/recordinfo/datalist/dataitem/datadesc/text()')[0]
+            efb_msg = Message(
+                type=MsgType.Text,
+                text= '微信笔记 :\n  - - - - - - - - - - - - - - - \n' +desc + '\n' + datadesc,
+                vendor_specific={ "is_mp": True }
+            )
+        elif type == 33:
+            sourcedisplayname = xml.xpath('/msg/appmsg/sourcedisplayname/text()')[0]
+            weappiconurl = xml.xpath('/msg/appmsg/weappinfo/weappiconurl/text()')[0]
+            url = xml.xpath('/msg/appmsg/url/text()')[0]
+            attribute = LinkAttribute(
+                title=sourcedisplayname,
+                description=None,
+                url=url,
+                image=weappiconurl
+            )
+            efb_msg = Message(
+                attributes=attribute,
+                type=MsgType.Link,
+                text=None,
+                vendor_specific={ "is_mp": True }
+            )
+        elif type == 35:
+            efb_msg = Message(
+                type=MsgType.Text,
+                text= '系统消息 : 消息同步',
+                vendor_specific={ "is_mp": False }
+            )
+        elif type == 40: # 转发的转发消息
+            title = xml.xpath('/msg/appmsg/title/text()')[0]
+            desc = xml.xpath('/msg/appmsg/des/text()')[0]
+            efb_msg = Message(
+                type=MsgType.Text,
+                text= f"{title}\n\n{desc}" ,
+                vendor_specific={ "is_forwarded": True }
+            )
+        elif type == 51: # 视频（微信视频号分享）
+            title = xml.xpath('/msg/appmsg/title/text()')[0]
+            url = xml.xpath('/msg/appmsg/url/text()')[0]
+            if len(xml.xpath('/msg/appmsg/finderFeed/avatar/text()'))!=0:
+                imgurl = xml.xpath('/msg/appmsg/finderFeed/avatar/text()')[0].strip("<![CDATA[").strip("]]>")
+            else:
+                imgurl = None
+            if len(xml.xpath('/msg/appmsg/finderFeed/desc/text()'))!=0:
+                desc = xml.xpath('/msg/appmsg/finderFeed/desc/text()')[0]
+            else:
+                desc = None
+            result_text += f"微信视频号分享\n - - - - - - - - - - - - - - - \n"
+            attribute = LinkAttribute(
+                title=title,
+                description=  '\n' + desc,
+                url= url,
+                image= imgurl
+            )
+            efb_msg = Message(
+                attributes=attribute,
+                type=MsgType.Link,
+                text=result_text,
+                vendor_specific={ "is_mp": True }
+            )
+        elif type == 57: # 引用（回复）消息
+            msg = xml.xpath('/msg/appmsg/title/text()')[0]
+            refer_msgType = int(xml.xpath('/msg/appmsg/refermsg/type/text()')[0]) # 被引用消息类型
+            e = xml.xpath('/msg/appmsg/refermsg/svrid/text()') # 被引用消息 id
+            refer_svrid = len(e) > 0 and e[0] or None
+            e = xml.xpath('/msg/appmsg/refermsg/fromusr/text()') # 被引用消息所在房间
+            refer_fromusr = len(e) > 0 and e[0] or None
+            e = xml.xpath('/msg/appmsg/refermsg/chatusr/text()') # 被引用消息发送人微信号
+            refer_chatusr = len(e) > 0 and e[0] or None
+            e = xml.xpath('/msg/appmsg/refermsg/displayname/text()') # 被引用消息发送人微信名称
+            refer_displayname = len(e) > 0 and e[0] or refer_chatusr
+            efb_msg = Message(
+                type=MsgType.Text,
+                text=msg,
+                vendor_specific={ "is_refer": True }
+            )
+            prefix = ""
+            sent_by_master = True
+            if refer_svrid is not None:
+                try:
+                    # 从 master channel 中根据微信 id 查找，如果找到说明是由 comwechat self_msg 发送过去的
+                    master_message = coordinator.master.get_message_by_id(chat=chat, msg_id=refer_svrid)
+                    if master_message is not None:
+                        sent_by_master = False
+                except:
+                    pass
+            if refer_displayname is not None:
+                prefix = f"{refer_displayname}:"
+            if refer_svrid is None or (refer_chatusr == message["self"] and sent_by_master):
+                if refer_msgType == 1: # 被引用的消息是文本
+                    refer_content = xml.xpath('/msg/appmsg/refermsg/content/text()')[0] # 被引用消息内容
+                    result_text = qutoed_text(refer_content, msg, prefix)
+                elif refer_msgType == 49: # 被引用的消息也是引用消息
+                    try:
+                        refer_msg_content = xml.xpath('/msg/appmsg/refermsg/content/text()')[0] # 被引用消息引用的消息
+                        refer_msg_xml = etree.fromstring(refer_msg_content)
+                        type = int(refer_msg_xml.xpath('/msg/appmsg/type/text()')[0])
+                        if type == 57:
+                            refer_msg_text = refer_msg_xml.xpath('/msg/appmsg/title/text()')[0]
+                            result_text = qutoed_text(refer_msg_text, msg, prefix)
+                        else:
+                            result_text = msg
+                    except Exception as e:
+                        print_exc()
+                else: # 被引用的消息非文本，提示不支持
+                    result_text = qutoed_text(" 系统消息: 被引用的消息不是文本,暂不支持展示", msg, prefix)
+                efb_msg.text = result_text
+            else:
+                efb_msg.target = Message(
+                    uid=MessageID(refer_svrid),
+                    chat=chat,
+                )
+        elif type == 63: # 直播（微信视频号分享）
+            title = xml.xpath('/msg/appmsg/title/text()')[0]
+            url = xml.xpath('/msg/appmsg/url/text()')[0]
+            imgurl = xml.xpath('/msg/appmsg/finderLive/headUrl/text()')[0].strip("<![CDATA[").strip("]]>")
+            desc = xml.xpath('/msg/appmsg/finderLive/desc/text()')[0].strip("<![CDATA[").strip("]]>")
+            result_text += f"视频号直播分享\n  - - - - - - - - - - - - - - - \n"
+            attribute = LinkAttribute(
+                title=title,
+                description= '\n' + desc ,
+                url= url,
+                image= imgurl
+            )
+            efb_msg = Message(
+                attributes=attribute,
+                type=MsgType.Link,
+                text=result_text,
+                vendor_specific={ "is_mp": True }
+            )
+        elif type == 87: # 群公告
+            return
+        #     title = xml.xpath('/msg/appmsg/textannouncement/text()')[0]
+        #     efb_msg = Message(
+        #         type=MsgType.Text,
+        #         text= f"[群公告]:\n{title}" ,
+        #         vendor_specific={ "is_mp": False }
+        #     )
+        elif type == 2000:
+            subtype = xml.xpath("/msg/appmsg/wcpayinfo/paysubtype/text()")[0]
+            money =  xml.xpath("/msg/appmsg/wcpayinfo/feedesc/text()")[0].strip("<![CDATA[").strip("]]>")
+            if subtype == "1":
+                efb_msg = Message(
+                    type=MsgType.Text,
+                    text= f"收到微信转账 {money} 元",
+                    vendor_specific={ "is_mp": False }
+                )
+            elif subtype == "3":
+                efb_msg = Message(
+                    type=MsgType.Text,
+                    text= f"接收微信转账 {money} 元",
+                    vendor_specific={ "is_mp": False }
+                )
+            elif subtype == "4":
+                efb_msg = Message(
+                    type=MsgType.Text,
+                    text= f"退还微信转账 {money} 元",
+                    vendor_specific={ "is_mp": False }
+                )
+    except Exception as e:
+        print_exc()
+
+    try:
+        return efb_msg
+    except:
+        efb_msg = Message(
+            type=MsgType.Text,
+            text=text
+        )
+        return efb_msg
+
+
+def words(rnd: random.Random, low: int = 1, high: int = 30) -> str:
+    vocabulary = ["收到", "好的", "今天", "开会", "[微笑]", "哈哈", "ok", "明天见", "https://example.com/a", "<b>", "&"]
+    return " ".join(rnd.choice(vocabulary) for _ in range(rnd.randint(low, high)))
+
+
+def appmsg_5(rnd: random.Random, i: int) -> str:
+    source = ('<sourceusername>gh_bench</sourceusername><sourcedisplayname>基准公众号</sourcedisplayname>'
+              if rnd.random() < 0.7 else '')
+    url = f'<url>https://mp.weixin.qq.com/s/{i}</url>' if rnd.random() < 0.95 else ''
+    appinfo = '<appinfo><version>1</version><appname>微信</appname></appinfo>' if rnd.random() < 0.5 else ''
+    return (f'<msg><appmsg appid="" sdkver="0"><title>{escape(words(rnd)[:60])}</title><des>{escape(words(rnd))}</des>'
+            f'<action /><type>5</type><showtype>0</showtype><content /><mediatagname />{url}'
+            f'<thumburl>https://mmbiz.qpic.cn/{i}.jpg</thumburl>{source}<appattach><cdnthumbaeskey /></appattach>'
+            f'<weappinfo><pagepath /></weappinfo></appmsg>{appinfo}<commenturl /></msg>')
+
+
+def appmsg_19(rnd: random.Random, i: int) -> str:
+    items = []
+    for n in range(rnd.randrange(3, 40)):
+        datatype = rnd.choice(["1", "1", "1", "2", "5"])
+        items.append(f'<dataitem datatype="{datatype}" dataid="{n}"><datadesc>{escape(words(rnd))}</datadesc>'
+                     f'<datatitle>标题{n}</datatitle><sourcename>好友{n % 7}</sourcename>'
+                     f'<sourcetime>2024-01-01 10:{n % 60:02d}</sourcetime></dataitem>')
+    record = f'<recordinfo><title>群聊的聊天记录</title><datalist count="{len(items)}">{"".join(items)}</datalist></recordinfo>'
+    return (f'<msg><appmsg appid="" sdkver="0"><title>群聊的聊天记录</title><des>聊天记录</des><type>19</type>'
+            f'<recorditem>{escape(record)}</recorditem></appmsg></msg>')
+
+
+def appmsg_57(rnd: random.Random, i: int) -> str:
+    kind = rnd.choice(["1", "1", "1", "3", "49"])
+    if kind == "49":
+        content = escape(f'<msg><appmsg><title>{escape(words(rnd))}</title><type>57</type></appmsg></msg>')
+    else:
+        content = escape(words(rnd))
+    svrid = f'<svrid>{i - 1}</svrid>' if rnd.random() < 0.5 else ''
+    return (f'<msg><appmsg appid="" sdkver="0"><title>{escape(words(rnd)[:80])}</title><des /><type>57</type>'
+            f'<refermsg><type>{kind}</type>{svrid}<fromusr>1000@chatroom</fromusr>'
+            f'<chatusr>{SELF_WXID}</chatusr><displayname>bench</displayname><content>{content}</content></refermsg>'
+            f'</appmsg></msg>')
+
+
+def appmsg_2000(rnd: random.Random, i: int) -> str:
+    return (f'<msg><appmsg appid="" sdkver=""><title>微信转账</title><type>2000</type>'
+            f'<wcpayinfo><paysubtype>{rnd.choice("1345")}</paysubtype><feedesc><![CDATA[￥{i % 1000}.01]]></feedesc>'
+            f'</wcpayinfo></appmsg></msg>')
+
+
+def appmsg_51(rnd: random.Random, i: int) -> str:
+    desc = f'<desc>{escape(words(rnd))}</desc>' if rnd.random() < 0.9 else ''
+    return (f'<msg><appmsg appid="" sdkver="0"><title>当前微信版本不支持展示该内容</title><type>51</type>'
+            f'<url>https://support.weixin.qq.com/update/</url><finderFeed><objectId>{i}</objectId>'
+            f'<nickname>视频号{i % 10}</nickname><avatar><![CDATA[https://wx.qlogo.cn/{i}]]></avatar>{desc}'
+            f'<mediaCount>1</mediaCount></finderFeed></appmsg></msg>')
+
+
+def appmsg_63(rnd: random.Random, i: int) -> str:
+    return (f'<msg><appmsg appid="" sdkver="0"><title>当前微信版本不支持展示该内容</title><type>63</type>'
+            f'<url>https://support.weixin.qq.com/update/</url><finderLive><finderLiveID>{i}</finderLiveID>'
+            f'<nickname>直播{i % 10}</nickname><headUrl><![CDATA[https://wx.qlogo.cn/{i}]]></headUrl>'
+            f'<desc><![CDATA[{escape(words(rnd))}]]></desc></finderLive></appmsg></msg>')
+
+
+BUILDERS = [appmsg_5, appmsg_19, appmsg_57, appmsg_2000, appmsg_51, appmsg_63]
+
+
+def make_corpus(count: int, seed: int = 0, builders: list = BUILDERS) -> list:
+    rnd = random.Random(seed)
+    return [{"message": rnd.choice(builders)(rnd, i), "self": SELF_WXID} for i in range(count)]
+
+
+def summarize(result) -> tuple:
+    if isinstance(result, list):
+        return tuple(summarize(m) for m in result)
+    if not isinstance(result, Message):
+        return (result,)
+    attributes = result.attributes and dict(vars(result.attributes))
+    target = result.target and result.target.uid
+    return result.type, result.text, attributes, result.vendor_specific, target
+
+
+def bench(func, corpus: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in corpus:
+            func(message, None)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages)
+    # 两个版本在字段缺失时都会打印异常栈，校验和计时时屏蔽
+    with contextlib.redirect_stderr(io.StringIO()):
+        for message in corpus:
+            assert summarize(efb_share_link_wrapper(message, None)) == summarize(legacy_share_link_wrapper(message, None)), message
+        legacy = bench(legacy_share_link_wrapper, corpus, args.repeat)
+        new = bench(efb_share_link_wrapper, corpus, args.repeat)
+        print(f"{args.messages} messages")
+        print(f"legacy  : {legacy * 1000:8.1f}ms")
+        print(f"new     : {new * 1000:8.1f}ms  ({legacy / new:.1f}x)")
+        for builder in BUILDERS:
+            subset = make_corpus(args.messages // len(BUILDERS), builders=[builder])
+            legacy = bench(legacy_share_link_wrapper, subset, args.repeat)
+            new = bench(efb_share_link_wrapper, subset, args.repeat)
+            print(f"  type {builder.__name__[7:]:<5}: {legacy * 1000:8.1f}ms -> {new * 1000:8.1f}ms  ({legacy / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+合并转发聊天记录解析基准：旧版（etree.fromstring 后递归，每个字段两次 .// 查找）对比新版
+（iterparse 单次流式解析、显式栈展开嵌套记录），校验无预算时两者输出一致，并给出带预算时超长记录的耗时
+
+    python benchmarks/bench_chat_history.py [--messages 500] [--repeat 3]
+"""
+import argparse
+import random
+import time
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+from efb_wechat_comwechat_slave.MsgDeco import (parse_chat_history, format_chat_history,
+                                                CHAT_HISTORY_MAX_ITEMS, CHAT_HISTORY_MAX_DEPTH)
+
+
+def legacy_parse_chat_history(xml, level: int = 1) -> list[dict]:
+    res = []
+    datalist_element = xml.find('.//datalist')
+    if datalist_element is not None:
+        for dataitem in datalist_element.findall('dataitem'):
+            #TODO 想办法下载图片文件等
+            data = {
+                'datatype': dataitem.get('datatype'),
+                # 'dataid': dataitem.get('dataid'),
+                # 'messageuuid': dataitem.find('.//messageuuid').text if dataitem.find('.//messageuuid') is not None else '',
+                # 'cdnthumburl': dataitem.find('.//cdnthumburl').text if dataitem.find('.//cdnthumburl') is not None else '',
+                'datatitle': dataitem.find('.//datatitle').text if dataitem.find(
+                    './/datatitle') is not None else '',
+                'sourcetime': dataitem.find('.//sourcetime').text if dataitem.find(
+                    './/sourcetime') is not None else '',
+                # 'fromnewmsgid': dataitem.find('.//fromnewmsgid').text if dataitem.find('.//fromnewmsgid') is not None else '',
+                # 'datasize': dataitem.find('.//datasize').text if dataitem.find('.//datasize') is not None else '',
+                # 'thumbfullmd5': dataitem.find('.//thumbfullmd5').text if dataitem.find('.//thumbfullmd5') is not None else '',
+                'datafmt': dataitem.find('.//datafmt').text if dataitem.find(
+                    './/datafmt') is not None else '',
+                # 'cdnthumbkey': dataitem.find('.//cdnthumbkey').text if dataitem.find('.//cdnthumbkey') is not None else '',
+                'sourcename': dataitem.find('.//sourcename').text if dataitem.find(
+                    './/sourcename') is not None else '',
+                'sourceheadurl': dataitem.find('.//sourceheadurl').text if dataitem.find(
+                    './/sourceheadurl') is not None else '',
+                'datadesc': dataitem.find('.//datadesc').text if dataitem.find(
+                    './/datadesc') is not None else '',
+                'children': [],
+            }
+
+            prefix = f"{data['sourcename']}: "
+            count = 8 * level
+            if data['datatype'] == '1':
+                data['placeholder'] = data['datadesc']
+            elif data['datatype'] == '2':
+                data['placeholder'] = '[Photo]'
+            elif data['datatype'] == '4':
+                data['placeholder'] = '[Video]'
+            elif data['datatype'] == '5':
+                data['placeholder'] = f"[Link] {data['datatitle']}"
+            elif data['datatype'] == '8':
+                data['placeholder'] = f"[File] {data['datatitle']}"
+            elif data['datatype'] == '17':
+                data['placeholder'] = f"\n{' ' * count}[Chat History]"
+                for i in legacy_parse_chat_history(dataitem.find('recordxml/recordinfo'), level + 1):
+                    data['placeholder'] += f"\n{' ' * count}{i['formatted']}"
+                    data['children'] = i
+                data['placeholder'] += f"\n{' ' * count}[Chat History]"
+            elif data['datatype'] == '19':
+                data['placeholder'] = f"[Mini Program] {data['datatitle']}"
+            else:
+                data['placeholder'] = data['datadesc'] or data['datatitle']
+
+            data['formatted'] = f"{prefix} {data['placeholder']}"
+
+            res.append(data)
+    return res
+
+
+def words(rnd: random.Random) -> str:
+    vocabulary = ["收到", "好的", "今天", "开会", "[微笑]", "哈哈", "ok", "明天见", "https://example.com/a", "&", "<b>"]
+    return " ".join(rnd.choice(vocabulary) for _ in range(rnd.randint(1, 20)))
+
+
+def record(rnd: random.Random, items: int, depth: int, nested: float = 0.1) -> str:
+    parts = []
+    for n in range(items):
+        datatype = rnd.choice(["1", "1", "1", "2", "4", "5", "8", "19", "3"])
+        inner = ""
+        if depth > 1 and rnd.random() < nested:
+            datatype = "17"
+            inner = f"<recordxml>{record(rnd, rnd.randint(1, 30), depth - 1, nested)}</recordxml>"
+        fields = [f"<datadesc>{escape(words(rnd))}</datadesc>" if rnd.random() < 0.95 else "<datadesc />",
+                  f"<datatitle>标题{n}</datatitle>" if rnd.random() < 0.8 else "",
+                  f"<sourcename>好友{n % 7}</sourcename>" if datatype != "17" or rnd.random() < 0.5 else "",
+                  f"<sourcetime>2024-01-01 10:{n % 60:02d}</sourcetime>",
+                  "<datafmt>jpg</datafmt>" if datatype == "2" else "",
+                  f"<sourceheadurl>https://wx.qlogo.cn/{n}</sourceheadurl>"]
+        rnd.shuffle(fields)
+        parts.append(f'<dataitem datatype="{datatype}" dataid="{n}">{"".join(fields)}{inner}</dataitem>')
+    return (f'<recordinfo><title>群聊的聊天记录</title><desc>{escape(words(rnd))}</desc>'
+            f'<datalist count="{items}">{"".join(parts)}</datalist><favusername>wxid_bench</favusername></recordinfo>')
+
+
+def legacy(data: bytes) -> str:
+    return "\n".join(d['formatted'] for d in legacy_parse_chat_history(etree.fromstring(data)))
+
+
+def bench(func, corpus: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for data in corpus:
+            func(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    unbounded = lambda data: format_chat_history(parse_chat_history(data))
+    bounded = lambda data: format_chat_history(parse_chat_history(data, CHAT_HISTORY_MAX_ITEMS, CHAT_HISTORY_MAX_DEPTH))
+    corpora = {
+        "small (3-40 items)": [record(rnd, rnd.randint(3, 40), 1).encode() for _ in range(args.messages)],
+        "nested (3-40 items, 3 levels)": [record(rnd, rnd.randint(3, 40), 3, 0.2).encode() for _ in range(args.messages)],
+        "huge (500-2000 items, 4 levels)": [record(rnd, rnd.randint(500, 2000), 4, 0.05).encode()
+                                            for _ in range(max(args.messages // 50, 5))],
+    }
+    for name, corpus in corpora.items():
+        for data in corpus:
+            assert unbounded(data) == legacy(data), data
+        before = bench(legacy, corpus, args.repeat)
+        after = bench(unbounded, corpus, args.repeat)
+        budget = bench(bounded, corpus, args.repeat)
+        print(f"{name}: {len(corpus)} records")
+        print(f"  legacy    : {before * 1000:8.1f}ms")
+        print(f"  new       : {after * 1000:8.1f}ms  ({before / after:.1f}x)")
+        print(f"  new+budget: {budget * 1000:8.1f}ms  ({before / budget:.1f}x, {CHAT_HISTORY_MAX_ITEMS} items / {CHAT_HISTORY_MAX_DEPTH} levels)")
+
+
+if __name__ == "__main__":
+    main()
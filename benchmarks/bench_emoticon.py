@@ -0,0 +1,81 @@
+"""
+微信表情代码转换基准：旧版（re.findall + 逐个 str.replace）对比新版（预编译正则单次切分后查表）
+
+    python benchmarks/bench_emoticon.py [--messages 20000] [--repeat 3]
+"""
+import argparse
+import random
+import re
+import time
+
+from efb_wechat_comwechat_slave.Utils import EMOTICON_TRANSLATOR, WC_EMOTICON_CONVERSION
+
+
+def legacy_translate(message: str) -> str:
+    emojiList = re.findall('\[[\w|！|!| ]+\]' , message)
+    for emoji in emojiList:
+        try:
+            message = message.replace(emoji, WC_EMOTICON_CONVERSION[emoji])
+        except:
+            pass
+    return message
+
+
+# 发送时带或不带变体选择符 U+FE0F 的 emoji 都应整体转换，不留下孤立的 U+FE0F
+VARIANTS = {"🤦‍♂️": "[捂脸]", "🤦‍♂": "[捂脸]", "❤️": "[爱心]", "❤": "[爱心]", "☺️": "[害羞]", "☺": "[害羞]"}
+
+
+def make_corpus(count: int, seed: int = 0) -> list:
+    """模拟表情密集的群聊：短句夹杂多个表情代码、未知代码与纯文本"""
+    rnd = random.Random(seed)
+    codes = list(WC_EMOTICON_CONVERSION)
+    words = ["哈哈", "今天", "开会", "收到", "ok", "明天见", "666", "在吗", "[未知]", "[图片]", "好的好的"]
+    corpus = []
+    for _ in range(count):
+        parts = []
+        for _ in range(rnd.randint(1, 12)):
+            parts.append(rnd.choice(codes) if rnd.random() < 0.6 else rnd.choice(words))
+        if rnd.random() < 0.1:
+            parts.append("很长的一段文字" * rnd.randint(10, 50))
+        if rnd.random() < 0.05:
+            # 刷屏式的长表情串
+            parts.append("".join(rnd.choice(codes) for _ in range(rnd.randint(50, 200))))
+        corpus.append("".join(parts))
+    return corpus
+
+
+def bench(func, corpus: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in corpus:
+            func(message)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages)
+    for message in corpus:
+        assert EMOTICON_TRANSLATOR.wechat_to_emoji(message) == legacy_translate(message), message
+    legacy = bench(legacy_translate, corpus, args.repeat)
+    new = bench(EMOTICON_TRANSLATOR.wechat_to_emoji, corpus, args.repeat)
+    translated = [EMOTICON_TRANSLATOR.wechat_to_emoji(m) for m in corpus]
+    for emoji, code in VARIANTS.items():
+        assert EMOTICON_TRANSLATOR.emoji_to_wechat(f"好{emoji}的") == f"好{code}的", emoji
+    for message in translated:
+        assert "\ufe0f" not in EMOTICON_TRANSLATOR.emoji_to_wechat(message), message
+    reverse = bench(EMOTICON_TRANSLATOR.emoji_to_wechat, translated, args.repeat)
+    print(f"{args.messages} messages")
+    print(f"legacy  : {legacy * 1000:8.1f}ms")
+    print(f"new     : {new * 1000:8.1f}ms  ({legacy / new:.1f}x)")
+    print(f"reverse : {reverse * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+事件 xml 取值基准：旧版（每个字段一次 re.search）对比新版（EventXml 预编译正则一次扫描取属性），
+覆盖好友申请、名片、转账、撤回四类事件，并校验取到的值一致
+
+    python benchmarks/bench_event_xml.py [--messages 20000] [--repeat 5]
+"""
+import argparse
+import random
+import re
+import time
+
+from efb_wechat_comwechat_slave.EventXml import EventXml, attribute_pattern
+
+TRANSFER_AMOUNT = re.compile(r"<des>(?:<!\[CDATA\[)?收到转账(.*?)元")    # 只认 des 中的金额
+FRDVER_ATTRIBUTES = attribute_pattern("fromnickname", "content", "bigheadimgurl", "encryptusername", "ticket")
+CARD_ATTRIBUTES = attribute_pattern("bigheadimgurl", "nickname", "province", "city", "sex", "username")
+
+
+def frdver(rnd: random.Random, i: int) -> str:
+    return (f'<msg fromusername="wxid_stranger{i}" encryptusername="v3_020b3826fd0301000000000{i:08d}@stranger" '
+            f'fromnickname="陌生人{i}" content="我是群聊“测试群{i % 9}”的陌生人{i}" fullpy="moshengren{i}" shortpy="MSR" '
+            f'imagestatus="3" scene="14" country="CN" province="Guangdong" city="Shenzhen" sign="{"签名" * rnd.randrange(20)}" '
+            f'percard="1" sex="{rnd.randrange(3)}" alias="" weibo="" albumflag="0" albumstyle="0" albumbgimgid="" '
+            f'snsflag="273" snsbgimgid="http://szmmsns.qpic.cn/mmsns/{i}/0" snsbgobjectid="14000000000000000000" '
+            f'mhash="{i:032x}" mfullhash="{i:032x}" bigheadimgurl="http://wx.qlogo.cn/mmhead/ver_1/{i:040d}/0" '
+            f'smallheadimgurl="http://wx.qlogo.cn/mmhead/ver_1/{i:040d}/96" '
+            f'ticket="v4_000b708f0b0400000100000000{i:08d}@stranger" opcode="2" googlecontact="" qrticket="" '
+            f'chatroomusername="{i}@chatroom" sourceusername="" sourcenickname="" sharecardusername="" '
+            f'sharecardnickname="" cardversion=""><brandlist count="0" ver="{i}"></brandlist></msg>')
+
+
+def card(rnd: random.Random, i: int) -> str:
+    return (f'<?xml version="1.0"?>\n<msg bigheadimgurl="http://wx.qlogo.cn/mmhead/ver_1/{i:040d}/0" '
+            f'smallheadimgurl="http://wx.qlogo.cn/mmhead/ver_1/{i:040d}/132" username="v3_020b3826fd03{i:08d}@stranger" '
+            f'nickname="名片{i}" fullpy="mingpian{i}" shortpy="" alias="" imagestatus="3" scene="17" '
+            f'province="{rnd.choice(["北京", "广东", ""])}" city="{rnd.choice(["海淀", "深圳", ""])}" sign="" '
+            f'sex="{rnd.randrange(3)}" certflag="0" certinfo="" brandIconUrl="" brandHomeUrl="" brandSubscriptConfigUrl="" '
+            f'brandFlags="0" regionCode="CN_Guangdong_Shenzhen" antispamticket="v2_{i:040d}@stranger" />\n')
+
+
+def transfer(rnd: random.Random, i: int) -> str:
+    return ('<msg>\n<appmsg appid="" sdkver="">\n<title><![CDATA[微信转账]]></title>\n'
+            f'<des><![CDATA[收到转账{i % 1000}.{rnd.randrange(100):02d}元。如需收钱，请点此升级至最新版本]]></des>\n'
+            '<action></action>\n<type>2000</type>\n<content><![CDATA[]]></content>\n'
+            '<url><![CDATA[https://support.weixin.qq.com/cgi-bin/mmsupport-bin/readtemplate?t=page/common_page__upgrade&text=text001&btntext=btntext_upgrade]]></url>\n'
+            '<thumburl><![CDATA[https://support.weixin.qq.com/cgi-bin/mmsupport-bin/readtemplate?t=page/common_page__upgrade]]></thumburl>\n'
+            '<lowurl></lowurl>\n<extinfo>\n</extinfo>\n<wcpayinfo>\n<paysubtype>1</paysubtype>\n'
+            f'<feedesc><![CDATA[￥{i % 1000}.00]]></feedesc>\n<transcationid><![CDATA[{i:030d}]]></transcationid>\n'
+            f'<transferid><![CDATA[{i:028d}]]></transferid>\n<invalidtime><![CDATA[1700086400]]></invalidtime>\n'
+            '<begintransfertime><![CDATA[1700000000]]></begintransfertime>\n<effectivedate><![CDATA[1]]></effectivedate>\n'
+            '<pay_memo><![CDATA[]]></pay_memo>\n</wcpayinfo>\n</appmsg>\n</msg>')
+
+
+def revoke(rnd: random.Random, i: int) -> str:
+    return (f'<sysmsg type="revokemsg"><revokemsg><session>{i}@chatroom</session><msgid>{i}</msgid>'
+            f'<newmsgid>{7000000000000000000 + i}</newmsgid><replacemsg><![CDATA["成员{i}" 撤回了一条消息]]></replacemsg>'
+            '</revokemsg></sysmsg>')
+
+
+def legacy_extract(kind: str, message: str) -> tuple:
+    if kind == "frdver":
+        return (re.search('fromnickname="(.*?)"', message).group(1), re.search('content="(.*?)"', message).group(1),
+                re.search('bigheadimgurl="(.*?)"', message).group(1), re.search('encryptusername="(v3.*?)"', message).group(1),
+                re.search('ticket="(v4.*?)"', message).group(1))
+    if kind == "card":
+        return (re.search('bigheadimgurl="(.*?)"', message).group(1), re.search('nickname="(.*?)"', message).group(1),
+                re.search('province="(.*?)"', message).group(1), re.search('city="(.*?)"', message).group(1),
+                re.search('sex="(.*?)"', message).group(1), re.search('username="(.*?)"', message).group(1))
+    if kind == "transfer":
+        return (re.search("收到转账(.*)元", message).group(1),
+                re.search("<transcationid><!\[CDATA\[(.*)\]\]><\/transcationid>", message).group(1),
+                re.search("<transferid><!\[CDATA\[(.*)\]\]><\/transferid>", message).group(1))
+    return (re.search("<newmsgid>(.*?)<\/newmsgid>", message).group(1),)
+
+
+def extract(kind: str, message: str) -> tuple:
+    if kind == "frdver":
+        event = EventXml(message, FRDVER_ATTRIBUTES)
+        return (event.get("fromnickname"), event.get("content"), event.get("bigheadimgurl"),
+                event.get("encryptusername"), event.get("ticket"))
+    if kind == "card":
+        event = EventXml(message, CARD_ATTRIBUTES)
+        return (event.get("bigheadimgurl"), event.get("nickname"), event.get("province"), event.get("city"),
+                event.get("sex"), event.get("username"))
+    event = EventXml(message)
+    if kind == "transfer":
+        return (TRANSFER_AMOUNT.search(event.message).group(1), event.text("transcationid"), event.text("transferid"))
+    return (event.text("newmsgid"),)
+
+
+BUILDERS = {"frdver": frdver, "card": card, "transfer": transfer, "revoke": revoke}
+
+
+def bench(func, corpus: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for kind, message in corpus:
+            func(kind, message)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    print(f"{args.messages} messages per kind")
+    for kind, builder in BUILDERS.items():
+        corpus = [(kind, builder(rnd, i)) for i in range(args.messages)]
+        for k, message in corpus:
+            assert extract(k, message) == legacy_extract(k, message), message
+        legacy = bench(legacy_extract, corpus, args.repeat)
+        new = bench(extract, corpus, args.repeat)
+        print(f"  {kind:<8}: {legacy * 1000:8.1f}ms -> {new * 1000:8.1f}ms  ({legacy / new:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+WeChat .dat 图片解密基准：旧版（整文件读入 + 逐字节列表推导）对比新版（转换表 + 分块写入）
+
+    python benchmarks/bench_image_decode.py [--sizes 100K,5M,20M] [--repeat 3]
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+from efb_wechat_comwechat_slave.Utils import wechatimagedecode
+
+
+def legacy_wechatimagedecode(file: str):
+    def do_magic(header_code, buf):
+        return header_code ^ list(buf)[0] if buf else 0x00
+
+    def decode(magic, buf):
+        return bytearray([b ^ magic for b in list(buf)])
+
+    def guess_encoding(buf):
+        headers = {
+            'jpg': (0xff, 0xd8),
+            'png': (0x89, 0x50),
+            'gif': (0x47, 0x49),
+        }
+        for encoding in headers:
+            header_code, check_code = headers[encoding]
+            magic = do_magic(header_code, buf)
+            _, code = decode(magic, buf[:2])
+            if check_code == code:
+                return (encoding, magic)
+        return None
+
+    with open(file, 'rb') as f:
+        buf = bytearray(f.read())
+    file_type, magic = guess_encoding(buf)
+
+    ret_file = tempfile.NamedTemporaryFile()
+    with open(ret_file.name, 'wb') as f:
+        f.write(decode(magic, buf))
+    return ret_file
+
+
+def parse_size(text: str) -> int:
+    units = {"K": 1024, "M": 1024 * 1024}
+    if text[-1].upper() in units:
+        return int(float(text[:-1]) * units[text[-1].upper()])
+    return int(text)
+
+
+def make_dat(size: int, magic: int = 0x5a) -> str:
+    body = b"\xff\xd8\xff\xe0" + os.urandom(size - 4)
+    f = tempfile.NamedTemporaryFile(suffix=".dat", delete=False)
+    f.write(bytes(b ^ magic for b in body[:4]) + body[4:].translate(bytes(b ^ magic for b in range(256))))
+    f.close()
+    return f.name
+
+
+def bench(func, path: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(path).close()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100K,5M,20M")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'legacy':>10} {'new':>10} {'speedup':>8}")
+    for text in args.sizes.split(","):
+        path = make_dat(parse_size(text))
+        try:
+            with wechatimagedecode(path) as new, legacy_wechatimagedecode(path) as old:
+                assert new.read() == open(old.name, "rb").read(), "decoded output differs"
+            legacy = bench(legacy_wechatimagedecode, path, args.repeat)
+            new = bench(wechatimagedecode, path, args.repeat)
+            print(f"{text:>8} {legacy * 1000:>8.1f}ms {new * 1000:>8.1f}ms {legacy / new:>7.1f}x")
+        finally:
+            os.unlink(path)
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+入站文件暂存基准：旧版 load_local_file_to_temp（整文件读入内存再写临时文件）对比 InboundStager，
+每种方式在独立子进程中运行以分别统计峰值 RSS
+
+    python benchmarks/bench_inbound_staging.py [--size 200M] [--dir /path/on/target/fs]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from efb_wechat_comwechat_slave.Staging import InboundStager
+
+
+def load_local_file_to_temp(file: str):
+    """旧版实现：整文件读入内存再写入临时文件"""
+    ret_file = tempfile.NamedTemporaryFile()
+    with open(file, 'rb') as f:
+        ret_file.write(f.read())
+    return ret_file
+
+
+def parse_size(text: str) -> int:
+    units = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+    if text[-1].upper() in units:
+        return int(float(text[:-1]) * units[text[-1].upper()])
+    return int(text)
+
+
+def make_file(size: int, directory: str) -> str:
+    f = tempfile.NamedTemporaryFile(dir=directory, suffix=".mp4", delete=False)
+    chunk = os.urandom(1024 * 1024)
+    for _ in range(size // len(chunk)):
+        f.write(chunk)
+    f.write(chunk[:size % len(chunk)])
+    f.close()
+    return f.name
+
+
+def child(method: str, path: str, spool: str):
+    start = time.perf_counter()
+    if method == "legacy":
+        staged = load_local_file_to_temp(path)
+    else:
+        stager = InboundStager(spool, mode=method)
+        staged = stager.stage(path)
+    elapsed = time.perf_counter() - start
+    staged.seek(0, os.SEEK_END)
+    assert staged.tell() == os.path.getsize(path)
+    staged.close()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{method:>8} {elapsed * 1000:>9.1f}ms {rss:>9.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="200M")
+    parser.add_argument("--dir", default=None)
+    parser.add_argument("--child", nargs=3, metavar=("METHOD", "PATH", "SPOOL"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    path = make_file(parse_size(args.size), args.dir)
+    spool = tempfile.mkdtemp(dir=args.dir)
+    try:
+        print(f"{'method':>8} {'time':>11} {'peak RSS':>11}")
+        for method in ("legacy", "copy", "link"):
+            subprocess.run([sys.executable, __file__, "--child", method, path, spool], check=True)
+    finally:
+        os.unlink(path)
+        os.rmdir(spool)
+
+
+if __name__ == "__main__":
+    main()
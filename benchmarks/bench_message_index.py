@@ -0,0 +1,79 @@
+"""
+消息索引基准：记录（收消息路径上的开销）、后台批量写入吞吐，以及 get_message_by_id 使用的查询延迟，
+分别统计内存 LRU 命中和回落到 SQLite 的情况
+
+    python -m benchmarks.bench_message_index [--messages 50000] [--hot 5000]
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from ehforwarderbot import Message, MsgType
+from ehforwarderbot.chat import GroupChat
+
+from efb_wechat_comwechat_slave.MessageIndex import MessageIndex
+
+
+def build(count: int, chats: int = 50) -> list:
+    groups = [GroupChat(module_id="comwechat", uid=f"{i}@chatroom", name=f"测试群{i}") for i in range(chats)]
+    members = [[group.add_member(uid=f"wxid_{i}_{j}", name=f"成员{j}") for j in range(20)] for i, group in enumerate(groups)]
+    msgs = []
+    for i in range(count):
+        chat = i % chats
+        msgs.append(Message(
+            uid=str(7000000000000000000 + i), chat=groups[chat], author=members[chat][i % 20], type=MsgType.Text,
+            text=f"第{i}条消息" * (i % 7 + 1),
+            vendor_specific={"wx_xml_ref": str(i), "comwechat_info": {"type": 1, "msgid": i, "sender": groups[chat].uid}},
+        ))
+    return msgs
+
+
+def latency(index: MessageIndex, keys: list) -> tuple:
+    samples = []
+    for chat, msgid in keys:
+        start = time.perf_counter()
+        assert index.lookup(chat, msgid) is not None
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--hot", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    args = parser.parse_args()
+
+    msgs = build(args.messages)
+    with tempfile.TemporaryDirectory() as tmp:
+        # 一次性灌入全部消息，队列放得下才能测出写入吞吐；实际收消息的速率远低于此
+        index = MessageIndex(Path(tmp) / "message_index.db", hot_size=args.hot, max_entries=args.messages * 2,
+                             queue_size=args.messages)
+
+        start = time.perf_counter()
+        for msg in msgs:
+            index.record(msg)
+        record_time = time.perf_counter() - start
+        while index.written + index.dropped < args.messages:
+            time.sleep(0.01)
+        write_time = time.perf_counter() - start
+
+        keys = [(str(m.chat.uid), str(m.uid)) for m in msgs]
+        hot = latency(index, keys[-min(args.hot, args.lookups):])
+        # 冷查询会把命中的记录放回 LRU，每个 key 只查一次
+        cold = latency(index, keys[:min(args.messages - args.hot, args.lookups)])
+        stats = index.stats()
+        index.close()
+
+    print(f"{args.messages} messages, hot LRU {args.hot}")
+    print(f"record : {record_time / args.messages * 1e6:6.1f}us/msg on the inbound path, dropped {stats['dropped']}")
+    print(f"write  : {args.messages / write_time:8.0f} msg/s in batches of {MessageIndex.batch_size}")
+    print(f"lookup : hot p50 {hot[0] * 1e6:.1f}us p99 {hot[1] * 1e6:.1f}us, "
+          f"sqlite p50 {cold[0] * 1e6:.1f}us p99 {cold[1] * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+消息原始 xml 常驻内存的开销：旧版（vendor_specific 中保存完整 xml 和 Hook 消息）对比新版
+（XmlSpool 压缩暂存、vendor_specific 只保存引用和精简字段），按主端保留全部消息计算每 1 万条的内存占用
+
+    python -m benchmarks.bench_xml_spool [--messages 10000] [--memory 16]
+"""
+import argparse
+import gc
+import json
+import tempfile
+import time
+import tracemalloc
+import types
+from pathlib import Path
+
+from ehforwarderbot import Message
+
+from efb_wechat_comwechat_slave.ChatMgr import ChatMgr
+from efb_wechat_comwechat_slave.MsgProcess import MsgWrapper
+from efb_wechat_comwechat_slave.XmlSpool import XmlSpool
+
+from .harness.corpus import Corpus, build_dataset
+
+MIX = {"text": 50, "share5": 10, "share19": 8, "share57": 10, "share2000": 2}
+
+
+def legacy_wrapper(msg, efb_msg: Message):
+    vendor_specific = getattr(efb_msg, "vendor_specific", {})
+    vendor_specific["wx_xml"] = msg.pop("message", None)
+    vendor_specific["comwechat_info"] = msg
+    efb_msg.vendor_specific = vendor_specific
+    return [efb_msg]
+
+
+def retained(wrap, encoded: list) -> tuple:
+    """返回 (保留全部消息时新增的内存, 耗时)，与 Hook 推送一样每条消息从 JSON 解出新的字符串"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    kept = [wrap(json.loads(data), Message()) for data in encoded]
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--memory", type=int, default=16, help="XmlSpool 内存上限（MB）")
+    args = parser.parse_args()
+
+    corpus = Corpus(build_dataset(), MIX, media_size=1024)
+    payloads = [sample.payload for sample in corpus.generate(args.messages)]
+    raw = sum(len(p["message"].encode("utf-8")) for p in payloads)
+    encoded = [json.dumps(p, ensure_ascii=False).encode("utf-8") for p in payloads]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = XmlSpool(Path(tmp) / "xml_spool.db", memory_limit=args.memory * 1024 * 1024, report_every=0)
+        ChatMgr.slave_channel = types.SimpleNamespace(xml_spool=spool)
+        before, before_time = retained(legacy_wrapper, encoded)
+        after, after_time = retained(MsgWrapper, encoded)
+        start = time.perf_counter()
+        for payload in payloads:
+            assert spool.get(str(payload["msgid"])) == payload["message"]
+        get_time = time.perf_counter() - start
+        stats = spool.stats()
+        spool.close()
+
+    per = 10000 / args.messages
+    print(f"{args.messages} messages, raw xml {raw / 1048576:.1f}MB")
+    print(f"legacy : {before * per / 1048576:7.1f}MB per 10k messages  ({before_time * 1000:.0f}ms)")
+    print(f"spool  : {after * per / 1048576:7.1f}MB per 10k messages  ({after_time * 1000:.0f}ms), "
+          f"saved {(before - after) * per / 1048576:.1f}MB")
+    print(f"         spool memory {stats['memory_bytes'] / 1048576:.1f}MB, compressed {stats['stored_bytes'] / max(stats['raw_bytes'], 1):.0%}, "
+          f"spilled {stats['spilled']}, get {get_time / args.messages * 1e6:.1f}us/msg")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""离线压测工具，见 __main__.py"""
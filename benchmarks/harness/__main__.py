@@ -0,0 +1,322 @@
+"""
+离线压测：ComWeChatChannel 对接本地 Hook 替身和桩主端，按给定速率回放合成消息，
+统计吞吐、各阶段耗时和峰值 RSS。不需要微信和网络。
+
+    python -m benchmarks.harness [--count 2000] [--rate 200] [--mix text=60,share19=20,image=20]
+                                 [--hook-latency 0.005] [--outbound 200] [--set inbound_workers=8]
+
+回放通道录制的日志（config.yaml 中 journal: true）代替合成消息：
+
+    python -m benchmarks.harness --journal path/to/comwechat-xxx.jsonl.gz [--speed 10]
+
+Hook 替身在独立进程中运行；RSS 为通道所在进程的峰值，不含 Hook 替身和转码进程。
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import yaml
+
+from .corpus import Corpus, Sample, build_dataset, parse_mix
+from .fake_hook import serve
+
+# 会投递到主端的事件，回放日志时只统计这些消息的端到端耗时
+DELIVERED_EVENTS = ("self_msg", "friend_msg", "group_msg", "transfer_msg")
+
+
+def quantiles(values: List[float]) -> str:
+    if not values:
+        return "-"
+    values = sorted(values)
+    pick = lambda q: values[max(int(q * len(values) + 0.5) - 1, 0)] * 1000
+    return f"{pick(0.5):.1f} / {pick(0.95):.1f} / {pick(0.99):.1f}"
+
+
+class Pusher:
+    """按 Hook 的方式把消息推送到 WeChatRobot 的 socket：一行 JSON，等待 200 OK"""
+
+    def __init__(self, port: int):
+        self.sock = socket.create_connection(("127.0.0.1", port))
+
+    def push(self, payload: Dict[str, Any]):
+        self.sock.sendall(json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n")
+        ack = b""
+        while not ack.endswith(b"200 OK"):
+            data = self.sock.recv(16)
+            if not data:
+                raise ConnectionError("message socket closed")
+            ack += data
+
+    def close(self):
+        self.sock.close()
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.root = Path(tempfile.mkdtemp(prefix="comwechat-bench-"))
+        self.wechat_dir = self.root / "wechat"
+        self.dataset = build_dataset(args.friends, args.groups, args.members, args.seed)
+        self.pushed: Dict[str, float] = {}
+        self.hook_process: Optional[multiprocessing.Process] = None
+
+    # 环境
+    def start_hook(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.hook_process = ctx.Process(target=serve, daemon=True,
+                                        args=(self.dataset, "127.0.0.1", self.args.hook_port, self.args.hook_latency))
+        self.hook_process.start()
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if not self.hook_process.is_alive():
+                raise RuntimeError(f"fake hook exited, is port {self.args.hook_port} in use?")
+            try:
+                self.hook_stats()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("fake hook did not start")
+
+    def hook_stats(self) -> Dict[str, Any]:
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.args.hook_port}/stats", timeout=5) as resp:
+            return json.loads(resp.read())
+
+    def write_config(self):
+        os.environ["EFB_DATA_PATH"] = str(self.root / "efb")
+        config = {
+            "dir": str(self.wechat_dir) + os.sep,
+            "base_path": str(self.wechat_dir),
+            "trace_buffer": (100000 if self.args.journal else self.args.count) + self.args.outbound,
+        }
+        for item in self.args.set:
+            key, _, value = item.partition("=")
+            config[key] = yaml.safe_load(value)
+        path = self.root / "efb" / "profiles" / "default" / "honus.comwechat" / "config.yaml"
+        path.parent.mkdir(parents=True)
+        path.write_text(yaml.safe_dump(config, allow_unicode=True), encoding="utf-8")
+        for sub in ("FileStorage/Image/bench", "FileStorage/Video/bench"):
+            (self.wechat_dir / self.dataset.self_wxid / sub).mkdir(parents=True, exist_ok=True)
+
+    def start_channel(self):
+        from ehforwarderbot import coordinator
+        from wechatrobot.Api import Api
+        from efb_wechat_comwechat_slave import ComWeChatChannel
+        from .master import StubMaster
+
+        Api.port = self.args.hook_port
+        coordinator.profile = "default"
+        self.master = StubMaster()
+        coordinator.add_channel(self.master)
+        started = time.perf_counter()
+        self.channel = ComWeChatChannel()
+        logging.getLogger("comwechat").setLevel(self.args.log_level)
+        coordinator.add_channel(self.channel)
+        self.channel.poll()
+        self.channel.get_directory()
+        self.startup = time.perf_counter() - started
+
+    def connect(self) -> Pusher:
+        deadline = time.monotonic() + 30
+        while not self.hook_stats()["msg_port"]:
+            if time.monotonic() > deadline:
+                raise RuntimeError("message hook was not started")
+            time.sleep(0.05)
+        # WeChatRobot.run 在 StartMsgHook 之后才开始监听
+        port = self.hook_stats()["msg_port"]
+        while True:
+            try:
+                return Pusher(port)
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    # 回放
+    def replay(self, samples: Iterable[Sample]):
+        pusher = self.connect()
+        interval = 1 / self.args.rate if self.args.rate else 0
+        start = time.perf_counter()
+        for i, sample in enumerate(samples):
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if sample.media is not None:
+                self.write_media(*sample.media)
+            payload = dict(sample.payload)
+            payload["timestamp"] = time.time()
+            self.pushed[str(payload["msgid"])] = time.perf_counter()
+            pusher.push(payload)
+        self.push_seconds = time.perf_counter() - start
+        pusher.close()
+
+    def replay_journal(self):
+        """经 wechatrobot 的事件总线回放录制的日志，与真实 Hook 回调走同一路径"""
+        from wechatrobot.WeChatRobot import Bus
+        from efb_wechat_comwechat_slave.Journal import replay
+
+        def emit(event: str, msg: Dict[str, Any]):
+            # 以回放时刻作为 Hook 收到消息的时间
+            msg["timestamp"] = time.time()
+            if event in DELIVERED_EVENTS:
+                self.pushed[str(msg["msgid"])] = time.perf_counter()
+            Bus.emit(event, msg)
+
+        start = time.perf_counter()
+        replay(self.args.journal, emit, media_root=self.wechat_dir, speed=self.args.speed)
+        self.push_seconds = time.perf_counter() - start
+
+    def write_media(self, relpath: str, content: bytes):
+        path = self.wechat_dir / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        def write():
+            with open(path, "wb") as f:
+                f.write(content)
+
+        if self.args.media_delay > 0:
+            # 模拟微信在消息之后才写完文件
+            threading.Timer(self.args.media_delay, write).start()
+        else:
+            write()
+
+    def drain(self) -> float:
+        """等待全部消息投递到主端，超过 drain_timeout 秒没有新进展时放弃"""
+        expected = set(self.pushed)
+        while True:
+            delivered, last = self.master.progress()
+            if expected <= delivered:
+                break
+            if time.monotonic() - last > self.args.drain_timeout:
+                break
+            time.sleep(0.05)
+        return max(self.master.delivered.values(), default=time.perf_counter())
+
+    def send_outbound(self) -> List[float]:
+        from ehforwarderbot import Message, MsgType, coordinator
+        latencies = []
+        chats = self.channel.get_chats()
+        for i in range(self.args.outbound):
+            chat = chats[i % len(chats)]
+            msg = Message(chat=chat, author=chat.self, type=MsgType.Text, text=f"bench {i}",
+                          uid=f"bench-out-{i}", deliver_to=self.channel)
+            start = time.perf_counter()
+            coordinator.send_message(msg)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    # 结果
+    def report(self, finished: float, outbound: List[float]) -> Dict[str, Any]:
+        delivered = self.master.delivered
+        e2e = [delivered[uid] - t for uid, t in self.pushed.items() if uid in delivered]
+        first = min(self.pushed.values(), default=finished)
+        elapsed = max(finished - first, 1e-9)
+        result = {
+            "startup_seconds": self.startup,
+            "pushed": len(self.pushed),
+            "push_seconds": self.push_seconds,
+            "delivered": len(e2e),
+            "master_messages": self.master.count,
+            "throughput": len(e2e) / elapsed,
+            "end_to_end": e2e,
+            "stages": self.channel.tracer.summary(),
+            "outbound": outbound,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "master_types": dict(self.master.types),
+            "hook_calls": self.hook_stats()["calls"],
+            "rpc": self.channel.bot.stats(),
+            "media": self.channel.media_watcher.stats(),
+            "transcode": self.channel.transcoder.stats(),
+        }
+        print(f"startup       {result['startup_seconds']:.2f}s")
+        print(f"pushed        {result['pushed']} in {result['push_seconds']:.2f}s")
+        print(f"delivered     {result['delivered']}/{result['pushed']} ({result['master_messages']} master messages)")
+        print(f"throughput    {result['throughput']:.1f} msg/s")
+        print(f"end-to-end    {quantiles(e2e)} ms (p50 / p95 / p99)")
+        if outbound:
+            print(f"outbound      {quantiles(outbound)} ms over {len(outbound)} messages")
+        print(f"peak RSS      {result['peak_rss_mb']:.1f} MB")
+        print(self.channel.tracer.report())
+        print(f"master types  {result['master_types']}")
+        print(f"hook calls    {result['hook_calls']}")
+        missing = len(self.pushed) - len(e2e)
+        if missing:
+            print(f"undelivered   {missing}")
+        return result
+
+    def stop(self):
+        channel = getattr(self, "channel", None)
+        if channel is not None:
+            channel.transcoder.close()
+            if channel.journal is not None:
+                channel.journal.close()
+        if self.hook_process is not None and self.hook_process.is_alive():
+            self.hook_process.terminate()
+            self.hook_process.join(5)
+
+    def run(self) -> Dict[str, Any]:
+        self.start_hook()
+        self.write_config()
+        self.start_channel()
+        if self.args.journal:
+            self.replay_journal()
+        else:
+            corpus = Corpus(self.dataset, parse_mix(self.args.mix), self.args.seed, self.args.media_size)
+            self.replay(corpus.generate(self.args.count))
+        finished = self.drain()
+        outbound = self.send_outbound()
+        return self.report(finished, outbound)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.harness")
+    parser.add_argument("--count", type=int, default=2000, help="回放的入站消息数")
+    parser.add_argument("--rate", type=float, default=200, help="每秒推送的消息数，0 为不限速")
+    parser.add_argument("--mix", default=None, help="消息类型权重，如 text=60,share19=20,image=20")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--friends", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--members", type=int, default=100)
+    parser.add_argument("--media-size", type=int, default=256 * 1024)
+    parser.add_argument("--media-delay", type=float, default=0.05, help="消息推送后多久写入媒体文件（秒）")
+    parser.add_argument("--hook-port", type=int, default=18888)
+    parser.add_argument("--hook-latency", type=float, default=0.0, help="Hook 替身每次调用的附加延迟（秒）")
+    parser.add_argument("--journal", help="回放录制的日志而不是合成消息")
+    parser.add_argument("--speed", type=float, default=1.0, help="日志回放倍速，0 为不等待")
+    parser.add_argument("--outbound", type=int, default=0, help="回放结束后经 send_message 发出的文本消息数")
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="覆盖通道配置项")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+    logging.getLogger().setLevel(args.log_level)
+    bench = Bench(args)
+    status = 1
+    try:
+        result = bench.run()
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2, default=str)
+        status = 0
+    finally:
+        bench.stop()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # 通道的轮询、转码等线程没有停止接口，直接退出
+        os._exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+合成的 Hook 推送消息（group_msg / friend_msg 原始格式，type 为数字），
+包括文本、share（appmsg type 5/19/57/2000）、图片、语音、视频，媒体文件内容随消息一起生成
+"""
+import io
+import math
+import os
+import random
+import struct
+import tempfile
+import time
+from typing import Any, Dict, Iterator, NamedTuple, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from .fake_hook import Dataset
+
+SELF_WXID = "wxid_bench_self"
+
+# Hook 原始消息类型
+RAW_TYPES = {"text": 1, "image": 3, "voice": 34, "video": 43, "share": 49}
+
+DEFAULT_MIX = {"text": 50, "share5": 10, "share19": 8, "share57": 10, "share2000": 2, "image": 10, "voice": 5, "video": 5}
+
+IMAGE_XOR_KEY = 0x5a
+
+
+class Sample(NamedTuple):
+    payload: Dict[str, Any]
+    media: Optional[Tuple[str, bytes]]      # (相对 dir 的路径, 文件内容)
+
+
+def build_dataset(friends: int = 200, groups: int = 50, members: int = 100, seed: int = 0) -> Dataset:
+    rnd = random.Random(seed)
+    contacts = {}
+    for i in range(friends):
+        contacts[f"wxid_friend{i}"] = {"alias": f"friend{i}", "remark": f"备注{i}" if i % 3 == 0 else "",
+                                       "nickname": f"好友{i}", "type": 3}
+    rooms = {}
+    for g in range(groups):
+        room = f"{1000000 + g}@chatroom"
+        contacts[room] = {"alias": "", "remark": "", "nickname": f"群聊{g}", "type": 2}
+        rooms[room] = {f"wxid_member{rnd.randrange(friends * 10)}": (f"群昵称{m}" if m % 4 == 0 else "")
+                       for m in range(members)}
+    return Dataset(SELF_WXID, contacts, rooms)
+
+
+def parse_mix(text: Optional[str]) -> Dict[str, int]:
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in DEFAULT_MIX:
+            raise ValueError(f"unknown message kind {kind}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[kind] = int(weight or 1)
+    return mix
+
+
+class Corpus:
+    def __init__(self, dataset: Dataset, mix: Dict[str, int], seed: int = 0, media_size: int = 256 * 1024):
+        self.dataset = dataset
+        self.mix = mix
+        self.rnd = random.Random(seed)
+        self.media_size = media_size
+        self._msgid = 7000000000000000000
+        self._jpeg = make_jpeg(media_size)
+        self._silk = make_silk()
+        self._friends = [w for w, c in dataset.contacts.items() if c["type"] == 3]
+        self._rooms = list(dataset.groups)
+
+    def generate(self, count: int) -> Iterator[Sample]:
+        kinds = list(self.mix)
+        weights = [self.mix[k] for k in kinds]
+        for _ in range(count):
+            yield self.sample(self.rnd.choices(kinds, weights)[0])
+
+    def sample(self, kind: str) -> Sample:
+        self._msgid += 1
+        if self.rnd.random() < 0.7:
+            sender = self.rnd.choice(self._rooms)
+            wxid = self.rnd.choice(list(self.dataset.groups[sender]) + ["wxid_newcomer%d" % self.rnd.randrange(50)])
+        else:
+            sender = wxid = self.rnd.choice(self._friends)
+        payload = {
+            "pid": 0,
+            "msgid": self._msgid,
+            "sender": sender,
+            "wxid": wxid,
+            "self": SELF_WXID,
+            "isSendMsg": 0,
+            "isSendByPhone": 0,
+            "extrainfo": "",
+            "filepath": "",
+            "thumb_path": "",
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        media = None
+        base = kind.rstrip("0123456789") if kind.startswith("share") else kind
+        payload["type"] = RAW_TYPES[base]
+        if kind == "text":
+            payload["message"] = self.text()
+            if "@chatroom" in sender and self.rnd.random() < 0.1:
+                payload["extrainfo"] = f"<msgsource><atuserlist>{SELF_WXID}</atuserlist></msgsource>"
+        elif kind.startswith("share"):
+            payload["message"] = getattr(self, f"appmsg_{kind[5:]}")(sender)
+        elif kind == "image":
+            path = f"{SELF_WXID}\\FileStorage\\Image\\bench\\{self._msgid}.dat"
+            payload["message"] = '<msg><img length="%d" /></msg>' % self.media_size
+            payload["filepath"] = path
+            media = (path.replace("\\", "/"), self._jpeg)
+        elif kind == "voice":
+            payload["message"] = f'<msg><voicemsg clientmsgid="bench{self._msgid}" voicelength="3000" /></msg>'
+            media = (f"{SELF_WXID}/bench{self._msgid}.amr", self._silk)
+        elif kind == "video":
+            thumb = f"{SELF_WXID}\\FileStorage\\Video\\bench\\{self._msgid}.jpg"
+            payload["message"] = '<msg><videomsg length="%d" /></msg>' % self.media_size
+            payload["thumb_path"] = thumb
+            media = (thumb.replace("\\", "/").replace(".jpg", ".mp4"), make_mp4(self.media_size))
+        return Sample(payload, media)
+
+    def text(self) -> str:
+        words = ["收到", "好的", "今天", "开会", "[微笑]", "[捂脸]", "哈哈", "ok", "明天见", "https://example.com/a"]
+        return " ".join(self.rnd.choice(words) for _ in range(self.rnd.randrange(1, 30)))
+
+    def appmsg_5(self, sender: str) -> str:
+        return (f'<msg><appmsg appid="" sdkver="0"><title>{escape(self.text()[:60])}</title><des>{escape(self.text())}</des>'
+                f'<type>5</type><showtype>0</showtype><url>https://mp.weixin.qq.com/s/{self._msgid}</url>'
+                f'<thumburl>https://mmbiz.qpic.cn/{self._msgid}.jpg</thumburl>'
+                f'<sourceusername>gh_bench</sourceusername><sourcedisplayname>基准公众号</sourcedisplayname></appmsg>'
+                f'<appinfo><version>1</version><appname>微信</appname></appinfo></msg>')
+
+    def appmsg_19(self, sender: str) -> str:
+        items = []
+        for i in range(self.rnd.randrange(3, 40)):
+            datatype = self.rnd.choice(["1", "1", "1", "2", "5"])
+            items.append(f'<dataitem datatype="{datatype}" dataid="{i}"><datadesc>{escape(self.text())}</datadesc>'
+                         f'<datatitle>标题{i}</datatitle><sourcename>好友{i % 7}</sourcename>'
+                         f'<sourcetime>2024-01-01 10:{i % 60:02d}</sourcetime></dataitem>')
+        record = f'<recordinfo><title>群聊的聊天记录</title><datalist count="{len(items)}">{"".join(items)}</datalist></recordinfo>'
+        return (f'<msg><appmsg appid="" sdkver="0"><title>群聊的聊天记录</title><des>聊天记录</des><type>19</type>'
+                f'<recorditem>{escape(record)}</recorditem></appmsg></msg>')
+
+    def appmsg_57(self, sender: str) -> str:
+        refer = escape(self.text())
+        return (f'<msg><appmsg appid="" sdkver="0"><title>{escape(self.text()[:80])}</title><type>57</type>'
+                f'<refermsg><type>1</type><svrid>{self._msgid - 1}</svrid><fromusr>{sender}</fromusr>'
+                f'<chatusr>{SELF_WXID}</chatusr><displayname>bench</displayname><content>{refer}</content></refermsg>'
+                f'</appmsg></msg>')
+
+    def appmsg_2000(self, sender: str) -> str:
+        return ('<msg><appmsg appid="" sdkver=""><title>微信转账</title><type>2000</type>'
+                '<wcpayinfo><paysubtype>3</paysubtype><feedesc><![CDATA[￥0.01]]></feedesc></wcpayinfo>'
+                '</appmsg></msg>')
+
+
+def make_jpeg(size: int) -> bytes:
+    """噪声 JPEG，按微信 .dat 格式异或"""
+    from PIL import Image
+    side = max(16, int(math.sqrt(size / 3)))
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=95)
+    return bytes(b ^ IMAGE_XOR_KEY for b in buf.getvalue())
+
+
+def make_mp4(size: int) -> bytes:
+    # ftyp 头足以让 libmagic 识别为 video/mp4，其余为随机数据
+    ftyp = struct.pack(">I4s4sI8s", 24, b"ftyp", b"isom", 512, b"isomiso2")
+    return ftyp + os.urandom(max(size - len(ftyp), 0))
+
+
+def make_silk(seconds: float = 3.0) -> bytes:
+    """3 秒正弦波编码为腾讯 silk，没有 pilk 时返回占位数据（转码失败，走文本提示）"""
+    try:
+        import pilk
+    except ImportError:
+        return b"\x02#!SILK_V3" + os.urandom(4096)
+    rate = 24000
+    pcm = b"".join(struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / rate))) for i in range(int(rate * seconds)))
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = os.path.join(tmp, "a.pcm"), os.path.join(tmp, "a.silk")
+        with open(src, "wb") as f:
+            f.write(pcm)
+        pilk.encode(src, dst, pcm_rate=rate, tencent=True)
+        with open(dst, "rb") as f:
+            return f.read()
+
@@ -0,0 +1,152 @@
+"""
+ComWeChatRobot Hook HTTP 接口（/api/?type=N）的本地替身，返回固定的联系人、群成员数据，
+发送类接口只计数，可选地为每次调用增加固定延迟以模拟真实 Hook 的耗时
+"""
+import base64
+import collections
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from wechatrobot import ChatRoomData_pb2
+
+IS_LOGIN = 0
+GET_SELF_INFO = 1
+START_MSG_HOOK = 9
+GET_CHATROOM_MEMBER_LIST = 25
+GET_CHATROOM_MEMBER_NICKNAME = 26
+GET_DB_HANDLES = 32
+QUERY_DATABASE = 34
+
+DB_HANDLES = {"MicroMsg.db": "1", "OpenIMContact.db": "2", "MediaMSG0.db": "3"}
+CONTACT_HEADER = ["UserName", "Alias", "Remark", "NickName", "Type"]
+
+
+class Dataset:
+    """联系人与群成员"""
+
+    def __init__(self, self_wxid: str, contacts: Dict[str, Dict[str, Any]], groups: Dict[str, Dict[str, str]]):
+        self.self_wxid = self_wxid
+        self.contacts = contacts        # {wxid : {alias, remark, nickname, type}}
+        self.groups = groups            # {room : {wxid : displayName}}
+        self._room_data = {room: encode_room_data(members) for room, members in groups.items()}
+
+    def contact_row(self, wxid: str) -> List[Any]:
+        c = self.contacts[wxid]
+        return [wxid, c["alias"], c["remark"], c["nickname"], c["type"]]
+
+    def query(self, handle: str, sql: str) -> List[List[Any]]:
+        if handle == DB_HANDLES["OpenIMContact.db"]:
+            return [CONTACT_HEADER]
+        if handle == DB_HANDLES["MediaMSG0.db"]:
+            return [["Reserved0", "Buf"]]
+        if "from ChatRoom" in sql:
+            rows: List[List[Any]] = [["ChatRoomName", "RoomData"]]
+            match = re.search(r"ChatRoomName='(.*?)'", sql)
+            rooms = [match.group(1)] if match else list(self._room_data)
+            rows.extend([room, self._room_data[room]] for room in rooms if room in self._room_data)
+            return rows
+        if "from Contact" in sql:
+            match = re.search(r"UserName\s*=\s*'(.*?)'", sql)
+            if match:
+                wxids = [match.group(1)]
+            else:
+                match = re.search(r"UserName in \((.*?)\)", sql)
+                wxids = re.findall(r"'(.*?)'", match.group(1)) if match else list(self.contacts)
+            columns = re.search(r"select (.*?) from", sql, re.I).group(1).split(",")
+            rows = [columns]
+            for wxid in wxids:
+                if wxid in self.contacts:
+                    row = dict(zip(CONTACT_HEADER, self.contact_row(wxid)))
+                    rows.append([row.get(c.strip(), "") for c in columns])
+            return rows
+        return [[]]
+
+
+def encode_room_data(members: Dict[str, str]) -> str:
+    room = ChatRoomData_pb2.ChatRoomData()
+    for wxid, display_name in members.items():
+        member = room.members.add()
+        member.wxID = wxid
+        member.displayName = display_name
+    return base64.b64encode(room.SerializeToString()).decode()
+
+
+class FakeHook:
+    def __init__(self, dataset: Dataset, host: str = "127.0.0.1", port: int = 18888, latency: float = 0.0):
+        self.dataset = dataset
+        self.latency = latency
+        self.calls: Dict[int, int] = collections.Counter()
+        self.msg_port: Optional[int] = None
+        self._lock = threading.Lock()
+        hook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                api_type = int(parse_qs(urlparse(self.path).query).get("type", ["-1"])[0])
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                try:
+                    params = json.loads(body or b"{}")
+                except ValueError:
+                    params = {}
+                data = json.dumps(hook.handle(api_type, params), ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                # 基准进程通过 /stats 读取调用计数和消息推送端口
+                data = json.dumps({"calls": hook.calls, "msg_port": hook.msg_port}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def handle(self, api_type: int, params: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.calls[api_type] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        ok = {"msg": 1, "result": "OK"}
+        if api_type == IS_LOGIN:
+            return {"is_login": 1, "result": "OK"}
+        if api_type == GET_SELF_INFO:
+            return {"data": {"wxId": self.dataset.self_wxid, "wxNickName": "bench", "wxNumber": "bench"}, "result": "OK"}
+        if api_type == START_MSG_HOOK:
+            self.msg_port = int(params.get("port", 0))
+            return ok
+        if api_type == GET_DB_HANDLES:
+            return {"data": [{"db_name": name, "handle": handle} for name, handle in DB_HANDLES.items()], "result": "OK"}
+        if api_type == QUERY_DATABASE:
+            return {"data": self.dataset.query(str(params.get("db_handle")),params.get("sql", "")), "result": "OK"}
+        if api_type == GET_CHATROOM_MEMBER_LIST:
+            members = self.dataset.groups.get(params.get("chatroom_id"), {})
+            return {"members": "^G".join(members), "result": "OK"}
+        if api_type == GET_CHATROOM_MEMBER_NICKNAME:
+            wxid = params.get("wxid")
+            return {"nickname": self.dataset.groups.get(params.get("chatroom_id"), {}).get(wxid, wxid), "result": "OK"}
+        return ok
+
+
+def serve(dataset: Dataset, host: str, port: int, latency: float):
+    """在独立进程中运行，避免与被测通道争用 GIL、计入其内存"""
+    FakeHook(dataset, host, port, latency).serve_forever()
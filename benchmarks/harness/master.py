@@ -0,0 +1,50 @@
+"""
+桩主端：只记录收到的消息和到达时间
+"""
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Set, Tuple
+
+from ehforwarderbot import Chat, Message, Status
+from ehforwarderbot.channel import MasterChannel
+from ehforwarderbot.types import MessageID, ModuleID
+
+
+class StubMaster(MasterChannel):
+    channel_name = "Benchmark master"
+    channel_emoji = "📊"
+    channel_id = ModuleID("bench.master")
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self.delivered: Dict[str, float] = {}       # {消息 uid : 首次到达的 perf_counter}
+        self.types: Counter = Counter()
+        self.count = 0
+        self.last_progress = time.monotonic()
+
+    def send_message(self, msg: Message) -> Message:
+        now = time.perf_counter()
+        with self._lock:
+            self.delivered.setdefault(str(msg.uid), now)
+            self.types[msg.type.name] += 1
+            self.count += 1
+            self.last_progress = time.monotonic()
+        return msg
+
+    def progress(self) -> Tuple[Set[str], float]:
+        with self._lock:
+            return set(self.delivered), self.last_progress
+
+    def send_status(self, status: Status):
+        pass
+
+    def poll(self):
+        pass
+
+    def stop_polling(self):
+        pass
+
+    def get_message_by_id(self, chat: Chat, msg_id: MessageID) -> Optional[Message]:
+        return None
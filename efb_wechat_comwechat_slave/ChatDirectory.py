@@ -0,0 +1,122 @@
+# coding: utf-8
+import base64
+import logging
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from ehforwarderbot import Chat
+from wechatrobot import ChatRoomData_pb2
+
+logger = logging.getLogger(__name__)
+
+ContactRecord = Tuple[str, str, int]     # (nickname, remark, type)
+
+
+class DirectoryChanges(NamedTuple):
+    added: List[str]
+    removed: List[str]
+    renamed: List[Tuple[str, str, str]]  # (uid, 旧名称, 新名称)
+
+
+def display_name(nickname: str, remark: str) -> str:
+    return f"{remark}({nickname})" if remark else nickname
+
+
+def parse_room_data(room_data: str) -> Dict[str, str]:
+    """
+    解析 ChatRoom 表的 RoomData 字段
+    :return: {wxid : 群昵称}，未设置群昵称的成员对应空字符串
+    """
+    chatroom = ChatRoomData_pb2.ChatRoomData()
+    chatroom.ParseFromString(base64.b64decode(room_data))
+    return {member.wxID: member.displayName for member in chatroom.members}
+
+
+class ChatDirectory:
+    """
+    联系人目录快照：以 uid 为主键，附带显示名与备注两个二级索引。
+    快照构建完成后不再修改，刷新时整体替换，读者始终看到完整的一份。
+    """
+
+    __slots__ = ("chats", "contacts", "friends", "groups", "by_name", "by_remark", "remarks", "records")
+
+    def __init__(self, chats: Optional[Dict[str, Chat]] = None,
+                 contacts: Optional[Dict[str, str]] = None,
+                 remarks: Optional[Dict[str, str]] = None,
+                 records: Optional[Dict[str, ContactRecord]] = None):
+        """
+        :param chats: {uid : Chat}，可以收发消息的好友与群聊
+        :param contacts: {wxid : 显示名}，包含不可聊天的联系人
+        :param remarks: {wxid : 备注}，仅包含有备注的联系人
+        :param records: {wxid : (昵称, 备注, 类型)}，用于下次刷新时比对
+        """
+        self.chats: Dict[str, Chat] = chats or {}
+        self.contacts: Dict[str, str] = contacts or {}
+        self.remarks: Dict[str, str] = remarks or {}
+        self.records: Dict[str, ContactRecord] = records or {}
+        self.groups: List[Chat] = [chat for uid, chat in self.chats.items() if "@chatroom" in uid]
+        self.friends: List[Chat] = [chat for uid, chat in self.chats.items() if "@chatroom" not in uid]
+        self.by_name: Dict[str, Tuple[str, ...]] = self._index(self.contacts)
+        self.by_remark: Dict[str, Tuple[str, ...]] = self._index(self.remarks)
+
+    @staticmethod
+    def _index(mapping: Dict[str, str]) -> Dict[str, Tuple[str, ...]]:
+        index: Dict[str, Tuple[str, ...]] = {}
+        for uid, key in mapping.items():
+            if key:
+                index[key] = index.get(key, ()) + (uid,)
+        return index
+
+    def __bool__(self) -> bool:
+        return bool(self.chats)
+
+    def __len__(self) -> int:
+        return len(self.chats)
+
+    def get(self, uid: str) -> Optional[Chat]:
+        return self.chats.get(uid)
+
+    def name_of(self, wxid: str) -> Optional[str]:
+        """返回联系人显示名，不在目录中时返回 None"""
+        return self.contacts.get(wxid)
+
+    def find_by_name(self, name: str) -> List[Chat]:
+        return [self.chats[uid] for uid in self.by_name.get(name, ()) if uid in self.chats]
+
+    def find_by_remark(self, remark: str) -> List[Chat]:
+        return [self.chats[uid] for uid in self.by_remark.get(remark, ()) if uid in self.chats]
+
+    def update(self, contacts: Dict[str, Dict[str, Any]],
+               build: Callable[[str, str], Chat]) -> Tuple['ChatDirectory', DirectoryChanges]:
+        """
+        以当前快照为基准合并新的联系人列表，昵称、备注、类型均未变化的聊天沿用原对象。
+        :param contacts: WeChatRobot.GetContactListBySql 的返回值
+        :param build: 构建聊天对象的回调 (uid, name) -> Chat
+        :return: 新快照及变更记录
+        """
+        chats: Dict[str, Chat] = {}
+        names: Dict[str, str] = {}
+        remarks: Dict[str, str] = {}
+        records: Dict[str, ContactRecord] = {}
+        added: List[str] = []
+        renamed: List[Tuple[str, str, str]] = []
+        for uid, data in contacts.items():
+            record = (data["nickname"], data["remark"], data["type"])
+            name = display_name(data["nickname"], data["remark"])
+            names[uid] = name
+            records[uid] = record
+            if data["remark"]:
+                remarks[uid] = data["remark"]
+            if data["type"] == 0 or data["type"] == 4:
+                continue
+
+            chat = self.chats.get(uid)
+            if chat is None:
+                added.append(uid)
+                chat = build(uid, name)
+            elif self.records.get(uid) != record:
+                if self.contacts.get(uid) != name:
+                    renamed.append((uid, self.contacts.get(uid), name))
+                chat = build(uid, name)
+            chats[uid] = chat
+        removed = [uid for uid in self.chats if uid not in chats]
+        return ChatDirectory(chats, names, remarks, records), DirectoryChanges(added, removed, renamed)
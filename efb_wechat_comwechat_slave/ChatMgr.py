@@ -1,10 +1,12 @@
 # coding: utf-8
 import contextlib
 import logging
-from typing import Dict, Optional, List
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, List, Tuple
 
 from ehforwarderbot.channel import SlaveChannel
-from ehforwarderbot.chat import GroupChat, PrivateChat, ChatMember, SystemChat
+from ehforwarderbot.chat import Chat, GroupChat, PrivateChat, ChatMember, SystemChat
 
 from .CustomTypes import EFBGroupChat, EFBGroupMember, EFBPrivateChat, EFBSystemUser
 
@@ -14,57 +16,133 @@ logger = logging.getLogger(__name__)
 class ChatMgr:
     slave_channel = None
 
+    # 聊天对象驻留缓存：同一聊天的消息复用同一个对象，成员按 uid 建索引
+    cache_size: int = 2048
+    hits: int = 0
+    misses: int = 0
+    _lock = threading.RLock()
+    _chats: "OrderedDict[Tuple[Hashable, ...], Chat]" = OrderedDict()
+    _members: Dict[int, Dict[str, ChatMember]] = {}     # id(chat) -> {member uid : ChatMember}
+
     @staticmethod
     def build_efb_chat_as_group(group: EFBGroupChat,
-                                members: Optional[List[EFBGroupMember]] = None) -> GroupChat:
+                                members: Optional[List[EFBGroupMember]] = None,
+                                vendor_specific: Optional[Dict[str, Any]] = None) -> GroupChat:
         """
         Build EFB GroupChat object from EFBGroupChat Dict
         :return: GroupChat from group_id
         :param group: EFBGroupChat object, see CustomTypes.py
         :param members: Optional, the member list for the specific group, None by default
                         Each object in members (if not None) must follow the syntax of GroupChat.add_members
+        :param vendor_specific: Optional, vendor specific attributes of the chat
         """
-        efb_chat: GroupChat = GroupChat(
-            channel=ChatMgr.slave_channel,
-            **group
-        )
-        if members:
-            for member in members:
-                efb_chat.add_member(
-                    **member
-                )
+        with ChatMgr._lock:
+            efb_chat: GroupChat = ChatMgr._intern(GroupChat, group, vendor_specific)
+            if members:
+                for member in members:
+                    ChatMgr.build_efb_chat_as_member(efb_chat, member)
         return efb_chat
 
     @staticmethod
-    def build_efb_chat_as_private(private: EFBPrivateChat) -> PrivateChat:
+    def build_efb_chat_as_private(private: EFBPrivateChat,
+                                  vendor_specific: Optional[Dict[str, Any]] = None) -> PrivateChat:
         """
         Build EFB PrivateChat object from EFBPrivateChat
         :return: GroupChat from group_id
         :param private: EFBPrivateChat object, see CustomTypes.py
+        :param vendor_specific: Optional, vendor specific attributes of the chat
         """
-        efb_chat: PrivateChat = PrivateChat(
-            channel=ChatMgr.slave_channel,
-            **private
-        )
-        return efb_chat
+        with ChatMgr._lock:
+            return ChatMgr._intern(PrivateChat, private, vendor_specific)
 
     @staticmethod
     def build_efb_chat_as_member(chat: GroupChat, member: EFBGroupMember) -> ChatMember:
         """
         Build EFB ChatMember object from GroupChat and EFBGroupMember.
         It'll try to get member from GroupChat, if one is not found then a new member is added.
+        A member whose name or alias has changed is replaced.
         :param chat: Original GroupChat
         :param member: EFBGroupMember object, see CustomTypes.py
         :return: Newly built ChatMember
         """
-        with contextlib.suppress(KeyError):
-            return chat.get_member(str(member.get('uid', '')))
-        efb_chat: ChatMember = chat.add_member(
-            **member
-        )
-        return efb_chat
+        uid = str(member.get('uid', ''))
+        with ChatMgr._lock:
+            index = ChatMgr._members.get(id(chat))
+            if index is None:
+                # 未经驻留的聊天对象，退回线性查找
+                with contextlib.suppress(KeyError):
+                    return chat.get_member(uid)
+                return chat.add_member(**member)
+            existing = index.get(uid)
+            if existing is not None:
+                if existing.name == member.get('name', existing.name) and \
+                        existing.alias == member.get('alias', existing.alias):
+                    return existing
+                chat.members.remove(existing)
+            efb_chat: ChatMember = chat.add_member(
+                **member
+            )
+            index[uid] = efb_chat
+            return efb_chat
 
     @staticmethod
     def build_efb_chat_as_system_user(chat: EFBSystemUser):
         return SystemChat(channel=ChatMgr.slave_channel,
-                          **chat)
\ No newline at end of file
+                          **chat)
+
+    @staticmethod
+    def invalidate(uid: Optional[str] = None, keep_name: Optional[str] = None):
+        """
+        移除驻留的聊天对象，uid 为 None 时清空全部。
+        联系人刷新发现删除或改名时调用；改名时传入 keep_name，只移除旧名称的对象，保留已按新名称驻留的对象。
+        """
+        with ChatMgr._lock:
+            if uid is None:
+                ChatMgr._chats.clear()
+                ChatMgr._members.clear()
+                return
+            for key in [key for key in ChatMgr._chats if key[1] == uid and (keep_name is None or key[2] != keep_name)]:
+                ChatMgr._evict(key)
+
+    @staticmethod
+    def stats() -> Dict[str, int]:
+        return {
+            "size": len(ChatMgr._chats),
+            "hits": ChatMgr.hits,
+            "misses": ChatMgr.misses,
+        }
+
+    @staticmethod
+    def _intern(chat_type: type, chat: Dict[str, Any], vendor_specific: Optional[Dict[str, Any]]) -> Chat:
+        flags = tuple(sorted(vendor_specific.items())) if vendor_specific else ()
+        key = (chat_type.__name__, chat.get('uid'), chat.get('name'), chat.get('alias'), flags)
+        try:
+            efb_chat = ChatMgr._chats[key]
+        except (KeyError, TypeError):
+            efb_chat = None
+        if efb_chat is not None:
+            ChatMgr._chats.move_to_end(key)
+            ChatMgr.hits += 1
+            return efb_chat
+
+        ChatMgr.misses += 1
+        efb_chat = chat_type(
+            channel=ChatMgr.slave_channel,
+            vendor_specific=dict(vendor_specific or {}),
+            **chat
+        )
+        try:
+            ChatMgr._chats[key] = efb_chat
+        except TypeError:
+            # vendor_specific 中含不可哈希的值，不做驻留
+            return efb_chat
+        ChatMgr._members[id(efb_chat)] = {member.uid: member for member in efb_chat.members}
+        while len(ChatMgr._chats) > ChatMgr.cache_size:
+            ChatMgr._evict(next(iter(ChatMgr._chats)))
+        return efb_chat
+
+    @staticmethod
+    def _evict(key: Tuple[Hashable, ...]):
+        efb_chat = ChatMgr._chats.pop(key, None)
+        if efb_chat is not None:
+            ChatMgr._members.pop(id(efb_chat), None)
@@ -0,0 +1,67 @@
+# coding: utf-8
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CleanupScheduler:
+    """
+    延迟清理任务调度：按到期时间排序的最小堆，由独立线程在最早到期时刻唤醒执行。
+    同一 key 重复调度时以最后一次为准，取消的任务在出堆时丢弃。
+    """
+
+    def __init__(self, name: str = "cleanup"):
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._tasks: Dict[Hashable, Tuple[int, Callable[[], None]]] = {}
+        self._seq = itertools.count()
+
+        self.executed = 0
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[], None]):
+        with self._cond:
+            seq = next(self._seq)
+            self._tasks[key] = (seq, callback)
+            heapq.heappush(self._heap, (time.monotonic() + delay, seq, key))
+            self._cond.notify()
+
+    def cancel(self, key: Hashable) -> bool:
+        with self._cond:
+            return self._tasks.pop(key, None) is not None
+
+    def _run(self):
+        while True:
+            callback = self._next()
+            try:
+                callback()
+                self.executed += 1
+            except Exception as e:
+                logger.exception(f"cleanup task failed: {e}")
+
+    def _next(self) -> Callable[[], None]:
+        with self._cond:
+            while True:
+                while self._heap and self._tasks.get(self._heap[0][2], (None,))[0] != self._heap[0][1]:
+                    # 已取消或已被重新调度
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, key = self._heap[0]
+                timeout = deadline - time.monotonic()
+                if timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+                heapq.heappop(self._heap)
+                return self._tasks.pop(key)[1]
@@ -1,8 +1,8 @@
 import logging, tempfile
 import time
 import threading
+import functools
 from traceback import print_exc
-from pydub import AudioSegment
 import qrcode
 from pyzbar.pyzbar import decode as pyzbar_decode
 import os
@@ -31,11 +31,27 @@ from ehforwarderbot.message import MessageCommand, MessageCommands
 from ehforwarderbot.status import MessageRemoval
 
 from .ChatMgr import ChatMgr
+from .ChatDirectory import ChatDirectory, parse_room_data
 from .CustomTypes import EFBGroupChat, EFBPrivateChat, EFBGroupMember, EFBSystemUser
-from .MsgDeco import qutoed_text
+from .MsgDeco import qutoed_text, parse_chat_history, format_chat_history, CHAT_HISTORY_MAX_ITEMS, CHAT_HISTORY_MAX_DEPTH
 from .MsgProcess import MsgProcess, MsgWrapper
-from .Utils import download_file , load_config , load_temp_file_to_local , WC_EMOTICON_CONVERSION
+from .Utils import download_file , load_config , EMOTICON_TRANSLATOR
 from .Constant import QUOTE_MESSAGE
+from .MediaWatcher import MediaWatcher
+from .Dispatcher import InboundDispatcher
+from .Transcoder import Transcoder
+from .NameResolver import NameResolver
+from .MediaDB import MediaDB
+from .Staging import InboundStager, OutboundStager
+from .CleanupScheduler import CleanupScheduler
+from .RpcProxy import InstrumentedBot, DEFAULT_TIMEOUTS
+from .Metrics import REGISTRY, MetricsServer
+from .Journal import JournalWriter
+from .EventXml import EventXml, attribute_pattern
+from .XmlSpool import XmlSpool
+from .MessageIndex import MessageIndex
+from .Tracer import Tracer, HANDLER, MEDIA_READY, PROCESS_START, PROCESS_END
+from .HookClient import HookClient, SET_VERSION, START_IMAGE_HOOK, START_VOICE_HOOK, result_ok, msg_ok
 
 from rich.console import Console
 from rich import print as rprint
@@ -43,24 +59,52 @@ from io import BytesIO
 from PIL import Image
 from pyqrcode import QRCode
 
+INBOUND_MESSAGES = REGISTRY.counter("comwechat_inbound_messages_total", "Inbound WeChat messages by type", ("type",))
+DUPLICATE_MESSAGES = REGISTRY.counter("comwechat_duplicate_messages_total", "Inbound messages dropped by the dedup cache")
+SEND_LATENCY = REGISTRY.histogram("comwechat_send_message_seconds", "send_message latency by EFB message type", ("type",))
+REFRESH_SECONDS = REGISTRY.histogram("comwechat_refresh_seconds", "Contact / group member refresh duration", ("kind",))
+
+TRANSFER_AMOUNT = re.compile(r"<des>(?:<!\[CDATA\[)?收到转账(.*?)元")    # 只认 des 中的金额
+FRDVER_ATTRIBUTES = attribute_pattern("fromnickname", "content", "bigheadimgurl", "encryptusername", "ticket")
+CARD_ATTRIBUTES = attribute_pattern("bigheadimgurl", "nickname", "province", "city", "sex", "username")
+
 class ComWeChatChannel(SlaveChannel):
     channel_name : str = "ComWechatChannel"
     channel_emoji : str = "💻"
     channel_id : str = "honus.comwechat"
 
-    bot : WeChatRobot = None
+    bot : InstrumentedBot = None                   # WeChatRobot 外包一层统计/超时/重试
     config : Dict = {}
 
-    friends : EFBPrivateChat = []
-    groups : EFBGroupChat    = []
-
-    contacts : Dict = {}            # {wxid : {alias : str , remark : str, nickname : str , type : int}} -> {wxid : name(after handle)}
+    directory : ChatDirectory = ChatDirectory()    # 好友/群聊目录快照，刷新时整体替换
+    directory_lock = threading.Lock()
     group_members : Dict = {}       # {"group_id" : { "wxID" : "displayName"}}
+    group_digests : Dict = {}       # {"group_id" : RoomData 摘要}，未变化的群不重复解析
+    group_refreshed : Dict = {}     # {"group_id" : 上次单独刷新成员的时间}
+    group_members_lock = threading.Lock()   # 复制、修改、替换 group_members / group_digests 时持有
 
     time_out : int = 120
     cache =  TTLCache(maxsize=200, ttl= time_out)  # 缓存发送过的消息ID
-    file_msg : Dict = {}                           # 存储待修改的文件类消息 {path : msg}
-    delete_file : Dict = {}                        # 存储待删除的消息 {path : time}
+    cache_lock = threading.Lock()
+    chat_history_max_items : int = CHAT_HISTORY_MAX_ITEMS   # 合并转发的聊天记录超出后截断，附 View more 命令
+    chat_history_max_depth : int = CHAT_HISTORY_MAX_DEPTH
+    chat_histories : TTLCache = None                        # {key : 被截断的聊天记录原文}
+    chat_histories_lock = threading.Lock()
+
+    dispatcher : InboundDispatcher = None          # 入站消息按聊天分片的线程池
+    transcoder : Transcoder = None                 # 语音转码进程池及结果缓存
+    xml_spool : XmlSpool = None                    # 入站消息原始 xml，引用回复时按需取出
+    message_index : MessageIndex = None            # 发往主端的消息索引，供 get_message_by_id 查询
+    name_resolver : NameResolver = None            # 目录外 wxid 的名称查询缓存
+    media_db : MediaDB = None                      # MediaMSG*.db 访问，语音未落盘时兜底
+    inbound_stager : InboundStager = None          # 入站文件/视频交给主端前的暂存
+    outbound_stager : OutboundStager = None        # 发往微信的文件在 Hook 可见目录中的暂存
+    media_watcher : MediaWatcher = None            # 等待落盘的文件类消息 {path : (msg, author, chat)}
+    cleanup_scheduler : CleanupScheduler = None    # 暂存文件的延迟删除
+    hook : HookClient = None                       # Hook HTTP 接口客户端（连接池）
+    metrics_server : MetricsServer = None          # 可选的本地指标接口
+    tracer : Tracer = None                         # 入站消息各阶段耗时追踪
+    journal : JournalWriter = None                 # 可选的入站事件录制，供离线回放
     forward_pattern = r"ehforwarderbot:\/\/([^/]+)\/forward\/(\d+)"
 
     __version__ = version.__version__
@@ -75,7 +119,12 @@ class ComWeChatChannel(SlaveChannel):
         self.logger.info("ComWeChat Slave Channel initialized.")
         self.logger.info("Version: %s" % self.__version__)
         self.config = load_config(efb_utils.get_config_path(self.channel_id))
-        self.bot = WeChatRobot()
+        self.bot = InstrumentedBot(
+            WeChatRobot(),
+            timeout = self.config.get("rpc_timeout", 30),
+            timeouts = {**DEFAULT_TIMEOUTS, **self.config.get("rpc_timeouts", {})},
+            retries = self.config.get("rpc_retries", 0),
+        )
 
         self.qr_url = ""
         self.master_qr_picture_id: Optional[str] = None
@@ -84,6 +133,9 @@ class ComWeChatChannel(SlaveChannel):
                                     uid=ChatID("__ews_user_auth__"))
 
         self.qrcode_timeout = self.config.get("qrcode_timeout", 10)
+        self.native_emoticon = self.config.get("native_emoticon", True)
+        self.member_refresh_interval = self.config.get("member_refresh_interval", 60)
+        ChatMgr.cache_size = self.config.get("chat_cache_size", 2048)
         self.login()
         self.me = self.bot.GetSelfInfo()["data"]
         self.wxid = self.me["wxId"]
@@ -92,90 +144,109 @@ class ComWeChatChannel(SlaveChannel):
         if not self.dir.endswith(os.path.sep):
             self.dir += os.path.sep
         
-        try:
-            import subprocess
-            import json
-            
-            url = 'http://127.0.0.1:18888/api/?type=35'
-            payload = {'version': '3.9.12.55'}
-            payload_str = json.dumps(payload)
-            
-            self.logger.info(f"向Hook发送微信版本号: {payload['version']}")
-            cmd = ["curl", "-X", "POST", url, "-d", payload_str]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
-            
-            if result.returncode != 0:
-                self.logger.error(f"设置微信版本号的curl命令执行失败. Curl stderr: {result.stderr.strip()}")
-            else:
-                try:
-                    response = json.loads(result.stdout)
-                    # Assuming a response with 'result' == 'OK' indicates success.
-                    if response.get('result') == 'OK':
-                        self.logger.info("成功设置微信版本号.")
-                    else:
-                        self.logger.error(f"设置微信版本号失败，Hook返回: {result.stdout.strip()}")
-                except json.JSONDecodeError:
-                    self.logger.error(f"解析Hook返回的JSON失败. Response: {result.stdout.strip()}")
-                    
-        except Exception as e:
-            self.logger.error(f"设置微信版本号失败: {e}")
+        self.hook = HookClient(
+            port = self.bot.api.port,
+            timeout = self.config.get("hook_timeout", 5),
+            retries = self.config.get("hook_retries", 2),
+        )
+        version = self.config.get("wechat_version", "3.9.12.55")
+        calls = {
+            "version": (SET_VERSION, {"version": version}, result_ok),
+        }
+        self.logger.info(f"向Hook发送微信版本号: {version}")
 
         # WSL环境检测和路径转换配置
         self.is_wsl = self._detect_wsl()
         if self.is_wsl:
             self.logger.info("检测到WSL环境，启用WSL到Windows路径转换")
-            try:
-                import subprocess
-                import json
-
-                # 移除末尾的路径分隔符
-                clean_dir = self.dir.rstrip(os.path.sep)
-                win_path = self._wsl_to_windows_path(clean_dir)
-
-                payload = {"save_path": win_path}
-                payload_str = json.dumps(payload)
-
-                # 设置图片保存路径 (type=13)
-                url13 = 'http://127.0.0.1:18888/api/?type=13'
-                self.logger.info(f"向Hook发送图片保存路径: {win_path}")
-                cmd13 = ["curl", "-X", "POST", url13, "-d", payload_str]
-                result13 = subprocess.run(cmd13, capture_output=True, text=True, timeout=5)
-                if result13.returncode != 0:
-                    self.logger.error(f"设置图片保存路径的curl命令执行失败. Curl stderr: {result13.stderr.strip()}")
-                else:
-                    try:
-                        response = json.loads(result13.stdout)
-                        if response.get('msg') == 1 and response.get('result') == 'OK':
-                            self.logger.info("成功设置Hook图片保存路径.")
-                        else:
-                            self.logger.error(f"设置Hook图片保存路径失败，Hook返回: {result13.stdout.strip()}")
-                    except json.JSONDecodeError:
-                        self.logger.error(f"解析Hook返回的JSON失败. Response: {result13.stdout.strip()}")
-
-                # 设置语音保存路径 (type=11)
-                url11 = 'http://127.0.0.1:18888/api/?type=11'
-                self.logger.info(f"向Hook发送语音保存路径: {win_path}")
-                cmd11 = ["curl", "-X", "POST", url11, "-d", payload_str]
-                result11 = subprocess.run(cmd11, capture_output=True, text=True, timeout=5)
-                if result11.returncode != 0:
-                    self.logger.error(f"设置语音保存路径的curl命令执行失败. Curl stderr: {result11.stderr.strip()}")
-                else:
-                    try:
-                        response = json.loads(result11.stdout)
-                        if response.get('msg') == 1 and response.get('result') == 'OK':
-                            self.logger.info("成功设置Hook语音保存路径.")
-                        else:
-                            self.logger.error(f"设置Hook语音保存路径失败，Hook返回: {result11.stdout.strip()}")
-                    except json.JSONDecodeError:
-                        self.logger.error(f"解析Hook返回的JSON失败. Response: {result11.stdout.strip()}")
+            # 移除末尾的路径分隔符
+            win_path = self._wsl_to_windows_path(self.dir.rstrip(os.path.sep))
+            self.logger.info(f"向Hook发送图片/语音保存路径: {win_path}")
+            calls["image_path"] = (START_IMAGE_HOOK, {"save_path": win_path}, msg_ok)
+            calls["voice_path"] = (START_VOICE_HOOK, {"save_path": win_path}, msg_ok)
+
+        descriptions = {
+            "version": "设置微信版本号",
+            "image_path": "设置Hook图片保存路径",
+            "voice_path": "设置Hook语音保存路径",
+        }
+        for name, result in self.hook.call_many(calls).items():
+            if isinstance(result, Exception):
+                self.logger.error(f"{descriptions[name]}失败: {result}")
+            else:
+                self.logger.info(f"成功{descriptions[name]}.")
+
+        # 媒体文件落盘监听，WSL 下 /mnt 为 DrvFs，Windows 侧写入不会触发 inotify
+        watch_mode = self.config.get("media_watch", "auto")
+        if watch_mode == "auto":
+            use_inotify = not (self.is_wsl and self.dir.startswith("/mnt/"))
+        else:
+            use_inotify = watch_mode == "inotify"
+        self.media_db = MediaDB(self.bot)
+        self.media_watcher = MediaWatcher(self.on_media_ready, time_out = self.time_out,
+                                          use_inotify = use_inotify, fallback = self.voice_fallback)
+        self.logger.info(f"媒体文件监听模式: {self.media_watcher.mode}")
+
+        self.dispatcher = InboundDispatcher(
+            workers = self.config.get("inbound_workers", 4),
+            queue_size = self.config.get("inbound_queue_size", 1000),
+            policy = self.config.get("inbound_backpressure", "block"),
+        )
+        self.transcoder = Transcoder(
+            cache_dir = efb_utils.get_data_path(self.channel_id) / "transcode",
+            workers = self.config.get("transcode_workers", 2),
+            max_pending = self.config.get("transcode_queue_size", 16),
+            timeout = self.config.get("transcode_timeout", 60),
+            cache_size = self.config.get("transcode_cache_size", 200) * 1024 * 1024,
+            voice_pipeline = self.config.get("voice_pipeline", "pipe"),
+        )
+        self.inbound_stager = InboundStager(
+            spool_dir = efb_utils.get_data_path(self.channel_id) / "spool",
+            buffer_limit = self.config.get("inbound_buffer_limit", 8) * 1024 * 1024,
+            mode = self.config.get("inbound_staging", "link"),
+        )
+        self.cleanup_scheduler = CleanupScheduler()
+        self.outbound_stager = OutboundStager(
+            root = os.path.join(self.dir, self.wxid, "efb_outbox"),
+            scheduler = self.cleanup_scheduler,
+            grace = self.config.get("outbox_grace", 120),
+        )
+        self.name_resolver = NameResolver(
+            fetch = self.fetch_contact_name,
+            fetch_many = self.fetch_contact_names,
+            batchable = self.in_contact_table,
+            ttl = self.config.get("name_cache_ttl", 3600),
+            negative_ttl = self.config.get("name_negative_ttl", 300),
+        )
+        self.xml_spool = XmlSpool(
+            path = efb_utils.get_data_path(self.channel_id) / "xml_spool.db",
+            memory_limit = self.config.get("xml_spool_memory", 16) * 1024 * 1024,
+            disk_entries = self.config.get("xml_spool_disk_entries", 100000),
+        )
+        if self.config.get("message_index", True):
+            self.message_index = MessageIndex(
+                path = efb_utils.get_data_path(self.channel_id) / "message_index.db",
+                hot_size = self.config.get("message_index_hot_size", 5000),
+                retention_days = self.config.get("message_index_retention_days", 30),
+                max_entries = self.config.get("message_index_max_entries", 200000),
+            )
+        self.tracer = Tracer(size = self.config.get("trace_buffer", 1000))
+        self.trace_vendor_specific = self.config.get("trace_vendor_specific", False)
+        self.chat_history_max_items = self.config.get("chat_history_max_items", CHAT_HISTORY_MAX_ITEMS)
+        self.chat_history_max_depth = self.config.get("chat_history_max_depth", CHAT_HISTORY_MAX_DEPTH)
+        self.chat_histories = TTLCache(maxsize = self.config.get("chat_history_cache_size", 100),
+                                       ttl = self.config.get("chat_history_cache_ttl", 86400))
+        if self.config.get("journal", False):
+            self.journal = JournalWriter(
+                directory = self.config.get("journal_dir") or efb_utils.get_data_path(self.channel_id) / "journal",
+                media = self.config.get("journal_media", True),
+            )
+        self.register_metrics()
 
-            except Exception as e:
-                self.logger.error(f"设置Windows Hook路径失败: {e}")
-        
         ChatMgr.slave_channel = self
 
         @self.bot.on("self_msg")
+        @self.dispatched("self_msg")
         def on_self_msg(msg : Dict):
             self.logger.debug(f"self_msg:{msg}")
             sender = msg["sender"]
@@ -192,14 +263,13 @@ class ComWeChatChannel(SlaveChannel):
                 chat = ChatMgr.build_efb_chat_as_private(EFBPrivateChat(
                     uid = sender,
                     name = name,
-                ))
-                if sender.startswith('gh_'):
-                    chat.vendor_specific = {'is_mp' : True}
+                ), vendor_specific = {'is_mp' : True} if sender.startswith('gh_') else None)
                 author = chat.self
 
             self.handle_msg(msg , author , chat)
 
         @self.bot.on("friend_msg")
+        @self.dispatched("friend_msg")
         def on_friend_msg(msg : Dict):
             self.logger.debug(f"friend_msg:{msg}")
 
@@ -213,14 +283,12 @@ class ComWeChatChannel(SlaveChannel):
             chat = ChatMgr.build_efb_chat_as_private(EFBPrivateChat(
                     uid= sender,
                     name= name,
-            ))
-            if sender.startswith('gh_'):
-                chat.vendor_specific = {'is_mp' : True}
-                self.logger.debug(f'modified_chat:{chat}')
+            ), vendor_specific = {'is_mp' : True} if sender.startswith('gh_') else None)
             author = chat.other
             self.handle_msg(msg, author, chat)
 
         @self.bot.on("group_msg")
+        @self.dispatched("group_msg")
         def on_group_msg(msg : Dict):
             self.logger.debug(f"group_msg:{msg}")
             sender = msg["sender"]
@@ -233,19 +301,27 @@ class ComWeChatChannel(SlaveChannel):
                 name = chatname,
             ))
 
-            try:
-                name = self.contacts[wxid]
-            except:
-                name = wxid
+            if wxid not in self.group_members.get(sender, {}):
+                # 新入群的成员，单独刷新该群的成员列表
+                self.refresh_group_members(sender)
+
+            members = self.group_members.get(sender)
+            if members:
+                # 首次见到该群时批量预取目录外成员的名称
+                directory = self.directory
+                self.name_resolver.prefetch(sender, (member for member in members if directory.name_of(member) is None))
+
+            name = self.get_name_by_wxid(wxid)
 
             author = ChatMgr.build_efb_chat_as_member(chat, EFBGroupMember(
                 uid = wxid,
                 name = name,
-                alias = self.group_members.get(sender,{}).get(wxid , None),
+                alias = self.group_members.get(sender,{}).get(wxid) or None,
             ))
             self.handle_msg(msg, author, chat)
 
         @self.bot.on("revoke_msg")
+        @self.dispatched("revoke_msg")
         def on_revoked_msg(msg : Dict):
             self.logger.debug(f"revoke_msg:{msg}")
             sender = msg["sender"]
@@ -265,7 +341,10 @@ class ComWeChatChannel(SlaveChannel):
                     name = name,
                 ))
 
-            newmsgid = re.search("<newmsgid>(.*?)<\/newmsgid>", msg["message"]).group(1)
+            newmsgid = EventXml(msg["message"]).text("newmsgid")
+            if not newmsgid:
+                self.logger.warning(f"revoke_msg without newmsgid: {msg['message']}")
+                return
 
             efb_msg = Message(chat = chat , uid = newmsgid)
             coordinator.send_status(
@@ -273,6 +352,7 @@ class ComWeChatChannel(SlaveChannel):
             )
 
         @self.bot.on("transfer_msg")
+        @self.dispatched("transfer_msg")
         def on_transfer_msg(msg : Dict):
             self.logger.debug(f"transfer_msg:{msg}")
             sender = msg["sender"]
@@ -290,38 +370,41 @@ class ComWeChatChannel(SlaveChannel):
 
             content = {}
 
-            money = re.search("收到转账(.*)元", msg["message"]).group(1)
-            transcationid = re.search("<transcationid><!\[CDATA\[(.*)\]\]><\/transcationid>", msg["message"]).group(1)
-            transferid = re.search("<transferid><!\[CDATA\[(.*)\]\]><\/transferid>", msg["message"]).group(1)
+            event = EventXml(msg["message"])
+            match = TRANSFER_AMOUNT.search(event.message)
+            money = match.group(1) if match else event.text("feedesc").lstrip("￥")
+            transcationid = event.text("transcationid")
+            transferid = event.text("transferid")
             text = (
                 f"收到 {name} 转账:\n"
                 f"金额为 {money} 元\n"
             )
 
-            commands = [
-                MessageCommand(
-                    name=("Accept"),
-                    callable_name="process_transfer",
-                    kwargs={"transcationid" : transcationid , "transferid" : transferid , "wxid" : sender},
-                )
-            ]
-
             content["sender"] = sender
             content["message"] = text
-            content["commands"] = commands
+            if transcationid and transferid:
+                content["commands"] = [
+                    MessageCommand(
+                        name=("Accept"),
+                        callable_name="process_transfer",
+                        kwargs={"transcationid" : transcationid , "transferid" : transferid , "wxid" : sender},
+                    )
+                ]
             content["name"] = name
             self.system_msg(content)
 
         @self.bot.on("frdver_msg")
+        @self.dispatched("frdver_msg")
         def on_frdver_msg(msg : Dict):
             self.logger.debug(f"frdver_msg:{msg}")
             content = {}
             sender = msg["sender"]
-            fromnickname = re.search('fromnickname="(.*?)"', msg["message"]).group(1)
-            apply_content = re.search('content="(.*?)"', msg["message"]).group(1)
-            url = re.search('bigheadimgurl="(.*?)"', msg["message"]).group(1)
-            v3 = re.search('encryptusername="(v3.*?)"', msg["message"]).group(1)
-            v4 = re.search('ticket="(v4.*?)"', msg["message"]).group(1)
+            event = EventXml(msg["message"], FRDVER_ATTRIBUTES)
+            fromnickname = event.get("fromnickname")
+            apply_content = event.get("content")
+            url = event.get("bigheadimgurl")
+            v3 = event.get("encryptusername")
+            v4 = event.get("ticket")
             text = (
                 "好友申请:\n"
                 f"名字: {fromnickname}\n"
@@ -329,20 +412,20 @@ class ComWeChatChannel(SlaveChannel):
                 f"头像: {url}"
             )
 
-            commands = [
-                MessageCommand(
-                    name=("Accept"),
-                    callable_name="process_friend_request",
-                    kwargs={"v3" : v3 , "v4" : v4},
-                )
-            ]
-
             content["sender"] = sender
             content["message"] = text
-            content["commands"] = commands
+            if v3.startswith("v3") and v4.startswith("v4"):
+                content["commands"] = [
+                    MessageCommand(
+                        name=("Accept"),
+                        callable_name="process_friend_request",
+                        kwargs={"v3" : v3 , "v4" : v4},
+                    )
+                ]
             self.system_msg(content)
 
         @self.bot.on("card_msg")
+        @self.dispatched("card_msg")
         def on_card_msg(msg : Dict):
             self.logger.debug(f"card_msg:{msg}")
             sender = msg["sender"]
@@ -350,12 +433,13 @@ class ComWeChatChannel(SlaveChannel):
             content = {}
             name = self.get_name_by_wxid(sender)
 
-            bigheadimgurl = re.search('bigheadimgurl="(.*?)"', msg["message"]).group(1)
-            nickname = re.search('nickname="(.*?)"', msg["message"]).group(1)
-            province = re.search('province="(.*?)"', msg["message"]).group(1)
-            city = re.search('city="(.*?)"', msg["message"]).group(1)
-            sex = re.search('sex="(.*?)"', msg["message"]).group(1)
-            username = re.search('username="(.*?)"', msg["message"]).group(1)
+            event = EventXml(msg["message"], CARD_ATTRIBUTES)
+            bigheadimgurl = event.get("bigheadimgurl")
+            nickname = event.get("nickname")
+            province = event.get("province")
+            city = event.get("city")
+            sex = event.get("sex")
+            username = event.get("username")
 
             text = "名片信息:\n"
             if nickname:
@@ -390,6 +474,20 @@ class ComWeChatChannel(SlaveChannel):
             # 暂时屏蔽
             self.system_msg(content)
 
+    def dispatched(self, event : str):
+        """把 Hook 回调转交给入站线程池，按消息所属聊天保证顺序"""
+        def deco(func):
+            @functools.wraps(func)
+            def wrapper(msg : Dict):
+                if self.journal is not None:
+                    self.journal.record_event(event, msg)
+                trace = self.tracer.start(msg)
+                if trace is not None:
+                    msg["efb_trace"] = trace
+                self.dispatcher.submit(msg.get("sender", ""), func, msg)
+            return wrapper
+        return deco
+
     def login(self):
         self.master_qr_picture_id = None
         # 每隔 10 秒检查一次登录状态
@@ -514,6 +612,10 @@ class ComWeChatChannel(SlaveChannel):
         for efb_msg in efb_msgs:
             for k, v in kwargs.items():
                 setattr(efb_msg, k, v)
+            index = getattr(ChatMgr.slave_channel, "message_index", None)
+            if index is not None and (efb_msg.vendor_specific or {}).get("comwechat_info") is not None:
+                # 先于投递记录，主端收到后立即引用也能查到
+                index.record(efb_msg)
             coordinator.send_message(efb_msg)
             if efb_msg.file:
                 efb_msg.file.close()
@@ -547,31 +649,30 @@ class ComWeChatChannel(SlaveChannel):
         self.send_efb_msgs(msg, uid=int(time.time()), chat=chat, author=author, type=MsgType.Text)
 
     def handle_msg(self , msg : Dict[str, Any] , author : 'ChatMember' , chat : 'Chat'):
-        emojiList = re.findall('\[[\w|！|!| ]+\]' , msg["message"])
-        for emoji in emojiList:
-            try:
-                msg["message"] = msg["message"].replace(emoji, WC_EMOTICON_CONVERSION[emoji])
-            except:
-                pass
+        INBOUND_MESSAGES.labels(msg["type"]).inc()
+        self.tracer.mark(msg.get("efb_trace"), HANDLER)
+        msg["message"] = EMOTICON_TRANSLATOR.wechat_to_emoji(msg["message"])
 
-        if msg["msgid"] not in self.cache:
-            self.cache[msg["msgid"]] = msg["type"]
-        else:
-            if self.cache[msg["msgid"]] == msg["type"]:
-                return
+        with self.cache_lock:
+            if msg["msgid"] not in self.cache:
+                self.cache[msg["msgid"]] = msg["type"]
+            else:
+                if self.cache[msg["msgid"]] == msg["type"]:
+                    DUPLICATE_MESSAGES.inc()
+                    return
 
         try:
             if ("FileStorage" in msg["filepath"]) and ("Cache" not in msg["filepath"]):
                 msg["timestamp"] = int(time.time())
                 msg["filepath"] = msg["filepath"].replace("\\","/")
                 msg["filepath"] = f'''{self.dir}{msg["filepath"]}'''
-                self.file_msg[msg["filepath"]] = ( msg , author , chat )
+                self.media_watcher.add(msg["filepath"], ( msg , author , chat ))
                 return
             if msg["type"] == "video":
                 msg["timestamp"] = int(time.time())
                 msg["filepath"] = msg["thumb_path"].replace("\\","/").replace(".jpg", ".mp4")
                 msg["filepath"] = f'''{self.dir}{msg["filepath"]}'''
-                self.file_msg[msg["filepath"]] = ( msg , author , chat )
+                self.media_watcher.add(msg["filepath"], ( msg , author , chat ))
                 return
         except:
             ...
@@ -580,53 +681,59 @@ class ComWeChatChannel(SlaveChannel):
             file_path = re.search("clientmsgid=\"(.*?)\"", msg["message"]).group(1) + ".amr"
             msg["timestamp"] = int(time.time())
             msg["filepath"] = f'''{self.dir}{msg["self"]}/{file_path}'''
-            self.file_msg[msg["filepath"]] = ( msg , author , chat )
+            self.media_watcher.add(msg["filepath"], ( msg , author , chat ), fallback = True)
             return
 
-        self.send_efb_msgs(MsgWrapper(msg, MsgProcess(msg, chat)), author=author, chat=chat, uid=MessageID(str(msg['msgid'])))
+        self.deliver_msg(msg, author, chat)
 
     def handle_file_msg(self):
-        while True:
-            if len(self.file_msg) == 0:
-                time.sleep(1)
-            else:
-                for path in list(self.file_msg.keys()):
-                    flag = False
-                    msg = self.file_msg[path][0]
-                    author = self.file_msg[path][1]
-                    chat = self.file_msg[path][2]
-                    if os.path.exists(path):
-                        flag = True
-                    elif (int(time.time()) - msg["timestamp"]) > self.time_out:
-                        msg_type = msg["type"]
-                        msg['message'] = f"[{msg_type} 下载超时,请在手机端查看]"
-                        msg["type"] = "text"
-                        flag = True
-                    elif msg["type"] == "voice":
-                        sql = f'SELECT Buf FROM Media WHERE Reserved0 = {msg["msgid"]}'
-                        dbresult = self.bot.QueryDatabase(db_handle=self.bot.GetDBHandle("MediaMSG0.db"), sql=sql)["data"]
-                        if len(dbresult) == 2:
-                            filebuffer = dbresult[1][0]
-                            decoded = bytes(base64.b64decode(filebuffer))
-                            with open(msg["filepath"], 'wb') as f:
-                                f.write(decoded)
-                            f.close()
-                            flag = True
-
-                    if flag:
-                        del self.file_msg[path]
-                        self.send_efb_msgs(MsgWrapper(msg, MsgProcess(msg, chat)), author=author, chat=chat, uid=MessageID(str(msg['msgid'])))
-
-            if len(self.delete_file):
-                for k in list(self.delete_file.keys()):
-                    file_path = k
-                    begin_time = self.delete_file[k]
-                    if  (int(time.time()) - begin_time) > self.time_out:
-                        try:
-                            os.remove(file_path)
-                        except:
-                            pass
-                        del self.delete_file[file_path]
+        self.media_watcher.run()
+
+    def on_media_ready(self, path : str, entry : Tuple[Dict[str, Any], 'ChatMember', 'Chat'], timed_out : bool):
+        # 解码/转码放到入站线程池，监听线程只负责发现文件
+        self.tracer.mark(entry[0].get("efb_trace"), MEDIA_READY)
+        if self.journal is not None and not timed_out:
+            self.journal.record_media(path, os.path.relpath(path, self.dir), entry[0].get("msgid"))
+        self.dispatcher.submit(entry[2].uid, self.send_media_msg, entry, timed_out)
+
+    def send_media_msg(self, entry : Tuple[Dict[str, Any], 'ChatMember', 'Chat'], timed_out : bool):
+        msg, author, chat = entry
+        if timed_out:
+            msg_type = msg["type"]
+            msg['message'] = f"[{msg_type} 下载超时,请在手机端查看]"
+            msg["type"] = "text"
+        self.deliver_msg(msg, author, chat)
+
+    def deliver_msg(self, msg : Dict[str, Any], author : 'ChatMember', chat : 'Chat'):
+        trace = msg.pop("efb_trace", None)
+        self.tracer.mark(trace, PROCESS_START)
+        efb_msgs = MsgWrapper(msg, MsgProcess(msg, chat))
+        self.tracer.mark(trace, PROCESS_END)
+        if not efb_msgs:
+            return
+        if trace is not None and self.trace_vendor_specific:
+            for efb_msg in efb_msgs:
+                efb_msg.vendor_specific["trace"] = trace
+        self.send_efb_msgs(efb_msgs, author=author, chat=chat, uid=MessageID(str(msg['msgid'])))
+        self.tracer.finish(trace)
+
+    def voice_fallback(self, entries : List[Tuple[str, Any]]) -> List[str]:
+        """语音文件未落盘时，从 MediaMSG*.db 中批量读取"""
+        return self.media_db.fetch_voices({str(msg["msgid"]): path for path, (msg, _, _) in entries})
+
+    def keep_chat_history(self, record : bytes) -> str:
+        """暂存被截断的聊天记录原文，返回 View more 命令使用的 key"""
+        key = hashlib.sha1(record).hexdigest()
+        with self.chat_histories_lock:
+            self.chat_histories[key] = record
+        return key
+
+    def view_chat_history(self, key : str) -> str:
+        with self.chat_histories_lock:
+            record = self.chat_histories.get(key)
+        if record is None:
+            return "聊天记录已过期，请在手机端查看"
+        return format_chat_history(parse_chat_history(record))
 
     def process_friend_request(self , v3 , v4):
         self.logger.debug(f"process_friend_request:{v3} {v4}")
@@ -650,6 +757,44 @@ class ComWeChatChannel(SlaveChannel):
         else:
             return "Failed"
 
+    def register_metrics(self):
+        """注册按需取值的指标，配置了 metrics_port 时启动本地指标接口"""
+        REGISTRY.callback("comwechat_media_pending", "File messages waiting for the media file",
+                          lambda: self.media_watcher.stats()["pending"])
+        REGISTRY.callback("comwechat_media_oldest_wait_seconds", "Age of the oldest pending file message",
+                          lambda: self.media_watcher.stats()["oldest_wait"])
+        REGISTRY.callback("comwechat_inbound_queued", "Messages queued in the inbound dispatcher",
+                          lambda: self.dispatcher.stats()["queued"])
+        REGISTRY.callback("comwechat_inbound_dropped", "Messages dropped by inbound backpressure",
+                          lambda: self.dispatcher.dropped)
+        REGISTRY.callback("comwechat_cleanup_backlog", "Staged files waiting for deletion",
+                          lambda: len(self.cleanup_scheduler))
+        REGISTRY.callback("comwechat_outbox_bytes", "Bytes held in the outbound staging directory",
+                          lambda: self.outbound_stager.staged_bytes)
+        REGISTRY.callback("comwechat_transcode_cache_hits", "Transcode cache hits",
+                          lambda: self.transcoder.hits)
+        REGISTRY.callback("comwechat_transcode_cache_misses", "Transcode cache misses",
+                          lambda: self.transcoder.misses)
+        REGISTRY.callback("comwechat_dedup_cache_size", "Message IDs held in the dedup cache",
+                          lambda: len(self.cache))
+        REGISTRY.callback("comwechat_xml_spool_memory_bytes", "Compressed raw XML held in memory by the spool",
+                          lambda: self.xml_spool.stats()["memory_bytes"])
+        REGISTRY.callback("comwechat_xml_spool_spilled", "Raw XML entries spilled to disk",
+                          lambda: self.xml_spool.spilled)
+        REGISTRY.callback("comwechat_message_index_hot", "Messages held in the in-memory message index LRU",
+                          lambda: self.message_index.stats()["hot"] if self.message_index is not None else 0)
+        REGISTRY.callback("comwechat_message_index_dropped", "Message index records dropped because the write queue was full",
+                          lambda: self.message_index.dropped if self.message_index is not None else 0)
+
+        port = self.config.get("metrics_port")
+        if not port or self.metrics_server is not None:
+            return
+        try:
+            self.metrics_server = MetricsServer(REGISTRY, host = self.config.get("metrics_host", "127.0.0.1"), port = port)
+            self.metrics_server.start()
+        except OSError as e:
+            self.logger.error(f"指标接口启动失败: {e}")
+
     # 定时任务
     def scheduled_job(self):
         count = 1
@@ -662,29 +807,47 @@ class ComWeChatChannel(SlaveChannel):
             else:
                 count += 1
 
+    @property
+    def friends(self) -> List['Chat']:
+        return self.directory.friends
+
+    @property
+    def groups(self) -> List['Chat']:
+        return self.directory.groups
+
+    @property
+    def contacts(self) -> Dict[str, str]:
+        """{wxid : name(after handle)}"""
+        return self.directory.contacts
+
+    def get_directory(self) -> ChatDirectory:
+        if not self.directory:
+            with self.directory_lock:
+                if not self.directory:
+                    self.GetContactListBySql()
+        return self.directory
+
     #获取全部联系人
     def get_chats(self) -> Collection['Chat']:
-        if not self.friends and not self.groups:
-            self.GetContactListBySql()
-        return self.groups + self.friends
+        directory = self.get_directory()
+        return directory.groups + directory.friends
 
     #获取联系人
     def get_chat(self, chat_uid: ChatID) -> 'Chat':
-        if not self.friends and not self.groups:
-            self.GetContactListBySql()
-
-        if "@chatroom" in chat_uid:
-            for group in self.groups:
-                if group.uid == chat_uid:
-                    return group
-        else:
-            for friend in self.friends:
-                if friend.uid == chat_uid:
-                    return friend
-        raise EFBChatNotFound
+        chat = self.get_directory().get(chat_uid)
+        if chat is None:
+            raise EFBChatNotFound
+        return chat
 
     #发送消息
     def send_message(self, msg : Message) -> Message:
+        start = time.perf_counter()
+        try:
+            return self._send_message(msg)
+        finally:
+            SEND_LATENCY.labels(msg.type.name).observe(time.perf_counter() - start)
+
+    def _send_message(self, msg : Message) -> Message:
         chat_uid = msg.chat.uid
 
         if msg.edit:
@@ -702,12 +865,9 @@ class ComWeChatChannel(SlaveChannel):
                 return msg
 
         if msg.type == MsgType.Voice:
-            f = tempfile.NamedTemporaryFile(prefix='voice_message_', suffix=".mp3")
-            AudioSegment.from_ogg(msg.file.name).export(f, format="mp3")
-            msg.file = f
-            msg.file.name = "语音留言.mp3"
+            msg.file = self.transcoder.ogg_to_mp3(msg.file.name)
             msg.type = MsgType.Video
-            msg.filename = os.path.basename(f.name)
+            msg.filename = "语音留言.mp3"
 
         if msg.type in [MsgType.Text]:
             if msg.text.startswith('/changename'):
@@ -736,8 +896,32 @@ class ComWeChatChannel(SlaveChannel):
                     message = json.dumps(self.group_members)
                 elif info == 'contacts':
                     message = json.dumps(self.contacts)
+                elif info == 'chat_cache':
+                    message = json.dumps(ChatMgr.stats())
+                elif info == 'name_cache':
+                    message = json.dumps(self.name_resolver.stats())
+                elif info == 'rpc':
+                    message = json.dumps(self.bot.stats())
+                elif info == 'journal':
+                    message = json.dumps(self.journal.stats()) if self.journal is not None else '未开启录制'
+                elif info == 'xml_spool':
+                    message = json.dumps(self.xml_spool.stats())
+                elif info == 'message_index':
+                    message = json.dumps(self.message_index.stats()) if self.message_index is not None else '未开启消息索引'
+                elif info == 'staging':
+                    message = json.dumps({
+                        "staged_bytes": self.outbound_stager.staged_bytes,
+                        "staged": self.outbound_stager.staged,
+                        "reused": self.outbound_stager.reused,
+                        "pending_cleanup": len(self.cleanup_scheduler),
+                        **self.inbound_stager.stats(),
+                    })
                 else:
-                    message = '当前仅支持查询friends, groups, group_members, contacts'
+                    message = '当前仅支持查询friends, groups, group_members, contacts, chat_cache, name_cache, staging, rpc, journal, xml_spool, message_index'
+                self.system_msg({'sender':chat_uid, 'message':message})
+            elif msg.text.startswith('/trace'):
+                count = msg.text[7::].strip()
+                message = self.tracer.report(int(count) if count.isdigit() else None)
                 self.system_msg({'sender':chat_uid, 'message':message})
             elif msg.text.startswith('/helpcomwechat'):
                 message = '''/search - 按关键字匹配好友昵称搜索联系人
@@ -754,7 +938,9 @@ class ComWeChatChannel(SlaveChannel):
 
 /addfriend - 后面格式'wxid message'
 
-/getstaticinfo - 可获取friends, groups, contacts信息'''
+/getstaticinfo - 可获取friends, groups, contacts, chat_cache, name_cache, staging, rpc, journal, xml_spool, message_index信息
+
+/trace - 查看最近消息各阶段耗时，后面可跟统计的消息条数'''
                 self.system_msg({'sender':chat_uid, 'message':message})
             elif msg.text.startswith('/search'):
                 keyword = msg.text[8::]
@@ -824,64 +1010,33 @@ class ComWeChatChannel(SlaveChannel):
         elif msg.type in [MsgType.Link]:
             self.send_text(wxid = chat_uid , msg = msg)
         elif msg.type in [MsgType.Image , MsgType.Sticker]:
-            name = os.path.basename(msg.file.name)
-            local_path = f"{self.dir}{self.wxid}/{name}"
-            load_temp_file_to_local(msg.file, local_path)
-            
-            # WSL环境下需要将路径转换为Windows格式
-            if self.is_wsl:
-                img_path = self._wsl_to_windows_path(local_path)
-                self.logger.debug(f"WSL路径转换: {local_path} -> {img_path}")
-            else:
-                img_path = os.path.join(self.base_path, self.wxid, name)
-            
+            local_path, img_path = self.stage_outbound(msg.file, os.path.basename(msg.file.name))
             self.logger.debug(f"发送图片路径: {img_path}")
-            res = self.bot.SendImage(receiver = chat_uid , img_path = img_path)
-            self.delete_file[local_path] = int(time.time())
+            try:
+                res = self.bot.SendImage(receiver = chat_uid , img_path = img_path)
+            finally:
+                self.outbound_stager.release(local_path)
             if msg.text:
                 self.send_text(wxid = chat_uid , msg = msg)
         elif msg.type in [MsgType.File , MsgType.Video]:
-            name = os.path.basename(msg.file.name)
-            local_path = f"{self.dir}{self.wxid}/{name}"
-            load_temp_file_to_local(msg.file, local_path)
-            
-            if msg.filename:
-                try:
-                    os.rename(local_path , f"{self.dir}{self.wxid}/{msg.filename}")
-                except:
-                    os.replace(local_path , f"{self.dir}{self.wxid}/{msg.filename}")
-                local_path = f"{self.dir}{self.wxid}/{msg.filename}"
-            
-            # WSL环境下需要将路径转换为Windows格式
-            if self.is_wsl:
-                file_path = self._wsl_to_windows_path(local_path)
-                self.logger.debug(f"WSL路径转换: {local_path} -> {file_path}")
-            else:
-                filename = msg.filename if msg.filename else name
-                file_path = os.path.join(self.base_path, self.wxid, filename)
-            
+            filename = msg.filename if msg.filename else os.path.basename(msg.file.name)
+            local_path, file_path = self.stage_outbound(msg.file, filename)
             self.logger.debug(f"发送文件路径: {file_path}")
-            res = self.bot.SendFile(receiver = chat_uid , file_path = file_path)
-            self.delete_file[local_path] = int(time.time())
+            try:
+                res = self.bot.SendFile(receiver = chat_uid , file_path = file_path)
+            finally:
+                self.outbound_stager.release(local_path)
             if msg.text:
                 self.send_text(wxid = chat_uid , msg = msg)
             if msg.type == MsgType.Video:
                 res["msg"] = 1
         elif msg.type in [MsgType.Animation]:
-            name = os.path.basename(msg.file.name)
-            local_path = f"{self.dir}{self.wxid}/{name}"
-            load_temp_file_to_local(msg.file, local_path)
-            
-            # WSL环境下需要将路径转换为Windows格式
-            if self.is_wsl:
-                file_path = self._wsl_to_windows_path(local_path)
-                self.logger.debug(f"WSL路径转换: {local_path} -> {file_path}")
-            else:
-                file_path = os.path.join(self.base_path, self.wxid, name)
-            
+            local_path, file_path = self.stage_outbound(msg.file, os.path.basename(msg.file.name))
             self.logger.debug(f"发送动画表情路径: {file_path}")
-            res = self.bot.SendEmotion(wxid = chat_uid , img_path = file_path)
-            self.delete_file[local_path] = int(time.time())
+            try:
+                res = self.bot.SendEmotion(wxid = chat_uid , img_path = file_path)
+            finally:
+                self.outbound_stager.release(local_path)
             if msg.text:
                 self.send_text(wxid = chat_uid , msg = msg)
 
@@ -892,17 +1047,42 @@ class ComWeChatChannel(SlaveChannel):
             ...
         return msg
 
+    def stage_outbound(self, file : BinaryIO, filename : str) -> Tuple[str, str]:
+        """
+        暂存待发送的文件，返回 (本地路径, Hook 侧路径)，发送完成后需调用 outbound_stager.release
+        """
+        local_path = self.outbound_stager.acquire(file, filename)
+        if self.is_wsl:
+            # WSL环境下需要将路径转换为Windows格式
+            hook_path = self._wsl_to_windows_path(local_path)
+            self.logger.debug(f"WSL路径转换: {local_path} -> {hook_path}")
+        else:
+            hook_path = os.path.join(self.base_path, *os.path.relpath(local_path, self.dir).split(os.sep))
+        return local_path, hook_path
+
+    def raw_xml(self, msg: Message) -> Optional[str]:
+        """收到的消息的原始 xml，XmlSpool 中已淘汰时为 None"""
+        vendor_specific = msg.vendor_specific or {}
+        if "wx_xml" in vendor_specific:
+            return vendor_specific["wx_xml"]
+        ref = vendor_specific.get("wx_xml_ref")
+        if ref is None or self.xml_spool is None:
+            return None
+        return self.xml_spool.get(ref)
+
     def send_text(self, wxid: ChatID, msg: Message) -> 'Message':
         text = msg.text
+        if self.native_emoticon:
+            text = EMOTICON_TRANSLATOR.emoji_to_wechat(text)
         if isinstance(msg.target, Message):
                 if isinstance(msg.target.author, SelfChatMember) and isinstance(msg.target.deliver_to, SlaveChannel):
                     qt_txt = msg.target.text or msg.target.type.name
-                    text = qutoed_text(qt_txt, msg.text)
+                    text = qutoed_text(qt_txt, text)
                 else:
                     msgid = msg.target.uid
                     sender = msg.target.author.uid
                     displayname = msg.target.author.name
-                    content = escape(msg.target.vendor_specific.get("wx_xml", ""), {
+                    content = escape(self.raw_xml(msg.target) or "", {
                         "\n": "&#x0A;",
                         "\t": "&#x09;",
                         '"': "&quot;",
@@ -968,51 +1148,153 @@ class ComWeChatChannel(SlaveChannel):
         ...
 
     def get_message_by_id(self, chat: 'Chat', msg_id: MessageID) -> Optional['Message']:
-        ...
+        if self.message_index is None:
+            return None
+        entry = self.message_index.lookup(chat.uid, msg_id)
+        if entry is None:
+            return None
+        author = ChatMgr.build_efb_chat_as_member(chat, EFBGroupMember(
+            uid = entry.author,
+            name = entry.author_name,
+            alias = entry.author_alias,
+        ))
+        vendor_specific = {"comwechat_info": entry.info}
+        if entry.xml_ref is not None:
+            vendor_specific["wx_xml_ref"] = entry.xml_ref
+        msg = Message(
+            uid = MessageID(entry.msgid),
+            chat = chat,
+            author = author,
+            type = MsgType(entry.type),
+            text = entry.text,
+            deliver_to = coordinator.master,
+            vendor_specific = vendor_specific,
+        )
+        if entry.path and os.path.exists(entry.path):
+            # 暂存文件可能已被清理，只在仍存在时附上
+            msg.path = Path(entry.path)
+            msg.filename = entry.filename
+            msg.mime = entry.mime
+        return msg
 
     def get_name_by_wxid(self, wxid):
-        try:
-            name = self.contacts[wxid]
-            if name == "":
-                name = wxid
-        except:
-            data = self.bot.GetContactBySql(wxid = wxid)
-            if data:
-                name = data[3]
-                if name == "":
-                    name = wxid
-            else:
-                name = wxid
-        return name
+        name = self.directory.name_of(wxid)
+        if name is None:
+            name = self.name_resolver.resolve(wxid)
+        return name or wxid
+
+    def fetch_contact_name(self, wxid : str) -> Optional[str]:
+        data = self.bot.GetContactBySql(wxid = wxid)
+        return data[3] if data else None
+
+    @staticmethod
+    def in_contact_table(wxid : str) -> bool:
+        """企业微信联系人（@openim）在 OpenIMContact 库中，批量查询 Contact 表查不到"""
+        return not wxid.endswith("@openim")
+
+    def fetch_contact_names(self, wxids : List[str]) -> Dict[str, str]:
+        names = {}
+        wxids = [wxid for wxid in wxids if self.in_contact_table(wxid)]
+        for i in range(0, len(wxids), 500):
+            chunk = ",".join("'%s'" % wxid.replace("'", "''") for wxid in wxids[i:i + 500])
+            sql = f"select UserName,NickName from Contact where UserName in ({chunk})"
+            data = self.bot.QueryDatabase(db_handle = self.bot.GetDBHandle(), sql = sql)["data"]
+            for row in data[1:]:
+                if row[1]:
+                    names[row[0]] = row[1]
+        return names
 
     #定时更新 Start
+    @REFRESH_SECONDS.labels("contacts").time()
     def GetContactListBySql(self):
-        self.groups = []
-        self.friends = []
         contacts = self.bot.GetContactListBySql()
-        for contact in contacts:
-            data = contacts[contact]
-            name = (f"{data['remark']}({data['nickname']})") if data["remark"] else data["nickname"]
-
-            self.contacts[contact] = name
-            if data["type"] == 0 or data["type"] == 4:
-                continue
-
-            if "@chatroom" in contact:
-                new_entity = EFBGroupChat(
-                    uid=contact,
-                    name=name
-                )
-                self.groups.append(ChatMgr.build_efb_chat_as_group(new_entity))
-            else:
-                new_entity = EFBPrivateChat(
-                    uid=contact,
-                    name=name
-                )
-                self.friends.append(ChatMgr.build_efb_chat_as_private(new_entity))
+        first = not self.directory
+        directory, changes = self.directory.update(contacts, self.build_directory_chat)
+        # 构建完成后整体替换，读者不会看到构建到一半的目录
+        self.directory = directory
+        if first:
+            self.logger.info(f"联系人加载完成: 好友 {len(directory.friends)}, 群聊 {len(directory.groups)}")
+            return
+        if any(changes):
+            self.logger.info(f"联系人更新: 新增 {len(changes.added)}, 删除 {len(changes.removed)}, 改名 {len(changes.renamed)}")
+        for uid in changes.added:
+            self.logger.debug(f"新增联系人: {uid} {directory.contacts.get(uid)}")
+        for uid in changes.removed:
+            self.logger.debug(f"删除联系人: {uid}")
+            ChatMgr.invalidate(uid)
+        for uid, old, new in changes.renamed:
+            self.logger.debug(f"联系人改名: {uid} {old} -> {new}")
+            # update 已按新名称驻留了新对象，只移除旧名称的
+            ChatMgr.invalidate(uid, keep_name = new)
+
+    def build_directory_chat(self, uid : str, name : str) -> 'Chat':
+        if "@chatroom" in uid:
+            return ChatMgr.build_efb_chat_as_group(EFBGroupChat(
+                uid=uid,
+                name=name
+            ))
+        return ChatMgr.build_efb_chat_as_private(EFBPrivateChat(
+            uid=uid,
+            name=name
+        ))
 
+    @REFRESH_SECONDS.labels("groups").time()
     def GetGroupListBySql(self):
-        self.group_members = self.bot.GetAllGroupMembersBySql()
+        started = time.monotonic()
+        rows = self.query_group_room_data()
+        members = {}
+        digests = {}
+        parsed = 0
+        with self.group_members_lock:
+            for group, room_data in rows:
+                if self.group_refreshed.get(group, started) > started and group in self.group_members:
+                    # 查询期间该群已单独刷新过，保留较新的结果
+                    members[group] = self.group_members[group]
+                    digests[group] = self.group_digests.get(group)
+                    continue
+                digest = hashlib.sha1(room_data.encode()).digest()
+                if self.group_digests.get(group) == digest and group in self.group_members:
+                    members[group] = self.group_members[group]
+                else:
+                    members[group] = parse_room_data(room_data)
+                    parsed += 1
+                digests[group] = digest
+            self.group_members = members
+            self.group_digests = digests
+        self.logger.debug(f"群成员更新: 共 {len(rows)} 个群，重新解析 {parsed} 个")
+
+    def refresh_group_members(self, group : str) -> bool:
+        """单独刷新一个群的成员，同一个群在 member_refresh_interval 秒内只刷新一次"""
+        now = time.monotonic()
+        if now - self.group_refreshed.get(group, -self.member_refresh_interval) < self.member_refresh_interval:
+            return False
+        try:
+            rows = self.query_group_room_data(group)
+        except Exception as e:
+            self.logger.warning(f"刷新群成员失败 {group}: {e}")
+            return False
+        if not rows:
+            return False
+        _, room_data = rows[0]
+        parsed = parse_room_data(room_data)
+        digest = hashlib.sha1(room_data.encode()).digest()
+        with self.group_members_lock:
+            members = dict(self.group_members)
+            members[group] = parsed
+            digests = dict(self.group_digests)
+            digests[group] = digest
+            self.group_members = members
+            self.group_digests = digests
+            self.group_refreshed[group] = time.monotonic()
+        self.logger.debug(f"群成员刷新: {group} 共 {len(members[group])} 人")
+        return True
+
+    def query_group_room_data(self, group : Optional[str] = None) -> List[Tuple[str, str]]:
+        sql = "select ChatRoomName,RoomData from ChatRoom"
+        if group is not None:
+            sql += " where ChatRoomName='%s'" % group.replace("'", "''")
+        data = self.bot.QueryDatabase(db_handle = self.bot.GetDBHandle(), sql = sql)["data"]
+        return [(row[0], row[1]) for row in data[1:]]
     #定时更新 End
     
     def _detect_wsl(self) -> bool:
@@ -0,0 +1,77 @@
+# coding: utf-8
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, Hashable, List
+
+logger = logging.getLogger(__name__)
+
+
+class InboundDispatcher:
+    """
+    入站消息分发线程池。
+    按 key（聊天 uid）取模分片到固定的工作线程，同一聊天的消息始终由同一线程按序处理，
+    不同聊天之间互不阻塞。每个分片的队列有上限，队列满时按 policy 处理：
+    - block : 阻塞调用方（即 Hook 接收线程），把压力传回 Hook
+    - drop  : 丢弃新消息并记录告警
+    """
+
+    POLICIES = ("block", "drop")
+
+    def __init__(self, workers: int = 4, queue_size: int = 1000, policy: str = "block",
+                 name: str = "inbound"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.workers = max(0, int(workers))
+        self.policy = policy
+        self.name = name
+        self.dropped = 0
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self._threads: List[threading.Thread] = []
+        for index, q in enumerate(self._queues):
+            t = threading.Thread(target=self._worker, args=(q,), name=f"{name}-{index}")
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, key: Hashable, func: Callable, *args: Any, **kwargs: Any) -> bool:
+        """
+        提交任务，返回是否已入队（或已执行）。
+        workers 为 0 时直接在调用线程中执行。
+        """
+        if not self.workers:
+            self._run(func, args, kwargs)
+            return True
+        q = self._queues[hash(key) % self.workers]
+        item = (func, args, kwargs)
+        if self.policy == "block":
+            q.put(item)
+            return True
+        try:
+            q.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"{self.name} queue full, dropped task for {key} (total dropped: {self.dropped})")
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = [q.qsize() for q in self._queues]
+        return {
+            "workers": self.workers,
+            "queued": sum(sizes),
+            "max_shard_queued": max(sizes, default=0),
+            "dropped": self.dropped,
+        }
+
+    def _worker(self, q: queue.Queue):
+        while True:
+            func, args, kwargs = q.get()
+            self._run(func, args, kwargs)
+
+    @staticmethod
+    def _run(func: Callable, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            logger.exception(f"Error occurred when handling inbound message: {e}")
@@ -0,0 +1,112 @@
+# coding: utf-8
+import re
+import threading
+from typing import Dict, Optional, Pattern
+from xml.sax.saxutils import unescape
+
+from lxml import etree
+
+_local = threading.local()
+
+ENTITIES = {"&quot;": '"', "&apos;": "'"}
+
+
+def event_parser() -> etree.XMLParser:
+    """
+    每个线程复用一个加固的解析器：不展开实体、不加载 DTD、不访问网络，容忍残缺的 xml。
+    lxml 的解析器对象不能跨线程并发使用，因此按线程缓存
+    """
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = _local.parser = etree.XMLParser(
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+            huge_tree=False,
+            remove_comments=True,
+            remove_pis=True,
+            recover=True,
+        )
+    return parser
+
+
+def attribute_pattern(*names: str) -> Pattern:
+    """
+    一次扫描取出 names 中的属性，names 为空时取全部属性。
+    以空格开头，正则引擎可以按字面量快速定位，不必在每个位置尝试匹配属性名
+    """
+    name = "|".join(map(re.escape, names)) if names else r"\w+"
+    return re.compile(rf' ({name})="([^"]*)"')
+
+
+ATTRIBUTES = attribute_pattern()
+_text_patterns: Dict[str, Pattern] = {}
+
+
+def text_pattern(tag: str) -> Pattern:
+    """<tag>文本</tag> 或 <tag><![CDATA[文本]]></tag>，按标签缓存编译结果"""
+    pattern = _text_patterns.get(tag)
+    if pattern is None:
+        pattern = _text_patterns[tag] = re.compile(rf"<{tag}>(?:<!\[CDATA\[(.*?)\]\]>|([^<]*))</{tag}>", re.S)
+    return pattern
+
+
+class EventXml:
+    """
+    好友申请、名片、转账、撤回等事件的 xml 取值：属性用一个预编译的正则扫描一次，叶子节点按标签的预编译正则查找。
+    同名时取文档中第一个；正则取不到时（单引号属性、换行分隔、残缺的 xml 等）才用 lxml 解析，
+    仍不存在则返回 default，不会抛出异常
+    """
+    __slots__ = ("message", "_pattern", "_attrs", "_root")
+
+    def __init__(self, text: str, attributes: Pattern = ATTRIBUTES):
+        self.message = text
+        self._pattern = attributes
+        self._attrs: Optional[Dict[str, str]] = None
+        self._root = None
+
+    @property
+    def attrs(self) -> Dict[str, str]:
+        """正则取到的属性（未反转义），首次用到时扫描"""
+        if self._attrs is None:
+            self._attrs = dict(reversed(self._pattern.findall(self.message)))
+        return self._attrs
+
+    def get(self, name: str, default: str = "") -> str:
+        value = self.attrs.get(name)
+        if value is not None:
+            return unescape(value, ENTITIES) if "&" in value else value
+        root = self.root
+        if root is not None:
+            for element in root.iter(etree.Element):
+                value = element.get(name)
+                if value is not None:
+                    return value
+        return default
+
+    def text(self, tag: str, default: str = "") -> str:
+        """第一个 tag 节点的文本，CDATA 已展开"""
+        pattern = _text_patterns.get(tag) or text_pattern(tag)
+        match = pattern.search(self.message)
+        if match is not None:
+            cdata, text = match.groups()
+            if cdata is not None:
+                return cdata
+            return unescape(text, ENTITIES) if "&" in text else text
+        root = self.root
+        if root is not None:
+            for element in root.iter(tag):
+                if element.text is not None:
+                    return element.text
+        return default
+
+    @property
+    def root(self) -> Optional[etree._Element]:
+        """lxml 兜底，首次用到时才解析；解析失败记为 False，不再重试"""
+        if self._root is None:
+            try:
+                root = etree.fromstring(self.message.encode("utf-8"), event_parser())
+            except (etree.XMLSyntaxError, ValueError):
+                root = None
+            self._root = root if root is not None else False
+        return self._root if self._root is not False else None
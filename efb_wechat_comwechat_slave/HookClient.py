@@ -0,0 +1,104 @@
+# coding: utf-8
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Hook HTTP 接口类型，见 ComWeChatRobot http 文档
+START_IMAGE_HOOK = 11
+START_VOICE_HOOK = 13
+SET_VERSION = 35
+
+Validator = Callable[[Dict[str, Any]], bool]
+
+
+class HookError(Exception):
+    pass
+
+
+def result_ok(response: Dict[str, Any]) -> bool:
+    return response.get("result") == "OK"
+
+
+def msg_ok(response: Dict[str, Any]) -> bool:
+    return response.get("msg") == 1 and response.get("result") == "OK"
+
+
+class HookClient:
+    """
+    Hook 的 /api/?type=N 接口客户端：
+    - 复用同一个 keep-alive 连接池；
+    - 连接失败、超时、5xx 时按指数退避重试；
+    - 返回值必须是 JSON 对象，可再附加校验函数。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 18888, timeout: float = 5,
+                 retries: int = 2, backoff: float = 0.5, pool_size: int = 4):
+        self.base_url = f"http://{host}:{port}/api/"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+
+    def call(self, api_type: int, payload: Optional[Dict[str, Any]] = None,
+             validate: Optional[Validator] = None) -> Dict[str, Any]:
+        """
+        调用一个 Hook 接口
+        :raise HookError: 重试后仍失败，或返回值未通过校验
+        """
+        last_error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                resp = self.session.post(self.base_url, params={"type": api_type},
+                                         data=json.dumps(payload or {}), timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+                continue
+            if resp.status_code >= 500:
+                last_error = HookError(f"HTTP {resp.status_code}")
+                continue
+            if resp.status_code != 200:
+                raise HookError(f"type={api_type}: HTTP {resp.status_code}")
+            try:
+                data = json.loads(resp.content.decode("utf-8"), strict=False)
+            except ValueError:
+                raise HookError(f"type={api_type}: invalid JSON response: {resp.text.strip()[:200]}")
+            if not isinstance(data, dict):
+                raise HookError(f"type={api_type}: unexpected response: {data!r}")
+            if validate and not validate(data):
+                raise HookError(f"type={api_type}: rejected by hook: {data}")
+            return data
+        raise HookError(f"type={api_type}: {last_error}") from last_error
+
+    def call_many(self, calls: Dict[str, Tuple[int, Optional[Dict[str, Any]], Optional[Validator]]]
+                  ) -> Dict[str, Union[Dict[str, Any], Exception]]:
+        """
+        并发调用多个互不依赖的接口
+        :param calls: {名称 : (type, payload, validate)}
+        :return: {名称 : 返回值或异常}
+        """
+        if not calls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(len(calls), self.pool_size)) as executor:
+            futures = {name: executor.submit(self.call, *args) for name, args in calls.items()}
+        results: Dict[str, Union[Dict[str, Any], Exception]] = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = e
+        return results
+
+    def close(self):
+        self.session.close()
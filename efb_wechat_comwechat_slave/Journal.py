@@ -0,0 +1,177 @@
+# coding: utf-8
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Union
+
+from .Staging import COPY_CHUNK_SIZE, unlink_quietly
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1.0
+
+
+class JournalWriter:
+    """
+    入站 Hook 事件录制：每条原始消息写一行 JSON 到 gzip 日志，媒体文件按 sha1 存放在 media 目录，
+    日志中只记录哈希与相对路径。写入在独立线程中进行，队列满时丢弃并计数，不阻塞收消息。
+
+    记录格式：
+    {"t": 时间, "event": "group_msg", "msg": {...}}
+    {"t": 时间, "media": 相对 dir 的路径, "sha1": 哈希, "msgid": 消息 ID}
+    """
+
+    def __init__(self, directory: Union[str, Path], media: bool = True, queue_size: int = 10000):
+        self.directory = Path(directory)
+        self.media_dir = self.directory / "media"
+        self.media_dir.mkdir(parents=True, exist_ok=True)
+        self.media = media
+        self.path = self.directory / f"comwechat-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl.gz"
+        self._file = gzip.GzipFile(self.path, "wb", compresslevel=6)
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+
+        self.events = 0
+        self.media_files = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="journal")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+        logger.info(f"journal: recording inbound events to {self.path}")
+
+    def record_event(self, event: str, msg: Dict[str, Any]):
+        self._put({"t": time.time(), "event": event, "msg": dict(msg)})
+
+    def record_media(self, path: str, relpath: str, msgid: Any):
+        if self.media:
+            self._put((time.time(), path, relpath, msgid))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "events": self.events,
+            "media": self.media_files,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+        }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(10)
+
+    def _put(self, item):
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            try:
+                if isinstance(item, dict):
+                    self._write(item)
+                    self.events += 1
+                elif item:
+                    self._write_media(*item)
+            except Exception as e:
+                logger.warning(f"journal: failed to record: {e}")
+            now = time.monotonic()
+            if now - last_flush >= FLUSH_INTERVAL:
+                # 定期同步刷新，进程异常退出时日志可读到最近一次刷新为止
+                self._file.flush(zlib.Z_SYNC_FLUSH)
+                last_flush = now
+        self._file.close()
+
+    def _write(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+
+    def _write_media(self, timestamp: float, path: str, relpath: str, msgid: Any):
+        digest = file_digest(path)
+        target = self.media_dir / digest
+        if not target.exists():
+            tmp = f"{target}.{os.getpid()}.tmp"
+            try:
+                try:
+                    os.link(path, tmp)
+                except OSError:
+                    shutil.copyfile(path, tmp)
+                os.replace(tmp, target)
+            finally:
+                unlink_quietly(tmp)
+            self.media_files += 1
+        self._write({"t": timestamp, "media": relpath, "sha1": digest, "msgid": msgid})
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_journal(path: Union[str, Path]) -> Iterator[Dict[str, Any]]:
+    """逐行读取日志，容忍进程异常退出时未写完的结尾"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.endswith("\n"):
+                    yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            logger.debug(f"journal {path} ends without a trailer")
+
+
+def replay(path: Union[str, Path], emit: Callable[[str, Dict[str, Any]], None],
+           media_root: Optional[Union[str, Path]] = None, speed: float = 1.0):
+    """
+    按原始时间间隔回放日志
+    :param emit: 接收 (事件名, 消息) ，通常为 wechatrobot 的 Bus.emit，与真实 Hook 回调走同一路径
+    :param media_root: 媒体文件还原到的目录（通道的 dir），为空时不还原
+    :param speed: 回放倍速，0 为不等待
+    """
+    path = Path(path)
+    media_dir = path.parent / "media"
+    start = time.monotonic()
+    first: Optional[float] = None
+    for record in read_journal(path):
+        if first is None:
+            first = record["t"]
+        if speed > 0:
+            delay = (record["t"] - first) / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        if "event" in record:
+            emit(record["event"], record["msg"])
+        elif media_root is not None:
+            source = media_dir / record["sha1"]
+            target = Path(media_root) / record["media"]
+            if not source.exists():
+                logger.warning(f"journal media {record['sha1']} for {record['media']} is missing")
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, target)
@@ -0,0 +1,104 @@
+# coding: utf-8
+import base64
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DB_PATTERN = re.compile(r"^MediaMSG(\d+)\.db$")
+WHITESPACE = re.compile(r"\s+")
+
+
+class MediaDB:
+    """
+    MediaMSG*.db 访问：
+    - 缓存数据库句柄，查询失败时重新获取一次句柄后重试；
+    - 同一轮待取的语音合并为一条 IN (...) 查询；
+    - Buf 字段按块 base64 解码后直接写入目标文件，不在内存中保留完整的解码结果。
+    """
+
+    query_batch: int = 200
+    decode_chunk_size: int = 256 * 1024         # 必须是 4 的倍数
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._lock = threading.Lock()
+        self._handles: List[int] = []
+
+        self.queries = 0
+        self.refreshes = 0
+
+    def handles(self, refresh: bool = False) -> List[int]:
+        """所有 MediaMSG*.db 的句柄，按库编号排序"""
+        with self._lock:
+            if not self._handles or refresh:
+                data = self.bot.GetDatabaseHandles()["data"]
+                dbs = []
+                for i in data:
+                    match = MEDIA_DB_PATTERN.match(i["db_name"])
+                    if match:
+                        dbs.append((int(match.group(1)), i["handle"]))
+                self._handles = [handle for _, handle in sorted(dbs)]
+                if refresh:
+                    self.refreshes += 1
+            return self._handles
+
+    def query(self, sql: str) -> List[List[Any]]:
+        """在所有 MediaMSG*.db 上执行查询，返回不含表头的结果行"""
+        try:
+            return self._query(self.handles(), sql)
+        except Exception as e:
+            # 微信重新登录或库切换后句柄失效，重新获取一次
+            logger.debug(f"media db query failed, refreshing handles: {e}")
+            return self._query(self.handles(refresh=True), sql)
+
+    def _query(self, handles: List[int], sql: str) -> List[List[Any]]:
+        rows = []
+        for handle in handles:
+            self.queries += 1
+            result = self.bot.QueryDatabase(db_handle=handle, sql=sql)
+            rows.extend(result["data"][1:])
+        return rows
+
+    def fetch_voices(self, targets: Dict[str, str]) -> List[str]:
+        """
+        从数据库读取语音并写入目标路径
+        :param targets: {msgid : 目标路径}
+        :return: 已写入的路径
+        """
+        msgids = [msgid for msgid in targets if str(msgid).isdigit()]
+        found = []
+        for i in range(0, len(msgids), self.query_batch):
+            batch = msgids[i:i + self.query_batch]
+            sql = f'SELECT Reserved0,Buf FROM Media WHERE Reserved0 IN ({",".join(map(str, batch))})'
+            for msgid, buf in self.query(sql):
+                path = targets.get(str(msgid))
+                if path is None or not buf or path in found:
+                    continue
+                self.write_base64(buf, path)
+                found.append(path)
+        return found
+
+    def write_base64(self, buf: str, path: str):
+        if WHITESPACE.search(buf):
+            # 按块解码要求每块都是完整的 4 字符组，换行等空白会打乱对齐
+            buf = WHITESPACE.sub("", buf)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                for i in range(0, len(buf), self.decode_chunk_size):
+                    f.write(base64.b64decode(buf[i:i + self.decode_chunk_size]))
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "handles": len(self._handles),
+            "queries": self.queries,
+            "refreshes": self.refreshes,
+        }
@@ -0,0 +1,362 @@
+# coding: utf-8
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import itertools
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_IGNORED = 0x00008000
+IN_Q_OVERFLOW = 0x00004000
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    基于 ctypes 的 inotify 封装，只监听目录内 "写完关闭" 与 "移入" 两类事件
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + _INOTIFY_EVENT.size <= len(buf):
+                wd, mask, _, length = _INOTIFY_EVENT.unpack_from(buf, offset)
+                offset += _INOTIFY_EVENT.size
+                name = buf[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PendingMedia:
+    __slots__ = ("path", "entry", "added", "deadline", "interval", "token", "fallback", "watched")
+
+    def __init__(self, path: str, entry: Any, added: float, deadline: float, fallback: bool):
+        self.path = path
+        self.entry = entry
+        self.added = added
+        self.deadline = deadline
+        self.interval = 0.0
+        self.token = 0
+        self.fallback = fallback
+        self.watched = False
+
+
+class MediaWatcher:
+    """
+    等待微信把媒体文件落盘：
+    - inotify 监听文件所在目录，文件写完即释放；
+    - DrvFs/9p 等 inotify 不可靠的挂载点使用退避轮询兜底；
+    - 超时由按截止时间排序的最小堆处理，无待处理文件时线程完全阻塞。
+    """
+
+    poll_interval_min: float = 0.5
+    poll_interval_max: float = 4.0
+    watched_poll_interval: float = 30.0     # 有 inotify 时的兜底检查间隔
+
+    def __init__(self, on_ready: Callable[[str, Any, bool], None], time_out: int = 120,
+                 use_inotify: bool = True,
+                 fallback: Optional[Callable[[List[Tuple[str, Any]]], Iterable[str]]] = None):
+        """
+        :param on_ready: 回调 (path, entry, timed_out)，在监听线程中调用
+        :param time_out: 单个文件的最长等待时间（秒）
+        :param use_inotify: 是否尝试使用 inotify，失败时自动退回轮询
+        :param fallback: 可选，轮询到期时对标记了 fallback 的条目调用，返回已就绪的路径
+        """
+        self.on_ready = on_ready
+        self.time_out = time_out
+        self.fallback = fallback
+
+        self._lock = threading.Lock()
+        self._pending: Dict[str, PendingMedia] = {}
+        self._deadlines: List[Tuple[float, int, str]] = []
+        self._polls: List[Tuple[float, int, int, str]] = []
+        self._seq = itertools.count()
+
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+
+        self._inotify: Optional[Inotify] = None
+        self._watches: Dict[str, int] = {}          # dir -> wd
+        self._watch_dirs: Dict[int, str] = {}       # wd -> dir
+        self._watch_refs: Dict[int, int] = {}       # wd -> 引用计数
+        if use_inotify:
+            try:
+                self._inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify 不可用，改用轮询: {e}")
+
+        self.released = 0
+        self.timed_out = 0
+        self.waits = deque(maxlen=256)
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._inotify else "poll"
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add(self, path: str, entry: Any, fallback: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            old = self._pending.pop(path, None)
+            if old:
+                self._unwatch(old)
+            pending = PendingMedia(path, entry, now, now + self.time_out, fallback)
+            self._pending[path] = pending
+            self._watch(pending)
+            heapq.heappush(self._deadlines, (pending.deadline, next(self._seq), path))
+            # 立即检查一次，文件可能在加入之前就已经落盘
+            self._schedule_poll(pending, now)
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            oldest = min((p.added for p in self._pending.values()), default=now)
+            waits = list(self.waits)
+            return {
+                "mode": self.mode,
+                "pending": len(self._pending),
+                "oldest_wait": now - oldest,
+                "released": self.released,
+                "timed_out": self.timed_out,
+                "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+                "wait_max": max(waits, default=0.0),
+            }
+
+    def run(self):
+        while True:
+            try:
+                self._run_once()
+            except Exception as e:
+                logger.exception(f"media watcher error: {e}")
+                time.sleep(1)
+
+    def _run_once(self):
+        timeout = self._next_timeout()
+        fds = [self._wake_r]
+        if self._inotify:
+            fds.append(self._inotify.fd)
+        readable, _, _ = select.select(fds, [], [], timeout)
+        if self._wake_r in readable:
+            self._drain_wake()
+        ready: List[Tuple[PendingMedia, bool]] = []
+        if self._inotify and self._inotify.fd in readable:
+            ready.extend(self._handle_events())
+        ready.extend(self._handle_polls())
+        ready.extend(self._handle_deadlines())
+        for pending, timed_out in ready:
+            self._release(pending, timed_out)
+
+    def _next_timeout(self) -> Optional[float]:
+        with self._lock:
+            candidates = []
+            if self._deadlines:
+                candidates.append(self._deadlines[0][0])
+            if self._polls:
+                candidates.append(self._polls[0][0])
+        if not candidates:
+            return None
+        return max(0.0, min(candidates) - time.monotonic())
+
+    def _handle_events(self) -> List[Tuple[PendingMedia, bool]]:
+        ready = []
+        events = self._inotify.read_events()
+        with self._lock:
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    # 事件队列溢出，让所有条目尽快轮询一次
+                    now = time.monotonic()
+                    for pending in self._pending.values():
+                        self._schedule_poll(pending, now)
+                    continue
+                if mask & IN_IGNORED:
+                    directory = self._watch_dirs.pop(wd, None)
+                    self._watch_refs.pop(wd, None)
+                    if directory is not None:
+                        self._watches.pop(directory, None)
+                        # 目录被删除或卸载，监听已失效，该目录下的条目回到快速轮询
+                        now = time.monotonic()
+                        for pending in self._pending.values():
+                            if pending.watched and os.path.dirname(pending.path) == directory:
+                                pending.watched = False
+                                pending.interval = 0.0
+                                self._schedule_poll(pending, now)
+                    continue
+                directory = self._watch_dirs.get(wd)
+                if directory is None or not name:
+                    continue
+                pending = self._pending.pop(os.path.join(directory, name), None)
+                if pending:
+                    ready.append((pending, False))
+        return ready
+
+    def _handle_polls(self) -> List[Tuple[PendingMedia, bool]]:
+        now = time.monotonic()
+        due: List[PendingMedia] = []
+        with self._lock:
+            while self._polls and self._polls[0][0] <= now:
+                _, _, token, path = heapq.heappop(self._polls)
+                pending = self._pending.get(path)
+                if pending and pending.token == token:
+                    due.append(pending)
+
+        ready = []
+        missing: List[PendingMedia] = []
+        for pending in due:
+            if os.path.exists(pending.path):
+                ready.append(pending)
+            else:
+                missing.append(pending)
+
+        fallback = [p for p in missing if p.fallback]
+        if fallback and self.fallback:
+            try:
+                found = set(self.fallback([(p.path, p.entry) for p in fallback]) or ())
+            except Exception as e:
+                logger.warning(f"media fallback failed: {e}")
+                found = set()
+            ready.extend(p for p in fallback if p.path in found)
+            missing = [p for p in missing if p.path not in found]
+
+        result = []
+        with self._lock:
+            for pending in ready:
+                if self._pending.pop(pending.path, None) is pending:
+                    result.append((pending, False))
+            for pending in missing:
+                if self._pending.get(pending.path) is pending:
+                    self._backoff(pending, now)
+        return result
+
+    def _handle_deadlines(self) -> List[Tuple[PendingMedia, bool]]:
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                deadline, _, path = heapq.heappop(self._deadlines)
+                pending = self._pending.get(path)
+                if pending and pending.deadline == deadline:
+                    del self._pending[path]
+                    ready.append((pending, True))
+        return ready
+
+    def _backoff(self, pending: PendingMedia, now: float):
+        if pending.watched and not pending.fallback:
+            interval = self.watched_poll_interval
+        elif pending.interval:
+            interval = min(pending.interval * 2, self.poll_interval_max)
+        else:
+            interval = self.poll_interval_min
+        pending.interval = interval
+        self._schedule_poll(pending, now + interval)
+
+    def _schedule_poll(self, pending: PendingMedia, when: float):
+        pending.token = next(self._seq)
+        heapq.heappush(self._polls, (when, next(self._seq), pending.token, pending.path))
+
+    def _release(self, pending: PendingMedia, timed_out: bool):
+        wait = time.monotonic() - pending.added
+        with self._lock:
+            self._unwatch(pending)
+            self.waits.append(wait)
+            if timed_out:
+                self.timed_out += 1
+            else:
+                self.released += 1
+        if timed_out:
+            logger.debug(f"media timed out after {wait:.1f}s: {pending.path}")
+        else:
+            logger.debug(f"media ready after {wait:.1f}s: {pending.path}")
+        try:
+            self.on_ready(pending.path, pending.entry, timed_out)
+        except Exception as e:
+            logger.exception(f"media callback error: {e}")
+
+    def _watch(self, pending: PendingMedia):
+        if not self._inotify:
+            return
+        directory = os.path.dirname(pending.path)
+        wd = self._watches.get(directory)
+        if wd is None:
+            try:
+                wd = self._inotify.add_watch(directory)
+            except OSError as e:
+                # 目录尚不存在等情况，交给轮询
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    logger.debug(f"inotify watch failed on {directory}: {e}")
+                return
+            self._watches[directory] = wd
+            self._watch_dirs[wd] = directory
+        self._watch_refs[wd] = self._watch_refs.get(wd, 0) + 1
+        pending.watched = True
+
+    def _unwatch(self, pending: PendingMedia):
+        if not pending.watched:
+            return
+        pending.watched = False
+        directory = os.path.dirname(pending.path)
+        wd = self._watches.get(directory)
+        if wd is None:
+            return
+        refs = self._watch_refs.get(wd, 1) - 1
+        if refs > 0:
+            self._watch_refs[wd] = refs
+            return
+        self._watch_refs.pop(wd, None)
+        self._watch_dirs.pop(wd, None)
+        self._watches.pop(directory, None)
+        self._inotify.rm_watch(wd)
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _drain_wake(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
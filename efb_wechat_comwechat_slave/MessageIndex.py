@@ -0,0 +1,218 @@
+# coding: utf-8
+import atexit
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from ehforwarderbot import Message
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.5
+TEXT_LIMIT = 4096           # 超长文本只保留开头，引用回复和转发用不到全文
+
+
+class IndexedMessage(NamedTuple):
+    chat: str
+    msgid: str
+    time: float
+    type: str                       # MsgType 的值
+    author: str
+    author_name: str
+    author_alias: Optional[str]
+    text: str
+    xml_ref: Optional[str]          # XmlSpool 中原始 xml 的 key
+    path: Optional[str]             # 暂存的媒体文件，可能已被清理
+    filename: Optional[str]
+    mime: Optional[str]
+    info: Dict[str, Any]            # 精简后的 comwechat_info
+
+
+COLUMNS = IndexedMessage._fields
+INSERT = f"INSERT OR REPLACE INTO messages ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+
+class MessageIndex:
+    """
+    发往主端的消息索引，按 (chat uid, msgid) 查询，供 get_message_by_id 使用：
+    - 最近的 hot_size 条保存在内存 LRU 中，记录时立即可查；
+    - 写入在独立线程中按批提交到 SQLite（WAL），队列满时丢弃并计数，不阻塞收消息；
+    - 早于 retention_days 天或超出 max_entries 条的记录定期删除。
+    """
+
+    batch_size: int = 500
+    prune_every: int = 1000         # 每写入这么多条检查一次保留策略
+
+    def __init__(self, path: Union[str, Path], hot_size: int = 5000, retention_days: float = 30,
+                 max_entries: int = 200000, queue_size: int = 10000):
+        self.hot_size = hot_size
+        self.retention = retention_days * 86400
+        self.max_entries = max_entries
+        self._hot: "OrderedDict[Tuple[str, str], IndexedMessage]" = OrderedDict()
+        self._hot_lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS messages (chat TEXT NOT NULL, msgid TEXT NOT NULL, time REAL NOT NULL, "
+                         f"{', '.join(f'{c} TEXT' for c in COLUMNS[3:])}, PRIMARY KEY (chat, msgid))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_time ON messages (time)")
+        # 写线程独占一个连接，查询使用另一个，WAL 下读写互不阻塞
+        self._reader = sqlite3.connect(str(path), check_same_thread=False)
+        self._reader_lock = threading.Lock()
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._thread = threading.Thread(target=self._run, name="message_index")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, msg: Message):
+        """记录一条发往主端的消息，只做内存操作"""
+        if self._closed:
+            return
+        author = msg.author
+        vendor_specific = msg.vendor_specific or {}
+        entry = IndexedMessage(
+            chat = str(msg.chat.uid),
+            msgid = str(msg.uid),
+            time = time.time(),
+            type = msg.type.value,
+            author = str(author.uid) if author else "",
+            author_name = author.name if author else "",
+            author_alias = author.alias if author else None,
+            text = (msg.text or "")[:TEXT_LIMIT],
+            xml_ref = vendor_specific.get("wx_xml_ref"),
+            path = str(msg.path) if msg.path else None,
+            filename = msg.filename,
+            mime = msg.mime,
+            info = vendor_specific.get("comwechat_info") or {},
+        )
+        self._remember(entry)
+        self.recorded += 1
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def lookup(self, chat: str, msgid: str) -> Optional[IndexedMessage]:
+        key = (str(chat), str(msgid))
+        with self._hot_lock:
+            entry = self._hot.get(key)
+            if entry is not None:
+                self._hot.move_to_end(key)
+        if entry is not None:
+            if self._expired(entry):
+                return None
+            self.hits += 1
+            return entry
+        try:
+            with self._reader_lock:
+                row = self._reader.execute(f"SELECT {', '.join(COLUMNS)} FROM messages WHERE chat = ? AND msgid = ?",
+                                           key).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"message index: failed to look up {key}: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        entry = IndexedMessage(*row[:-1], info=json.loads(row[-1]) if row[-1] else {})
+        if self._expired(entry):
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._remember(entry)
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hot": len(self._hot),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(10)
+        with self._reader_lock:
+            self._reader.close()
+
+    def _remember(self, entry: IndexedMessage):
+        key = (entry.chat, entry.msgid)
+        with self._hot_lock:
+            self._hot[key] = entry
+            self._hot.move_to_end(key)
+            while len(self._hot) > self.hot_size:
+                self._hot.popitem(last=False)
+
+    def _expired(self, entry: IndexedMessage) -> bool:
+        return bool(self.retention) and entry.time < time.time() - self.retention
+
+    def _run(self):
+        pending = 0
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+            batch: List[IndexedMessage] = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+                pending += len(batch)
+                if pending >= self.prune_every:
+                    self._prune()
+                    pending = 0
+            if item is None:
+                break
+        self._db.close()
+
+    def _write(self, batch: List[IndexedMessage]):
+        rows = [entry[:-1] + (json.dumps(entry.info, ensure_ascii=False, default=str),) for entry in batch]
+        try:
+            self._db.execute("BEGIN")
+            self._db.executemany(INSERT, rows)
+            self._db.execute("COMMIT")
+            self.written += len(rows)
+        except sqlite3.Error as e:
+            logger.warning(f"message index: failed to write {len(rows)} messages: {e}")
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+
+    def _prune(self):
+        try:
+            if self.retention:
+                self._db.execute("DELETE FROM messages WHERE time < ?", (time.time() - self.retention,))
+            if self.max_entries:
+                self._db.execute("DELETE FROM messages WHERE rowid <= (SELECT MAX(rowid) FROM messages) - ?", (self.max_entries,))
+        except sqlite3.Error as e:
+            logger.warning(f"message index: failed to prune: {e}")
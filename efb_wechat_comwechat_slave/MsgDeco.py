@@ -1,13 +1,14 @@
-from typing import Mapping, Tuple, List, Union, IO
+from typing import Mapping, Tuple, List, Union, IO, NamedTuple, Optional
 import magic
 from lxml import etree
 from functools import partial
+from io import BytesIO
 from traceback import print_exc
 import re , json
 
 from ehforwarderbot import MsgType, Chat, coordinator
 from ehforwarderbot.chat import ChatMember
-from ehforwarderbot.message import Substitutions, Message, LinkAttribute, LocationAttribute
+from ehforwarderbot.message import Substitutions, Message, LinkAttribute, LocationAttribute, MessageCommand, MessageCommands
 from ehforwarderbot.types import MessageID
 
 from .ChatMgr import ChatMgr
@@ -20,63 +21,149 @@ def qutoed_text(qutoed_text: str, text: str, prefix: str = "") -> str:
         qutoed_text = qutoed_text.split(QUOTE_DIVIDER)[-1]
     return f"「{prefix}{qutoed_text}」\n{QUOTE_DIVIDER}\n{text}"
 
-def parse_chat_history(xml, level: int = 1) -> list[dict]:
-    res = []
-    datalist_element = xml.find('.//datalist')
-    if datalist_element is not None:
-        for dataitem in datalist_element.findall('dataitem'):
-            #TODO 想办法下载图片文件等
-            data = {
-                'datatype': dataitem.get('datatype'),
-                # 'dataid': dataitem.get('dataid'),
-                # 'messageuuid': dataitem.find('.//messageuuid').text if dataitem.find('.//messageuuid') is not None else '',
-                # 'cdnthumburl': dataitem.find('.//cdnthumburl').text if dataitem.find('.//cdnthumburl') is not None else '',
-                'datatitle': dataitem.find('.//datatitle').text if dataitem.find(
-                    './/datatitle') is not None else '',
-                'sourcetime': dataitem.find('.//sourcetime').text if dataitem.find(
-                    './/sourcetime') is not None else '',
-                # 'fromnewmsgid': dataitem.find('.//fromnewmsgid').text if dataitem.find('.//fromnewmsgid') is not None else '',
-                # 'datasize': dataitem.find('.//datasize').text if dataitem.find('.//datasize') is not None else '',
-                # 'thumbfullmd5': dataitem.find('.//thumbfullmd5').text if dataitem.find('.//thumbfullmd5') is not None else '',
-                'datafmt': dataitem.find('.//datafmt').text if dataitem.find(
-                    './/datafmt') is not None else '',
-                # 'cdnthumbkey': dataitem.find('.//cdnthumbkey').text if dataitem.find('.//cdnthumbkey') is not None else '',
-                'sourcename': dataitem.find('.//sourcename').text if dataitem.find(
-                    './/sourcename') is not None else '',
-                'sourceheadurl': dataitem.find('.//sourceheadurl').text if dataitem.find(
-                    './/sourceheadurl') is not None else '',
-                'datadesc': dataitem.find('.//datadesc').text if dataitem.find(
-                    './/datadesc') is not None else '',
-                'children': [],
-            }
-
-            prefix = f"{data['sourcename']}: "
-            count = 8 * level
-            if data['datatype'] == '1':
-                data['placeholder'] = data['datadesc']
-            elif data['datatype'] == '2':
-                data['placeholder'] = '[Photo]'
-            elif data['datatype'] == '4':
-                data['placeholder'] = '[Video]'
-            elif data['datatype'] == '5':
-                data['placeholder'] = f"[Link] {data['datatitle']}"
-            elif data['datatype'] == '8':
-                data['placeholder'] = f"[File] {data['datatitle']}"
-            elif data['datatype'] == '17':
-                data['placeholder'] = f"\n{' ' * count}[Chat History]"
-                for i in parse_chat_history(dataitem.find('recordxml/recordinfo'), level + 1):
-                    data['placeholder'] += f"\n{' ' * count}{i['formatted']}"
-                    data['children'] = i
-                data['placeholder'] += f"\n{' ' * count}[Chat History]"
-            elif data['datatype'] == '19':
-                data['placeholder'] = f"[Mini Program] {data['datatitle']}"
+CHAT_HISTORY_FIELDS = ('datatitle', 'sourcetime', 'datafmt', 'sourcename', 'sourceheadurl', 'datadesc')
+CHAT_HISTORY_MAX_ITEMS = 200
+CHAT_HISTORY_MAX_DEPTH = 5
+
+class ChatHistory(NamedTuple):
+    items: List[dict]           # 顶层条目，formatted 为展示文本
+    count: int                  # 已解析的条目数，含嵌套
+    total: Optional[int]        # 顶层 datalist 的 count 属性
+    truncated: bool             # 超出条目或层级预算，未完整展示
+
+class _HistoryItem:
+    """解析中的 dataitem"""
+    __slots__ = ("element", "level", "siblings", "fields", "recordinfo", "recordinfo_closed", "datalist", "children", "collapsed")
+
+    def __init__(self, element, level: int, siblings: list):
+        self.element = element
+        self.level = level
+        self.siblings = siblings
+        self.fields = {}
+        self.recordinfo = None
+        self.recordinfo_closed = False
+        self.datalist = None
+        self.children = []
+        self.collapsed = False
+
+    def finish(self, complete: bool = True) -> dict:
+        element = self.element
+        fields = self.fields
+        data = {'datatype': element.get('datatype')}
+        for name in CHAT_HISTORY_FIELDS:
+            # 与 dataitem.find('.//name').text 一致：取第一个后代节点，节点存在但无文本时为 None
+            field = fields.get(name)
+            data[name] = field.text if field is not None else ''
+        data['children'] = self.children[-1] if self.children else []
+
+        prefix = f"{data['sourcename']}: "
+        count = 8 * self.level
+        if data['datatype'] == '1':
+            data['placeholder'] = data['datadesc']
+        elif data['datatype'] == '2':
+            data['placeholder'] = '[Photo]'
+        elif data['datatype'] == '4':
+            data['placeholder'] = '[Video]'
+        elif data['datatype'] == '5':
+            data['placeholder'] = f"[Link] {data['datatitle']}"
+        elif data['datatype'] == '8':
+            data['placeholder'] = f"[File] {data['datatitle']}"
+        elif data['datatype'] == '17':
+            if self.collapsed:
+                data['placeholder'] = f"[Chat History] {data['datatitle']}"
             else:
-                data['placeholder'] = data['datadesc'] or data['datatitle']
-
-            data['formatted'] = f"{prefix} {data['placeholder']}"
-
-            res.append(data)
-    return res
+                if self.recordinfo is None and complete:
+                    raise ValueError("chat history item without recordxml/recordinfo")
+                indent = ' ' * count
+                lines = [f"\n{indent}[Chat History]"]
+                lines.extend(f"\n{indent}{child['formatted']}" for child in self.children)
+                lines.append(f"\n{indent}[Chat History]")
+                data['placeholder'] = "".join(lines)
+        elif data['datatype'] == '19':
+            data['placeholder'] = f"[Mini Program] {data['datatitle']}"
+        else:
+            data['placeholder'] = data['datadesc'] or data['datatitle']
+
+        data['formatted'] = f"{prefix} {data['placeholder']}"
+        return data
+
+def parse_chat_history(record: bytes, max_items: Optional[int] = None, max_depth: Optional[int] = None) -> ChatHistory:
+    """
+    合并转发的聊天记录（recordinfo xml），流式解析，嵌套的记录（datatype 17）用显式栈展开而非递归。
+    :param max_items: 最多解析的条目数（含嵌套），超出后停止解析
+    :param max_depth: 最多展开的层数，更深的嵌套记录只显示标题
+    """
+    items = []
+    stack: List[_HistoryItem] = []
+    top = None
+    total = None
+    count = 0
+    truncated = False
+    context = etree.iterparse(BytesIO(record), events=("start", "end"), resolve_entities=False,
+                              no_network=True, load_dtd=False, remove_comments=True, remove_pis=True)
+    for event, element in context:
+        tag = element.tag
+        if event == "start":
+            if tag in CHAT_HISTORY_FIELDS:
+                for item in stack:
+                    if tag not in item.fields:
+                        item.fields[tag] = element
+            elif tag == 'dataitem':
+                parent = element.getparent()
+                if parent is top:
+                    level, siblings = 1, items
+                elif stack and parent is stack[-1].datalist:
+                    level, siblings = stack[-1].level + 1, stack[-1].children
+                else:
+                    continue
+                if max_items is not None and count >= max_items:
+                    truncated = True
+                    break
+                count += 1
+                item = _HistoryItem(element, level, siblings)
+                if element.get('datatype') == '17' and max_depth is not None and level >= max_depth:
+                    item.collapsed = True
+                    truncated = True
+                stack.append(item)
+            elif tag == 'datalist':
+                if top is None:
+                    top = element
+                    total = element.get('count')
+                elif stack:
+                    item = stack[-1]
+                    if item.recordinfo is not None and not item.recordinfo_closed and item.datalist is None and not item.collapsed:
+                        item.datalist = element
+            elif tag == 'recordinfo' and stack:
+                item = stack[-1]
+                parent = element.getparent()
+                if item.recordinfo is None and parent is not None and parent.tag == 'recordxml' \
+                        and parent.getparent() is item.element:
+                    item.recordinfo = element
+        elif stack:
+            item = stack[-1]
+            if element is item.element:
+                stack.pop()
+                item.siblings.append(item.finish())
+                if item.level == 1:
+                    # 顶层条目处理完即释放，超长记录不在内存中保留整棵树
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del top[0]
+            elif element is item.recordinfo:
+                item.recordinfo_closed = True
+    while stack:
+        item = stack.pop()
+        item.siblings.append(item.finish(complete=False))
+    return ChatHistory(items, count, int(total) if total and total.isdigit() else None, truncated)
+
+def format_chat_history(history: ChatHistory) -> str:
+    text = "\n".join(data['formatted'] for data in history.items)
+    if history.truncated:
+        if history.total is not None and history.total > len(history.items):
+            text += f"\n\n[聊天记录过长，仅显示前 {len(history.items)} 条，共 {history.total} 条]"
+        else:
+            text += "\n\n[聊天记录过长，部分内容未显示]"
+    return text
 
 def efb_text_simple_wrapper(text: str, ats: Union[Mapping[Tuple[int, int], Union[Chat, ChatMember]], None] = None) -> Message:
     """
@@ -207,6 +294,413 @@ def efb_mp_post_wrapper(item: etree.Element, show_name: str = None) -> Message:
         text=f'{title}\n  - - - - - - - - - - - - - - - \n{digest}' if digest else str(title),
     )
 
+# appmsg 中不在常用字段里的路径，预编译后在各类型处理函数中复用
+XPATH_ITEMS = etree.XPath('//item')
+XPATH_PUBLISHER_NICKNAME = etree.XPath('//publisher/nickname/text()')
+XPATH_RANK_DISPLAY = etree.XPath('/msg/appmsg/hardwareinfo/messagenodeinfo/rankinfo/rank/rankdisplay/text()')
+XPATH_SCORE_DISPLAY = etree.XPath('/msg/appmsg/hardwareinfo/messagenodeinfo/rankinfo/score/scoredisplay/text()')
+XPATH_RECORD_DATADESC = etree.XPath('/recordinfo/datalist/dataitem/datadesc/text()')
+XPATH_WEAPP_ICON_URL = etree.XPath('/msg/appmsg/weappinfo/weappiconurl/text()')
+XPATH_FINDER_FEED_AVATAR = etree.XPath('/msg/appmsg/finderFeed/avatar/text()')
+XPATH_FINDER_FEED_DESC = etree.XPath('/msg/appmsg/finderFeed/desc/text()')
+XPATH_FINDER_LIVE_HEAD_URL = etree.XPath('/msg/appmsg/finderLive/headUrl/text()')
+XPATH_FINDER_LIVE_DESC = etree.XPath('/msg/appmsg/finderLive/desc/text()')
+XPATH_REFER_TYPE = etree.XPath('/msg/appmsg/refermsg/type/text()')
+XPATH_REFER_SVRID = etree.XPath('/msg/appmsg/refermsg/svrid/text()')
+XPATH_REFER_FROMUSR = etree.XPath('/msg/appmsg/refermsg/fromusr/text()')
+XPATH_REFER_CHATUSR = etree.XPath('/msg/appmsg/refermsg/chatusr/text()')
+XPATH_REFER_DISPLAYNAME = etree.XPath('/msg/appmsg/refermsg/displayname/text()')
+XPATH_REFER_CONTENT = etree.XPath('/msg/appmsg/refermsg/content/text()')
+XPATH_APPMSG_TYPE = etree.XPath('/msg/appmsg/type/text()')
+XPATH_APPMSG_TITLE = etree.XPath('/msg/appmsg/title/text()')
+XPATH_PAY_SUBTYPE = etree.XPath('/msg/appmsg/wcpayinfo/paysubtype/text()')
+XPATH_PAY_FEEDESC = etree.XPath('/msg/appmsg/wcpayinfo/feedesc/text()')
+
+APPMSG_FIELDS = frozenset(("type", "title", "des", "url", "showtype", "thumburl",
+                           "sourceusername", "sourcedisplayname", "recorditem"))
+APPINFO_FIELDS = frozenset(("appname",))
+
+TRANSFER_ACTIONS = {"1": "收到", "3": "接收", "4": "退还"}
+
+
+class AppMsg:
+    """
+    /msg/appmsg 与 /msg/appinfo 下的常用字段，遍历一次子节点取出。
+    取值与 xpath('.../text()')[0] 一致，字段缺失或没有文本时为 None
+    """
+    __slots__ = ("xml", "type", "title", "des", "url", "showtype", "thumburl",
+                 "sourceusername", "sourcedisplayname", "recorditem", "appname")
+
+    def __init__(self, xml):
+        self.xml = xml
+        self.type = self.title = self.des = self.url = self.showtype = self.thumburl = None
+        self.sourceusername = self.sourcedisplayname = self.recorditem = self.appname = None
+        if xml.tag != 'msg':
+            return
+        for section in xml:
+            if section.tag == 'appmsg':
+                fields = APPMSG_FIELDS
+            elif section.tag == 'appinfo':
+                fields = APPINFO_FIELDS
+            else:
+                continue
+            for child in section:
+                tag = child.tag
+                if tag in fields and getattr(self, tag) is None:
+                    setattr(self, tag, _first_text(child))
+
+
+def _first_text(element):
+    if element.text is not None or not len(element):
+        return element.text
+    # 文本在子节点之后时 .text 为空，与 text() 保持一致
+    texts = element.xpath('text()')
+    return texts[0] if texts else None
+
+
+def _required(value):
+    """与 xpath(...)[0] 相同，缺失时抛出 IndexError，由外层回退为原始文本"""
+    if value is None:
+        raise IndexError(value)
+    return value
+
+
+def _appmsg_text(app: AppMsg, message: dict, chat):
+    """1 : 百度网盘分享, 2 : 微信运动"""
+    title = _required(app.title)
+    des = _required(app.des)
+    return Message(
+        type = MsgType.Text,
+        text = title if title==des else title+" :\n"+des,
+    )
+
+
+def _appmsg_music(app: AppMsg, message: dict, chat):
+    """3 : 音乐分享"""
+    if app.title is None or app.des is None:
+        return Message(
+            type = MsgType.Text,
+            text = "- - - - - - - - - - - - - - - \n无效的音乐分享",
+        )
+    if app.url is None:
+        return None
+    attribute = LinkAttribute(
+        title = app.title + ' / ' + app.des,
+        description = None,
+        url = app.url ,
+        image = None
+    )
+    return Message(
+        attributes=attribute,
+        type=MsgType.Link,
+        text= None,
+        vendor_specific={ "is_mp": False }
+    )
+
+
+def _appmsg_app_link(app: AppMsg, message: dict, chat):
+    """4, 36 : 至少包含小红书分享 , 京东农场 , 滴滴打车"""
+    title = _required(app.title)
+    des = app.des if app.des is not None else ""
+    url = _required(app.url)
+    description = f"{des}\n---- from {_required(app.appname)}"
+    attribute = LinkAttribute(
+        title = title,
+        description = description,
+        url = url ,
+        image = None
+    )
+    return Message(
+        attributes=attribute,
+        type=MsgType.Link,
+        text= None,
+        vendor_specific={ "is_mp": False }
+    )
+
+
+def _appmsg_link(app: AppMsg, message: dict, chat):
+    """5 : xml链接"""
+    showtype = int(app.showtype) if app.showtype is not None else 0
+    if showtype == 0: # 消息对话中的(测试的是从公众号转发给好友, 不排除其他情况)
+        title = app.title if app.title is not None else "[xml 消息解析，点击查看详情]"
+        if '<' in title and '>' in title:
+            title = re.sub('<[\s\S]+?>', '', title)
+        if app.url is None:
+            return None
+        des = app.des
+        if app.appname is not None:
+            des = f"{des}\n---- from {app.appname}"
+        result_text = ""
+        if app.sourceusername is not None and app.sourcedisplayname is not None:
+            result_text = f"\n转发自公众号[{app.sourcedisplayname}(id: {app.sourceusername})]\n\n"
+        attribute = LinkAttribute(
+            title=title,
+            description=des,
+            url=app.url,
+            image=app.thumburl
+        )
+        return Message(
+            attributes=attribute,
+            type=MsgType.Link,
+            text=result_text,
+            vendor_specific={ "is_mp": True }
+        )
+    elif showtype == 1: # 公众号发的推送
+        items = XPATH_ITEMS(app.xml)
+        show_name = XPATH_PUBLISHER_NICKNAME(app.xml)[0] if '@app' in message['message'] else ''
+        return list(map(partial(efb_mp_post_wrapper, show_name=show_name), items))
+
+
+def _appmsg_unsupported_image(app: AppMsg, message: dict, chat):
+    """8 : 未解析图片消息"""
+    return Message(
+        type=MsgType.Unsupported,
+        text='未解密表情消息 ，请在手机端查看',
+    )
+
+
+def _appmsg_title(app: AppMsg, message: dict, chat):
+    """17 : 实时位置共享"""
+    return Message(
+        type=MsgType.Text,
+        text=_required(app.title),
+    )
+
+
+def _appmsg_chat_history(app: AppMsg, message: dict, chat):
+    """19 : 合并转发的聊天记录"""
+    msg_title = app.title if app.title is not None else ""
+    commands = None
+    try:
+        record = app.xml.find('.//recorditem').text.encode('utf-8')
+        channel = ChatMgr.slave_channel
+        history = parse_chat_history(record,
+                                     getattr(channel, "chat_history_max_items", CHAT_HISTORY_MAX_ITEMS),
+                                     getattr(channel, "chat_history_max_depth", CHAT_HISTORY_MAX_DEPTH))
+        forward_content = format_chat_history(history)
+        if history.truncated and channel is not None:
+            commands = MessageCommands([
+                MessageCommand(
+                    name="View more",
+                    callable_name="view_chat_history",
+                    kwargs={"key": channel.keep_chat_history(record)},
+                )
+            ])
+    except Exception as e:
+        forward_content = _required(app.des)
+    return Message(
+        type=MsgType.Text,
+        text= f"{msg_title}\n\n{forward_content}",
+        vendor_specific={ "is_forwarded": True },
+        commands=commands,
+    )
+
+
+def _appmsg_wechat_sport(app: AppMsg, message: dict, chat):
+    """21 : 微信运动"""
+    msg_title = _required(app.title).strip("<![CDATA[夺得").strip("冠军]]>")
+    if '排行' not in msg_title:
+        return Message(
+            type=MsgType.Text,
+            text= msg_title.strip() ,
+        )
+    rank = XPATH_RANK_DISPLAY(app.xml)[0].strip("<![CDATA[").strip("]]>")
+    steps = XPATH_SCORE_DISPLAY(app.xml)[0].strip("<![CDATA[").strip("]]>")
+    return Message(
+        type=MsgType.Text,
+        text=f"{msg_title}\n\n排名: {rank}\n步数: {steps}",
+        vendor_specific={ "is_wechatsport": True }
+    )
+
+
+def _appmsg_note(app: AppMsg, message: dict, chat):
+    """24 : 从收藏中分享的笔记"""
+    desc = _required(app.des)
+    recordinfo = etree.fromstring(_required(app.recorditem))
+    datadesc = XPATH_RECORD_DATADESC(recordinfo)[0]
+    return Message(
+        type=MsgType.Text,
+        text= '微信笔记 :\n  - - - - - - - - - - - - - - - \n' +desc + '\n' + datadesc,
+        vendor_specific={ "is_mp": True }
+    )
+
+
+def _appmsg_miniprogram(app: AppMsg, message: dict, chat):
+    """33 : 美团外卖"""
+    sourcedisplayname = _required(app.sourcedisplayname)
+    weappiconurl = XPATH_WEAPP_ICON_URL(app.xml)[0]
+    attribute = LinkAttribute(
+        title=sourcedisplayname,
+        description=None,
+        url=_required(app.url),
+        image=weappiconurl
+    )
+    return Message(
+        attributes=attribute,
+        type=MsgType.Link,
+        text=None,
+        vendor_specific={ "is_mp": True }
+    )
+
+
+def _appmsg_sync(app: AppMsg, message: dict, chat):
+    """35 : 消息同步"""
+    return Message(
+        type=MsgType.Text,
+        text= '系统消息 : 消息同步',
+        vendor_specific={ "is_mp": False }
+    )
+
+
+def _appmsg_forwarded(app: AppMsg, message: dict, chat):
+    """40 : 转发的转发消息"""
+    title = _required(app.title)
+    desc = _required(app.des)
+    return Message(
+        type=MsgType.Text,
+        text= f"{title}\n\n{desc}" ,
+        vendor_specific={ "is_forwarded": True }
+    )
+
+
+def _appmsg_finder_feed(app: AppMsg, message: dict, chat):
+    """51 : 视频（微信视频号分享）"""
+    title = _required(app.title)
+    url = _required(app.url)
+    avatar = XPATH_FINDER_FEED_AVATAR(app.xml)
+    imgurl = avatar[0].strip("<![CDATA[").strip("]]>") if avatar else None
+    desc = XPATH_FINDER_FEED_DESC(app.xml)
+    desc = desc[0] if desc else None
+    attribute = LinkAttribute(
+        title=title,
+        description=  '\n' + desc,
+        url= url,
+        image= imgurl
+    )
+    return Message(
+        attributes=attribute,
+        type=MsgType.Link,
+        text=f"微信视频号分享\n - - - - - - - - - - - - - - - \n",
+        vendor_specific={ "is_mp": True }
+    )
+
+
+def _appmsg_refer(app: AppMsg, message: dict, chat):
+    """57 : 引用(回复)消息"""
+    xml = app.xml
+    msg = _required(app.title)
+    refer_msgType = int(XPATH_REFER_TYPE(xml)[0]) # 被引用消息类型
+    e = XPATH_REFER_SVRID(xml) # 被引用消息 id
+    refer_svrid = len(e) > 0 and e[0] or None
+    e = XPATH_REFER_FROMUSR(xml) # 被引用消息所在房间
+    refer_fromusr = len(e) > 0 and e[0] or None
+    e = XPATH_REFER_CHATUSR(xml) # 被引用消息发送人微信号
+    refer_chatusr = len(e) > 0 and e[0] or None
+    e = XPATH_REFER_DISPLAYNAME(xml) # 被引用消息发送人微信名称
+    refer_displayname = len(e) > 0 and e[0] or refer_chatusr
+    efb_msg = Message(
+        type=MsgType.Text,
+        text=msg,
+        vendor_specific={ "is_refer": True }
+    )
+    prefix = ""
+    sent_by_master = True
+    if refer_svrid is not None:
+        try:
+            # 从 master channel 中根据微信 id 查找，如果找到说明是由 comwechat self_msg 发送过去的
+            master_message = coordinator.master.get_message_by_id(chat=chat, msg_id=refer_svrid)
+            if master_message is not None:
+                sent_by_master = False
+        except:
+            pass
+    if refer_displayname is not None:
+        prefix = f"{refer_displayname}:"
+    if refer_svrid is None or (refer_chatusr == message["self"] and sent_by_master):
+        if refer_msgType == 1: # 被引用的消息是文本
+            refer_content = XPATH_REFER_CONTENT(xml) # 被引用消息内容
+            if not refer_content:
+                return efb_msg
+            result_text = qutoed_text(refer_content[0], msg, prefix)
+        elif refer_msgType == 49: # 被引用的消息也是引用消息
+            result_text = ""
+            try:
+                refer_msg_content = XPATH_REFER_CONTENT(xml)[0] # 被引用消息引用的消息
+                refer_msg_xml = etree.fromstring(refer_msg_content)
+                if int(XPATH_APPMSG_TYPE(refer_msg_xml)[0]) == 57:
+                    refer_msg_text = XPATH_APPMSG_TITLE(refer_msg_xml)[0]
+                    result_text = qutoed_text(refer_msg_text, msg, prefix)
+                else:
+                    result_text = msg
+            except Exception as e:
+                print_exc()
+        else: # 被引用的消息非文本，提示不支持
+            result_text = qutoed_text(" 系统消息: 被引用的消息不是文本,暂不支持展示", msg, prefix)
+        efb_msg.text = result_text
+    else:
+        efb_msg.target = Message(
+            uid=MessageID(refer_svrid),
+            chat=chat,
+        )
+    return efb_msg
+
+
+def _appmsg_finder_live(app: AppMsg, message: dict, chat):
+    """63 : 直播（微信视频号分享）"""
+    title = _required(app.title)
+    url = _required(app.url)
+    imgurl = XPATH_FINDER_LIVE_HEAD_URL(app.xml)[0].strip("<![CDATA[").strip("]]>")
+    desc = XPATH_FINDER_LIVE_DESC(app.xml)[0].strip("<![CDATA[").strip("]]>")
+    attribute = LinkAttribute(
+        title=title,
+        description= '\n' + desc ,
+        url= url,
+        image= imgurl
+    )
+    return Message(
+        attributes=attribute,
+        type=MsgType.Link,
+        text=f"视频号直播分享\n  - - - - - - - - - - - - - - - \n",
+        vendor_specific={ "is_mp": True }
+    )
+
+
+def _appmsg_transfer(app: AppMsg, message: dict, chat):
+    """2000 : 转账"""
+    subtype = XPATH_PAY_SUBTYPE(app.xml)[0]
+    money = XPATH_PAY_FEEDESC(app.xml)[0].strip("<![CDATA[").strip("]]>")
+    if subtype in TRANSFER_ACTIONS:
+        return Message(
+            type=MsgType.Text,
+            text= f"{TRANSFER_ACTIONS[subtype]}微信转账 {money} 元",
+            vendor_specific={ "is_mp": False }
+        )
+
+
+# //appmsg/type -> 处理函数，返回 None 时按原始 xml 文本发送
+APPMSG_HANDLERS = {
+    1: _appmsg_text,
+    2: _appmsg_text,
+    3: _appmsg_music,
+    4: _appmsg_app_link,
+    5: _appmsg_link,
+    8: _appmsg_unsupported_image,
+    17: _appmsg_title,
+    19: _appmsg_chat_history,
+    21: _appmsg_wechat_sport,
+    24: _appmsg_note,
+    33: _appmsg_miniprogram,
+    35: _appmsg_sync,
+    36: _appmsg_app_link,
+    40: _appmsg_forwarded,
+    51: _appmsg_finder_feed,
+    57: _appmsg_refer,
+    63: _appmsg_finder_live,
+    2000: _appmsg_transfer,
+}
+
+# 不转发的类型： 87 : 群公告
+APPMSG_IGNORED = frozenset((87,))
+
 def efb_share_link_wrapper(message: dict, chat) -> Message:
     """
     处理msgType49消息 - 复合xml, xml 中 //appmsg/type 指示具体消息类型.
@@ -233,343 +727,31 @@ def efb_share_link_wrapper(message: dict, chat) -> Message:
     //appmsg/type = 74 : 文件 (收到文件的第一个提示)
     //appmsg/type = 87 : 群公告
     //appmsg/type = 2000 : 转账
+    各类型的处理见 APPMSG_HANDLERS
     :param message: The message
     :return: EFB Message
     """
 
     text: str = message['message']
     xml = etree.fromstring(text)
-    result_text = ""
+    efb_msg = None
     try:
-        type = int(xml.xpath('/msg/appmsg/type/text()')[0])
-        if type in [ 1 , 2 ]:
-            title = xml.xpath('/msg/appmsg/title/text()')[0]
-            des = xml.xpath('/msg/appmsg/des/text()')[0]
-            efb_msg = Message(
-                type = MsgType.Text,
-                text = title if title==des else title+" :\n"+des,
-            )
-        elif type == 3: #音乐分享
-            try:
-                music_name = xml.xpath('/msg/appmsg/title/text()')[0]
-                music_singer = xml.xpath('/msg/appmsg/des/text()')[0]
-            except:
-                efb_msg = Message(
-                    type = MsgType.Text,
-                    text = "- - - - - - - - - - - - - - - \n无效的音乐分享",
-                )
-            try:
-                thumb_url = xml.xpath('/msg/appmsg/url/text()')[0]
-                attribute = LinkAttribute(
-                    title = music_name + ' / ' + music_singer,
-                    description = None,
-                    url = thumb_url ,
-                    image = None
-                )
-                efb_msg = Message(
-                    attributes=attribute,
-                    type=MsgType.Link,
-                    text= None,
-                    vendor_specific={ "is_mp": False }
-                )
-            except:
-                pass
-        elif type in [ 4 , 36 ]: # 至少包含小红书分享 , 京东农场 , 滴滴打车
-            title = xml.xpath('/msg/appmsg/title/text()')[0]
-            try:
-                des = xml.xpath('/msg/appmsg/des/text()')[0]
-            except:
-                des = ""
-            url = xml.xpath('/msg/appmsg/url/text()')[0]
-            app = xml.xpath('/msg/appinfo/appname/text()')[0]
-            description = f"{des}\n---- from {app}"
-            attribute = LinkAttribute(
-                title = title,
-                description = description,
-                url = url ,
-                image = None
-            )
-            efb_msg = Message(
-                attributes=attribute,
-                type=MsgType.Link,
-                text= None,
-                vendor_specific={ "is_mp": False }
-            )
-        elif type == 5: # xml链接
-            if len(xml.xpath('/msg/appmsg/showtype/text()'))!=0:
-                showtype = int(xml.xpath('/msg/appmsg/showtype/text()')[0])
-            else:
-                showtype = 0
-            if showtype == 0: # 消息对话中的(测试的是从公众号转发给好友, 不排除其他情况)
-                title = url = des = thumburl = None # 初始化
-                try:
-                    try:
-                        title = xml.xpath('/msg/appmsg/title/text()')[0]
-                    except:
-                        title = "[xml 消息解析，点击查看详情]"
-                    if '<' in title and '>' in title:
-                        subs = re.findall('<[\s\S]+?>', title)
-                        for sub in subs:
-                            title = title.replace(sub, '')
-                    url = xml.xpath('/msg/appmsg/url/text()')[0]
-                    if len(xml.xpath('/msg/appmsg/des/text()'))!=0:
-                        des = xml.xpath('/msg/appmsg/des/text()')[0]
-                    if len(xml.xpath('/msg/appmsg/thumburl/text()'))!=0:
-                        thumburl = xml.xpath('/msg/appmsg/thumburl/text()')[0]
-                    if len(xml.xpath('/msg/appinfo/appname/text()'))!=0:
-                        app = xml.xpath('/msg/appinfo/appname/text()')[0]
-                        des = f"{des}\n---- from {app}"
-
-                    if len(xml.xpath('/msg/appmsg/sourceusername/text()'))!=0:
-                        sourceusername = xml.xpath('/msg/appmsg/sourceusername/text()')[0]
-                        try:
-                            sourcedisplayname = xml.xpath('/msg/appmsg/sourcedisplayname/text()')[0]
-                            result_text += f"\n转发自公众号[{sourcedisplayname}(id: {sourceusername})]\n\n"
-                        except:
-                            result_text += f"\n转发自公众号[{sourcedisplayname}]\n\n"
-                except Exception as e:
-                    print_exc()
-                if title is not None and url is not None:
-                    attribute = LinkAttribute(
-                        title=title,
-                        description=des,
-                        url=url,
-                        image=thumburl
-                    )
-                    efb_msg = Message(
-                        attributes=attribute,
-                        type=MsgType.Link,
-                        text=result_text,
-                        vendor_specific={ "is_mp": True }
-                    )
-            elif showtype == 1: # 公众号发的推送
-                items = xml.xpath('//item')
-                show_name = xml.xpath('//publisher/nickname/text()')[0] if '@app' in text else ''
-                efb_msg = list(map(partial(efb_mp_post_wrapper, show_name=show_name), items))
-        elif type == 8:
-            efb_msg = Message(
-                type=MsgType.Unsupported,
-                text='未解密表情消息 ，请在手机端查看',
-            )
-        elif type == 17:
-            msg_title = xml.xpath('/msg/appmsg/title/text()')[0]
-            efb_msg = Message(
-                type=MsgType.Text,
-                text=msg_title,
-            )
-        elif type == 19: # 合并转发的聊天记录
-            try:
-                msg_title = xml.xpath('/msg/appmsg/title/text()')[0]
-            except:
-                msg_title = ""
-            try:
-                recorditem_element = xml.find('.//recorditem')
-                inner_xml_string = recorditem_element.text
-                recordinfo_root = etree.fromstring(inner_xml_string.encode('utf-8'))
-                texts = []
-                for data in parse_chat_history(recordinfo_root):
-                    texts.append(data['formatted'])
-                forward_content = "\n".join(texts)
-            except Exception as e:
-                forward_content = xml.xpath('/msg/appmsg/des/text()')[0]
-
-            result_text += f"{msg_title}\n\n{forward_content}"
-            efb_msg = Message(
-                type=MsgType.Text,
-                text= result_text,
-                vendor_specific={ "is_forwarded": True }
-            )
-        elif type == 21: # 微信运动
-            msg_title = xml.xpath('/msg/appmsg/title/text()')[0].strip("<![CDATA[夺得").strip("冠军]]>")
-            if '排行' not in msg_title:
-                msg_title = msg_title.strip()
-                efb_msg = Message(
-                    type=MsgType.Text,
-                    text= msg_title ,
-                )
-            else:
-                rank = xml.xpath('/msg/appmsg/hardwareinfo/messagenodeinfo/rankinfo/rank/rankdisplay/text()')[0].strip("<![CDATA[").strip("]]>")
-                steps = xml.xpath('/msg/appmsg/hardwareinfo/messagenodeinfo/rankinfo/score/scoredisplay/text()')[0].strip("<![CDATA[").strip("]]>")
-                result_text += f"{msg_title}\n\n排名: {rank}\n步数: {steps}"
-                efb_msg = Message(
-                    type=MsgType.Text,
-                    text=result_text,
-                    vendor_specific={ "is_wechatsport": True }
-                )
-        elif type == 24:
-            desc = xml.xpath('/msg/appmsg/des/text()')[0]
-            recorditem = xml.xpath('/msg/appmsg/recorditem/text()')[0]
-            xml = etree.fromstring(recorditem)
-            datadesc = xml.xpath('/recordinfo/datalist/dataitem/datadesc/text()')[0]
-            efb_msg = Message(
-                type=MsgType.Text,
-                text= '微信笔记 :\n  - - - - - - - - - - - - - - - \n' +desc + '\n' + datadesc,
-                vendor_specific={ "is_mp": True }
-            )
-        elif type == 33:
-            sourcedisplayname = xml.xpath('/msg/appmsg/sourcedisplayname/text()')[0]
-            weappiconurl = xml.xpath('/msg/appmsg/weappinfo/weappiconurl/text()')[0]
-            url = xml.xpath('/msg/appmsg/url/text()')[0]
-            attribute = LinkAttribute(
-                title=sourcedisplayname,
-                description=None,
-                url=url,
-                image=weappiconurl
-            )
-            efb_msg = Message(
-                attributes=attribute,
-                type=MsgType.Link,
-                text=None,
-                vendor_specific={ "is_mp": True }
-            )
-        elif type == 35:
-            efb_msg = Message(
-                type=MsgType.Text,
-                text= '系统消息 : 消息同步',
-                vendor_specific={ "is_mp": False }
-            )
-        elif type == 40: # 转发的转发消息
-            title = xml.xpath('/msg/appmsg/title/text()')[0]
-            desc = xml.xpath('/msg/appmsg/des/text()')[0]
-            efb_msg = Message(
-                type=MsgType.Text,
-                text= f"{title}\n\n{desc}" ,
-                vendor_specific={ "is_forwarded": True }
-            )
-        elif type == 51: # 视频（微信视频号分享）
-            title = xml.xpath('/msg/appmsg/title/text()')[0]
-            url = xml.xpath('/msg/appmsg/url/text()')[0]
-            if len(xml.xpath('/msg/appmsg/finderFeed/avatar/text()'))!=0:
-                imgurl = xml.xpath('/msg/appmsg/finderFeed/avatar/text()')[0].strip("<![CDATA[").strip("]]>")
-            else:
-                imgurl = None
-            if len(xml.xpath('/msg/appmsg/finderFeed/desc/text()'))!=0:
-                desc = xml.xpath('/msg/appmsg/finderFeed/desc/text()')[0]
-            else:
-                desc = None
-            result_text += f"微信视频号分享\n - - - - - - - - - - - - - - - \n"
-            attribute = LinkAttribute(
-                title=title,
-                description=  '\n' + desc,
-                url= url,
-                image= imgurl
-            )
-            efb_msg = Message(
-                attributes=attribute,
-                type=MsgType.Link,
-                text=result_text,
-                vendor_specific={ "is_mp": True }
-            )
-        elif type == 57: # 引用（回复）消息
-            msg = xml.xpath('/msg/appmsg/title/text()')[0]
-            refer_msgType = int(xml.xpath('/msg/appmsg/refermsg/type/text()')[0]) # 被引用消息类型
-            e = xml.xpath('/msg/appmsg/refermsg/svrid/text()') # 被引用消息 id
-            refer_svrid = len(e) > 0 and e[0] or None
-            e = xml.xpath('/msg/appmsg/refermsg/fromusr/text()') # 被引用消息所在房间
-            refer_fromusr = len(e) > 0 and e[0] or None
-            e = xml.xpath('/msg/appmsg/refermsg/chatusr/text()') # 被引用消息发送人微信号
-            refer_chatusr = len(e) > 0 and e[0] or None
-            e = xml.xpath('/msg/appmsg/refermsg/displayname/text()') # 被引用消息发送人微信名称
-            refer_displayname = len(e) > 0 and e[0] or refer_chatusr
-            efb_msg = Message(
-                type=MsgType.Text,
-                text=msg,
-                vendor_specific={ "is_refer": True }
-            )
-            prefix = ""
-            sent_by_master = True
-            if refer_svrid is not None:
-                try:
-                    # 从 master channel 中根据微信 id 查找，如果找到说明是由 comwechat self_msg 发送过去的
-                    master_message = coordinator.master.get_message_by_id(chat=chat, msg_id=refer_svrid)
-                    if master_message is not None:
-                        sent_by_master = False
-                except:
-                    pass
-            if refer_displayname is not None:
-                prefix = f"{refer_displayname}:"
-            if refer_svrid is None or (refer_chatusr == message["self"] and sent_by_master):
-                if refer_msgType == 1: # 被引用的消息是文本
-                    refer_content = xml.xpath('/msg/appmsg/refermsg/content/text()')[0] # 被引用消息内容
-                    result_text = qutoed_text(refer_content, msg, prefix)
-                elif refer_msgType == 49: # 被引用的消息也是引用消息
-                    try:
-                        refer_msg_content = xml.xpath('/msg/appmsg/refermsg/content/text()')[0] # 被引用消息引用的消息
-                        refer_msg_xml = etree.fromstring(refer_msg_content)
-                        type = int(refer_msg_xml.xpath('/msg/appmsg/type/text()')[0])
-                        if type == 57:
-                            refer_msg_text = refer_msg_xml.xpath('/msg/appmsg/title/text()')[0]
-                            result_text = qutoed_text(refer_msg_text, msg, prefix)
-                        else:
-                            result_text = msg
-                    except Exception as e:
-                        print_exc()
-                else: # 被引用的消息非文本，提示不支持
-                    result_text = qutoed_text(" 系统消息: 被引用的消息不是文本,暂不支持展示", msg, prefix)
-                efb_msg.text = result_text
-            else:
-                efb_msg.target = Message(
-                    uid=MessageID(refer_svrid),
-                    chat=chat,
-                )
-        elif type == 63: # 直播（微信视频号分享）
-            title = xml.xpath('/msg/appmsg/title/text()')[0]
-            url = xml.xpath('/msg/appmsg/url/text()')[0]
-            imgurl = xml.xpath('/msg/appmsg/finderLive/headUrl/text()')[0].strip("<![CDATA[").strip("]]>")
-            desc = xml.xpath('/msg/appmsg/finderLive/desc/text()')[0].strip("<![CDATA[").strip("]]>")
-            result_text += f"视频号直播分享\n  - - - - - - - - - - - - - - - \n"
-            attribute = LinkAttribute(
-                title=title,
-                description= '\n' + desc ,
-                url= url,
-                image= imgurl
-            )
-            efb_msg = Message(
-                attributes=attribute,
-                type=MsgType.Link,
-                text=result_text,
-                vendor_specific={ "is_mp": True }
-            )
-        elif type == 87: # 群公告
+        app = AppMsg(xml)
+        type = int(_required(app.type))
+        if type in APPMSG_IGNORED:
             return
-        #     title = xml.xpath('/msg/appmsg/textannouncement/text()')[0]
-        #     efb_msg = Message(
-        #         type=MsgType.Text,
-        #         text= f"[群公告]:\n{title}" ,
-        #         vendor_specific={ "is_mp": False }
-        #     )
-        elif type == 2000:
-            subtype = xml.xpath("/msg/appmsg/wcpayinfo/paysubtype/text()")[0]
-            money =  xml.xpath("/msg/appmsg/wcpayinfo/feedesc/text()")[0].strip("<![CDATA[").strip("]]>")
-            if subtype == "1":
-                efb_msg = Message(
-                    type=MsgType.Text,
-                    text= f"收到微信转账 {money} 元",
-                    vendor_specific={ "is_mp": False }
-                )
-            elif subtype == "3":
-                efb_msg = Message(
-                    type=MsgType.Text,
-                    text= f"接收微信转账 {money} 元",
-                    vendor_specific={ "is_mp": False }
-                )
-            elif subtype == "4":
-                efb_msg = Message(
-                    type=MsgType.Text,
-                    text= f"退还微信转账 {money} 元",
-                    vendor_specific={ "is_mp": False }
-                )
+        handler = APPMSG_HANDLERS.get(type)
+        if handler is not None:
+            efb_msg = handler(app, message, chat)
     except Exception as e:
         print_exc()
 
-    try:
-        return efb_msg
-    except:
+    if efb_msg is None:
         efb_msg = Message(
             type=MsgType.Text,
             text=text
         )
-        return efb_msg
+    return efb_msg
 
 def efb_location_wrapper(msg: str) -> Message:
     efb_msg = Message()
@@ -4,6 +4,7 @@ import tempfile
 import logging
 from .Utils import *
 from .MsgDeco import *
+from .ChatMgr import ChatMgr
 import re
 import pydub
 import json
@@ -12,15 +13,27 @@ from lxml import etree
 from ehforwarderbot import utils as efb_utils
 from ehforwarderbot.message import Message
 
+# 随消息保留的 Hook 字段，其余（原始 xml、extrainfo、文件路径等）不随消息常驻内存
+COMWECHAT_INFO_KEYS = ("type", "msgid", "sender", "wxid", "self", "isSendMsg", "isSendByPhone", "time", "timestamp")
+
 def MsgWrapper(msg, efb_msgs:  Union[Message, List[Message]]):
     efb_msgs = [efb_msgs] if isinstance(efb_msgs, Message) else efb_msgs
     if not efb_msgs:
         return
+    xml = msg.pop("message", None)
+    comwechat_info = {k: msg[k] for k in COMWECHAT_INFO_KEYS if k in msg}
+    spool = getattr(ChatMgr.slave_channel, "xml_spool", None)
+    xml_ref = None
+    if spool is not None and xml:
+        # 原始 xml 放入 XmlSpool，消息中只保留引用，引用回复时再取出
+        xml_ref = spool.put(str(msg["msgid"]), xml)
     for efb_msg in efb_msgs:
         vendor_specific = getattr(efb_msg, "vendor_specific", {})
-        xml = msg.pop("message", None)
-        vendor_specific["wx_xml"] = xml
-        vendor_specific["comwechat_info"] = msg
+        if xml_ref is not None:
+            vendor_specific["wx_xml_ref"] = xml_ref
+        else:
+            vendor_specific["wx_xml"] = xml
+        vendor_specific["comwechat_info"] = comwechat_info
         setattr(efb_msg, "vendor_specific", vendor_specific)
     return efb_msgs
 
@@ -51,7 +64,11 @@ def MsgProcess(msg : dict , chat) -> Union[Message, List[Message]]:
         return efb_text_simple_wrapper("[" + msg['message'] + "]")
 
     elif msg["type"] == "image":
-        file = wechatimagedecode(msg["filepath"])
+        try:
+            file = wechatimagedecode(msg["filepath"])
+        except ValueError as e:
+            logging.getLogger(__name__).warning(f"Failed to decode image {msg['filepath']}: {e}")
+            return efb_text_simple_wrapper("Image received and decode failed. Please check it on your phone.")
         return efb_image_wrapper(file)
 
     elif msg["type"] == "animatedsticker":
@@ -64,16 +81,20 @@ def MsgProcess(msg : dict , chat) -> Union[Message, List[Message]]:
 
     elif msg["type"] == "share":
         if ("FileStorage" in msg["filepath"]) and ("Cache" not in msg["filepath"]):
-            file = load_local_file_to_temp(msg["filepath"])
+            file = ChatMgr.slave_channel.inbound_stager.stage(msg["filepath"])
             return efb_file_wrapper(file, os.path.basename(msg["filepath"]))
         return efb_share_link_wrapper(msg, chat)  # may return msgs in a list
 
     elif msg["type"] == "voice":
-        file = convert_silk_to_mp3(load_local_file_to_temp(msg["filepath"]))
-        return efb_voice_wrapper(file , file.name + ".ogg")
+        try:
+            file = ChatMgr.slave_channel.transcoder.silk_to_ogg(msg["filepath"])
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Failed to convert voice {msg['filepath']}: {e}")
+            return efb_text_simple_wrapper("Voice received and convert failed. Please check it on your phone.")
+        return efb_voice_wrapper(file , os.path.basename(file.name))
 
     elif msg["type"] == "video":
-        file = load_local_file_to_temp(msg["filepath"])
+        file = ChatMgr.slave_channel.inbound_stager.stage(msg["filepath"])
         return efb_video_wrapper(file)
 
     elif msg["type"] == "location":
@@ -0,0 +1,127 @@
+# coding: utf-8
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, List, Optional
+
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class NameResolver:
+    """
+    不在联系人目录中的 wxid（群内陌生人、公众号、新成员）的名称查询：
+    - 查到的名称与查不到的 wxid 分别缓存，后者有效期较短；
+    - 同一 wxid 的并发查询合并为一次；
+    - 可按群批量预取成员名称，一次查询代替逐条查询。
+    """
+
+    def __init__(self, fetch: Callable[[str], Optional[str]],
+                 fetch_many: Optional[Callable[[List[str]], Dict[str, str]]] = None,
+                 batchable: Optional[Callable[[str], bool]] = None,
+                 ttl: int = 3600, negative_ttl: int = 300, maxsize: int = 10000):
+        """
+        :param fetch: 查询单个 wxid 的名称，查不到返回 None
+        :param fetch_many: 可选，批量查询，返回 {wxid : 名称}，未返回的视为查不到
+        :param batchable: 可选，fetch_many 能查询的 wxid，其余不参与预取，留给 fetch 逐个查询
+        """
+        self.fetch = fetch
+        self.fetch_many = fetch_many
+        self.batchable = batchable
+        self._names = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._missing = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+        self._prefetched = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+
+    def resolve(self, wxid: str) -> Optional[str]:
+        with self._lock:
+            name = self._names.get(wxid)
+            if name is not None or wxid in self._missing:
+                self.hits += 1
+                return name
+            future = self._inflight.get(wxid)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[wxid] = future
+                self.misses += 1
+        if not owner:
+            return future.result()
+
+        name = None
+        try:
+            self.lookups += 1
+            name = self.fetch(wxid) or None
+            with self._lock:
+                self._store(wxid, name)
+        except Exception as e:
+            # 查询失败不缓存，下次重试
+            logger.warning(f"resolve name of {wxid} failed: {e}")
+        finally:
+            with self._lock:
+                self._inflight.pop(wxid, None)
+            future.set_result(name)
+        return name
+
+    def prefetch(self, key: str, wxids: Iterable[str]) -> int:
+        """
+        批量预取一组 wxid 的名称，同一个 key（如群 id）在缓存有效期内只预取一次
+        :return: 查到名称的数量
+        """
+        if not self.fetch_many:
+            return 0
+        with self._lock:
+            if key in self._prefetched:
+                return 0
+            self._prefetched[key] = True
+            wxids = [wxid for wxid in wxids
+                     if wxid not in self._names and wxid not in self._missing and wxid not in self._inflight
+                     and (self.batchable is None or self.batchable(wxid))]
+        if not wxids:
+            return 0
+        try:
+            self.lookups += 1
+            names = self.fetch_many(wxids)
+        except Exception as e:
+            logger.warning(f"prefetch names for {key} failed: {e}")
+            with self._lock:
+                self._prefetched.pop(key, None)
+            return 0
+        with self._lock:
+            for wxid in wxids:
+                self._store(wxid, names.get(wxid) or None)
+        logger.debug(f"prefetched {len(names)}/{len(wxids)} names for {key}")
+        return len(names)
+
+    def invalidate(self, wxid: Optional[str] = None):
+        with self._lock:
+            if wxid is None:
+                self._names.clear()
+                self._missing.clear()
+                self._prefetched.clear()
+                return
+            self._names.pop(wxid, None)
+            self._missing.pop(wxid, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "names": len(self._names),
+            "missing": len(self._missing),
+            "hits": self.hits,
+            "misses": self.misses,
+            "lookups": self.lookups,
+        }
+
+    def _store(self, wxid: str, name: Optional[str]):
+        if name is None:
+            self._names.pop(wxid, None)
+            self._missing[wxid] = True
+        else:
+            self._missing.pop(wxid, None)
+            self._names[wxid] = name
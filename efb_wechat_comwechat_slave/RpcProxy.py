@@ -0,0 +1,151 @@
+# coding: utf-8
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .Metrics import REGISTRY, Registry
+
+logger = logging.getLogger(__name__)
+
+# 只读接口，失败时可以安全重试
+IDEMPOTENT_METHODS = frozenset({
+    "IsLoginIn", "GetSelfInfo", "GetQrcodeImage",
+    "GetDatabaseHandles", "GetDBHandle", "QueryDatabase",
+    "GetContactBySql", "GetContactListBySql", "GetAllGroupMembersBySql", "GetPictureBySql",
+    "GetChatroomMemberList", "GetChatroomMemberNickname",
+})
+
+
+# 默认超时（秒），大文件发送与全量查询需要更长时间
+DEFAULT_TIMEOUTS = {
+    "SendFile": 300,
+    "QueryDatabase": 60,
+    "GetContactListBySql": 120,
+    "GetAllGroupMembersBySql": 120,
+}
+
+
+class RpcTimeout(TimeoutError):
+    pass
+
+
+class InstrumentedBot:
+    """
+    WeChatRobot 代理：首字母大写的方法（即 Hook 接口）经过统计，其余属性（on / run / api 等）原样透传。
+    - 按方法统计调用次数、失败次数与耗时分布；
+    - 可按方法设置超时：Api.post 换成带超时的连接池请求，超时后请求即中止，调用方得到 RpcTimeout；
+      没有 Api.post 的 bot 退回到线程池中等待，超时时取消尚未开始的调用；
+    - 只读接口可以按 retries 重试。
+    """
+
+    def __init__(self, bot, timeout: Optional[float] = None, timeouts: Optional[Dict[str, float]] = None,
+                 retries: int = 0, idempotent: Iterable[str] = IDEMPOTENT_METHODS,
+                 registry: Registry = REGISTRY, workers: int = 8):
+        self._bot = bot
+        self._timeout = timeout
+        self._timeouts = dict(timeouts or {})
+        self._retries = retries
+        self._idempotent = frozenset(idempotent)
+        self._wrapped: Dict[str, Callable] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._workers = workers
+        self._local = threading.local()
+        self._session: Optional[requests.Session] = None
+        api = getattr(bot, "api", None)
+        if api is not None and callable(getattr(api, "post", None)):
+            # wechatrobot 的 Api.post 直接调用 requests.post，没有超时，挂起的请求会一直占着调用线程
+            self._session = requests.Session()
+            self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+            api.post = self._post
+
+        self._calls = registry.counter("comwechat_rpc_calls_total", "Hook RPC calls", ("method",))
+        self._errors = registry.counter("comwechat_rpc_errors_total", "Hook RPC failures", ("method",))
+        self._latency = registry.histogram("comwechat_rpc_latency_seconds", "Hook RPC latency", ("method",))
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        wrapped = self._wrapped.get(name)
+        if wrapped is not None:
+            return wrapped
+        attr = getattr(self._bot, name)
+        if not name[:1].isupper() or not callable(attr):
+            return attr
+        wrapped = self._wrap(name)
+        self._wrapped[name] = wrapped
+        return wrapped
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for (method,), calls in self._calls.children():
+            latency = self._latency.labels(method)
+            result[method] = {
+                "calls": calls.value,
+                "errors": self._errors.labels(method).value,
+                "avg": latency.sum / latency.count if latency.count else 0.0,
+                "p95": latency.quantile(0.95),
+            }
+        return result
+
+    def _wrap(self, name: str) -> Callable:
+        timeout = self._timeouts.get(name, self._timeout)
+        retries = self._retries if name in self._idempotent else 0
+        calls = self._calls.labels(name)
+        errors = self._errors.labels(name)
+        latency = self._latency.labels(name)
+
+        def call(*args, **kwargs):
+            for attempt in range(retries + 1):
+                calls.inc()
+                start = time.perf_counter()
+                try:
+                    # 每次重新取方法，WeChatRobot 的 __getattr__ 会返回当前的 Api 绑定
+                    method = getattr(self._bot, name)
+                    if timeout and self._session is None:
+                        return self._call_with_timeout(name, timeout, method, args, kwargs)
+                    self._local.timeout = timeout or None
+                    try:
+                        return method(*args, **kwargs)
+                    except requests.Timeout:
+                        raise RpcTimeout(f"{name} timed out after {timeout}s")
+                    finally:
+                        self._local.timeout = None
+                except Exception as e:
+                    errors.inc()
+                    if attempt >= retries:
+                        raise
+                    logger.debug(f"rpc {name} failed, retrying ({attempt + 1}/{retries}): {e}")
+                finally:
+                    latency.observe(time.perf_counter() - start)
+
+        call.__name__ = name
+        return call
+
+    def _call_with_timeout(self, name: str, timeout: float, method: Callable, args, kwargs) -> Any:
+        future = self._get_executor().submit(method, *args, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # 还在排队的调用不再执行，避免调用方已得到超时后消息又被发出
+            future.cancel()
+            raise RpcTimeout(f"{name} timed out after {timeout}s")
+
+    def _post(self, type: int, params) -> Dict:
+        """替换 Api.post：同样的请求，带上当前调用的超时"""
+        resp = self._session.post(f"http://127.0.0.1:{self._bot.api.port}/api/?type={type}", data=params.json(),
+                                  timeout=getattr(self._local, "timeout", None))
+        return json.loads(resp.content.decode("utf-8"), strict=False)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="rpc")
+        return self._executor
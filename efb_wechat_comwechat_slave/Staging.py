@@ -0,0 +1,254 @@
+# coding: utf-8
+import contextlib
+import errno
+import functools
+import hashlib
+import io
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Union
+
+from .CleanupScheduler import CleanupScheduler
+
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def copy_file_chunked(src: BinaryIO, dst: BinaryIO, chunk_size: int = COPY_CHUNK_SIZE):
+    """
+    分块复制文件内容，优先使用 sendfile 在内核中完成，不支持时退回 copyfileobj。
+    sendfile 中途失败时，从已写入的位置接着复制，不会重复写入
+    """
+    dst.flush()
+    start = offset = src.tell()
+    dst_start = dst.tell()
+    try:
+        while True:
+            sent = os.sendfile(dst.fileno(), src.fileno(), offset, chunk_size)
+            if not sent:
+                break
+            offset += sent
+    except (OSError, AttributeError, io.UnsupportedOperation):
+        src.seek(offset)
+        dst.seek(dst_start + offset - start)
+        dst.truncate()
+        shutil.copyfileobj(src, dst, chunk_size)
+    else:
+        src.seek(offset)
+        dst.seek(dst_start + offset - start)
+    dst.flush()
+
+
+def reflink(src: str, dst: str) -> bool:
+    """尝试以写时复制方式克隆文件（btrfs/xfs 等），失败时不留下目标文件"""
+    try:
+        import fcntl
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except (OSError, ImportError):
+        unlink_quietly(dst)
+        return False
+
+
+def unlink_quietly(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class StagedFile(io.BufferedReader):
+    """
+    只读文件句柄，cleanup 为 True 时关闭后删除对应路径（暂存目录中的链接）
+    """
+
+    def __init__(self, path: Union[str, Path], cleanup: bool = False):
+        super().__init__(io.FileIO(str(path), 'rb'))
+        self.cleanup = cleanup
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        if self.cleanup:
+            unlink_quietly(self.name)
+
+
+class InboundStager:
+    """
+    入站文件/视频交给主端前的暂存：
+    - 小于 buffer_limit 的文件分块复制到临时文件，与微信目录隔离；
+    - 更大的文件不再复制：同一文件系统下硬链接（或 reflink）到暂存目录，
+      否则直接交出原文件的只读句柄。
+    mode 为 copy 时所有文件都分块复制。
+    """
+
+    MODES = ("link", "copy")
+
+    def __init__(self, spool_dir: Union[str, Path], buffer_limit: int = 8 * 1024 * 1024, mode: str = "link"):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown staging mode: {mode}")
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.buffer_limit = buffer_limit
+        self.mode = mode
+        self._seq = itertools.count()
+        self.counts: Dict[str, int] = {"copied": 0, "linked": 0, "reflinked": 0, "original": 0}
+        self._sweep()
+
+    def stage(self, path: str) -> BinaryIO:
+        size = os.path.getsize(path)
+        if self.mode == "link" and size > self.buffer_limit:
+            staged = self._link(path)
+            if staged is not None:
+                return StagedFile(staged, cleanup=True)
+            self.counts["original"] += 1
+            return StagedFile(path)
+        return self._copy(path)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counts)
+
+    def _copy(self, path: str) -> BinaryIO:
+        ret_file = tempfile.NamedTemporaryFile()
+        with open(path, 'rb') as f:
+            copy_file_chunked(f, ret_file)
+        ret_file.seek(0)
+        self.counts["copied"] += 1
+        return ret_file
+
+    def _link(self, path: str) -> Optional[str]:
+        target = str(self.spool_dir / f"{os.getpid()}-{next(self._seq)}")
+        try:
+            os.link(path, target)
+            self.counts["linked"] += 1
+            return target
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES):
+                logger.debug(f"link {path} failed: {e}")
+        if reflink(path, target):
+            self.counts["reflinked"] += 1
+            return target
+        return None
+
+    def _sweep(self):
+        """清理上次异常退出时遗留在暂存目录中的链接"""
+        for path in self.spool_dir.iterdir():
+            if path.is_file():
+                unlink_quietly(str(path))
+
+
+class OutboundStager:
+    """
+    发送给微信的文件暂存到 Hook 可见的目录：
+    - 按 (内容哈希, 文件名) 去重，同一文件转发到多个聊天只暂存一份；
+    - 能硬链接时不复制，否则分块复制；
+    - 引用计数，最后一次发送完成后再等待 grace 秒删除（微信在发送接口返回后仍可能在读取文件），
+      期间再次使用会取消删除。
+    启动时清空暂存目录，删除上次异常退出遗留的文件。
+    """
+
+    def __init__(self, root: Union[str, Path], scheduler: CleanupScheduler, grace: int = 120):
+        self.root = Path(root)
+        self.scheduler = scheduler
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._refs: Dict[str, int] = {}
+        self._sizes: Dict[str, int] = {}
+
+        self.staged = 0
+        self.reused = 0
+        self.sweep()
+
+    @property
+    def staged_bytes(self) -> int:
+        """暂存目录中文件占用的字节数"""
+        return sum(self._sizes.values())
+
+    def acquire(self, file: BinaryIO, filename: str) -> str:
+        """暂存文件并增加引用，返回暂存后的本地路径"""
+        digest = stream_digest(file)
+        path = str(self.root / digest[:16] / os.path.basename(filename))
+        with self._lock:
+            self._refs[path] = self._refs.get(path, 0) + 1
+            pending = self.scheduler.cancel(path)
+            if (pending or self._refs[path] > 1) and path in self._sizes and os.path.exists(path):
+                self.reused += 1
+                return path
+        try:
+            size = self._write(file, path)
+        except BaseException:
+            self.release(path, grace=0)
+            raise
+        with self._lock:
+            self._sizes[path] = size
+        self.staged += 1
+        return path
+
+    def release(self, path: str, grace: Optional[int] = None):
+        with self._lock:
+            refs = self._refs.get(path, 0) - 1
+            if refs > 0:
+                self._refs[path] = refs
+                return
+            self._refs.pop(path, None)
+            self.scheduler.schedule(path, self.grace if grace is None else grace,
+                                    functools.partial(self._remove, path))
+
+    def sweep(self):
+        removed = 0
+        if self.root.is_dir():
+            for path in sorted(self.root.rglob("*"), reverse=True):
+                with contextlib.suppress(OSError):
+                    if path.is_dir():
+                        path.rmdir()
+                    else:
+                        path.unlink()
+                        removed += 1
+        if removed:
+            logger.info(f"cleaned {removed} orphaned files in {self.root}")
+
+    def _remove(self, path: str):
+        with self._lock:
+            if self._refs.get(path):
+                return
+            self._sizes.pop(path, None)
+            unlink_quietly(path)
+            with contextlib.suppress(OSError):
+                os.rmdir(os.path.dirname(path))
+
+    def _write(self, file: BinaryIO, path: str) -> int:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            try:
+                os.link(file.name, tmp)
+            except (OSError, AttributeError, TypeError):
+                file.seek(0)
+                with open(tmp, 'wb') as f:
+                    copy_file_chunked(file, f)
+            os.replace(tmp, path)
+        finally:
+            unlink_quietly(tmp)
+            file.seek(0)
+        return os.path.getsize(path)
+
+
+def stream_digest(file: BinaryIO, chunk_size: int = COPY_CHUNK_SIZE) -> str:
+    h = hashlib.sha1()
+    file.seek(0)
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        h.update(chunk)
+    file.seek(0)
+    return h.hexdigest()
@@ -0,0 +1,101 @@
+# coding: utf-8
+import collections
+import math
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+# 消息在各阶段的时间点，按先后顺序
+RECEIVED = "received"           # Hook 收到消息（消息自带的 timestamp，秒级）
+HOOK = "hook"                   # Hook 回调进入本进程
+HANDLER = "handler"             # 入站线程开始处理
+MEDIA_READY = "media_ready"     # 媒体文件落盘（仅文件类消息）
+PROCESS_START = "process_start"
+PROCESS_END = "process_end"
+DELIVERED = "delivered"         # coordinator.send_message 返回
+
+STAGES = (RECEIVED, HOOK, HANDLER, MEDIA_READY, PROCESS_START, PROCESS_END, DELIVERED)
+
+Trace = Dict[str, Any]
+
+
+class Tracer:
+    """
+    入站消息端到端耗时追踪。每条消息的 trace 为 {阶段 : 时间}，随消息字典传递，
+    投递完成后放入固定长度的环形缓冲区，/trace 统计最近 N 条各阶段耗时的分位数。
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, size: int = 1000):
+        self.size = size
+        self._lock = threading.Lock()
+        self._traces: Deque[Trace] = collections.deque(maxlen=size)
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def start(self, msg: Dict[str, Any]) -> Optional[Trace]:
+        if not self.enabled:
+            return None
+        trace = {"msgid": msg.get("msgid"), "type": msg.get("type"), HOOK: time.time()}
+        try:
+            trace[RECEIVED] = float(msg["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            pass
+        return trace
+
+    @staticmethod
+    def mark(trace: Optional[Trace], stage: str):
+        if trace is not None:
+            trace[stage] = time.time()
+
+    def finish(self, trace: Optional[Trace]):
+        if trace is None:
+            return
+        trace[DELIVERED] = time.time()
+        with self._lock:
+            self._traces.append(trace)
+
+    def recent(self, n: Optional[int] = None) -> List[Trace]:
+        with self._lock:
+            traces = list(self._traces)
+        return traces[-n:] if n else traces
+
+    def summary(self, n: Optional[int] = None) -> Dict[str, Dict[str, float]]:
+        """
+        各阶段相对上一个已记录阶段的耗时（秒）的分位数，total 为从第一个阶段到投递完成
+        :return: {阶段 : {"count": 条数, "p50": ..., "p95": ..., "p99": ...}}
+        """
+        durations: Dict[str, List[float]] = {stage: [] for stage in STAGES[1:]}
+        durations["total"] = []
+        for trace in self.recent(n):
+            previous = None
+            for stage in STAGES:
+                if stage not in trace:
+                    continue
+                if previous is not None:
+                    durations[stage].append(max(trace[stage] - previous, 0.0))
+                previous = trace[stage]
+            first = next(trace[stage] for stage in STAGES if stage in trace)
+            durations["total"].append(max(trace[DELIVERED] - first, 0.0))
+        return {stage: _quantiles(values, self.QUANTILES) for stage, values in durations.items() if values}
+
+    def report(self, n: Optional[int] = None) -> str:
+        summary = self.summary(n)
+        if not summary:
+            return "暂无追踪数据"
+        lines = [f"最近 {len(self.recent(n))} 条消息各阶段耗时 (ms)  p50 / p95 / p99"]
+        for stage, q in summary.items():
+            lines.append(f"{stage} [{q['count']}]: {q['p50'] * 1000:.1f} / {q['p95'] * 1000:.1f} / {q['p99'] * 1000:.1f}")
+        return "\n".join(lines)
+
+
+def _quantiles(values: List[float], quantiles) -> Dict[str, float]:
+    values = sorted(values)
+    result = {"count": len(values)}
+    for q in quantiles:
+        index = max(math.ceil(q * len(values)) - 1, 0)
+        result[f"p{round(q * 100)}"] = values[index]
+    return result
@@ -0,0 +1,268 @@
+# coding: utf-8
+import hashlib
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Optional, Tuple, Union
+
+from .Metrics import REGISTRY
+from .Utils import convert_silk_to_ogg_file, convert_silk_to_ogg_stream, convert_ogg_to_mp3_file
+
+logger = logging.getLogger(__name__)
+
+SILK_TO_OGG = "silk2ogg"
+OGG_TO_MP3 = "ogg2mp3"
+
+# file: 经由临时文件 / pipe: 经由管道，不落地中间文件
+TRANSCODERS: Dict[Tuple[str, str], Callable[[str, str], None]] = {
+    (SILK_TO_OGG, "file"): convert_silk_to_ogg_file,
+    (SILK_TO_OGG, "pipe"): convert_silk_to_ogg_stream,
+    (OGG_TO_MP3, "file"): convert_ogg_to_mp3_file,
+}
+TRANSCODE_SECONDS = REGISTRY.histogram("comwechat_transcode_seconds", "Voice transcoding time", ("kind",))
+
+SUBMIT_ATTEMPTS = 3     # 被其他任务的超时重建连带终止时，最多提交的次数
+
+SUFFIXES = {
+    SILK_TO_OGG: ".ogg",
+    OGG_TO_MP3: ".mp3",
+}
+
+
+def _init_worker():
+    """工作进程自成一个进程组，pydub/管道模式启动的 ffmpeg 随之加入，超时时整组结束"""
+    if hasattr(os, "setsid"):
+        try:
+            os.setsid()
+        except OSError:
+            pass
+
+
+def _transcode(kind: str, mode: str, src: str, dst: str) -> int:
+    """在工作进程中执行，返回输出文件大小"""
+    converter = TRANSCODERS.get((kind, mode)) or TRANSCODERS[(kind, "file")]
+    converter(src, dst)
+    return os.path.getsize(dst)
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Transcoder:
+    """
+    语音转码服务：
+    - 常驻进程池执行 pilk/ffmpeg 转码，并发任务数有上限；
+    - 每个任务有超时，超时后重建进程池，被连带终止的其他任务在新进程池中重新提交；
+    - 以 (转码类型, 输入内容哈希) 为键缓存结果，重复转发/重复投递的语音不再转码。
+    返回值为缓存文件的只读句柄，调用方负责关闭。
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], workers: int = 2, max_pending: int = 16,
+                 timeout: int = 60, cache_size: int = 200 * 1024 * 1024, voice_pipeline: str = "pipe"):
+        self.cache_dir = Path(cache_dir)
+        if voice_pipeline == "pipe" and not hasattr(os, "mkfifo"):
+            voice_pipeline = "file"
+        self.voice_pipeline = voice_pipeline
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = max(0, int(workers))
+        self.timeout = timeout
+        self.cache_size = cache_size
+
+        self._slots = threading.BoundedSemaphore(max(1, int(max_pending)))
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._generation = 0            # 进程池每重建一次加一
+        self._inserts = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.seconds = 0.0
+
+    def silk_to_ogg(self, src: str) -> BinaryIO:
+        return self.transcode(SILK_TO_OGG, src)
+
+    def ogg_to_mp3(self, src: str) -> BinaryIO:
+        return self.transcode(OGG_TO_MP3, src)
+
+    def transcode(self, kind: str, src: str) -> BinaryIO:
+        digest = file_digest(src)
+        target = self.cache_dir / digest[:2] / f"{digest}-{kind}{SUFFIXES[kind]}"
+        cached = self._open_cached(target)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        with self._lock:
+            future = self._inflight.get(str(target))
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[str(target)] = future
+        if not owner:
+            # 相同内容正在转码，等待同一结果；结果在打开前已被清理时重新转码。
+            # 首个请求最长要排队一次、提交 SUBMIT_ATTEMPTS 次，等待时间按此放宽
+            future.result(timeout=self.timeout * (SUBMIT_ATTEMPTS + 2))
+            cached = self._open_cached(target)
+            if cached is None:
+                return self.transcode(kind, src)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        try:
+            result = self._run(kind, src, target)
+            future.set_result(str(target))
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(str(target), None)
+        return result
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+            "seconds": self.seconds,
+            "inflight": len(self._inflight),
+        }
+
+    @staticmethod
+    def _open_cached(target: Path) -> Optional[BinaryIO]:
+        """直接打开缓存文件，不先判断是否存在，避免与清理竞争"""
+        try:
+            f = open(target, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(target)
+        except OSError:
+            pass
+        return f
+
+    def _run(self, kind: str, src: str, target: Path) -> BinaryIO:
+        if not self._slots.acquire(timeout=self.timeout):
+            self.failures += 1
+            raise TimeoutError("transcode queue is full")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        mode = self.voice_pipeline if kind == SILK_TO_OGG else "file"
+        start = time.monotonic()
+        try:
+            if self.workers:
+                size = self._submit(kind, mode, src, str(tmp))
+            else:
+                size = _transcode(kind, mode, src, str(tmp))
+            os.replace(tmp, target)
+            # 先打开再清理缓存，清理删掉它也不影响已打开的句柄
+            result = open(target, 'rb')
+        except BaseException:
+            self.failures += 1
+            raise
+        finally:
+            self._slots.release()
+            if tmp.exists():
+                tmp.unlink()
+        elapsed = time.monotonic() - start
+        self.seconds += elapsed
+        TRANSCODE_SECONDS.labels(kind).observe(elapsed)
+        logger.info(f"transcode {kind} [{mode}] {src}: {size} bytes written in {elapsed:.3f}s")
+        self._inserts += 1
+        if self._inserts % 16 == 0:
+            self._prune()
+        return result
+
+    def _submit(self, kind: str, mode: str, src: str, dst: str) -> int:
+        for attempt in range(SUBMIT_ATTEMPTS):
+            executor, generation = self._get_executor()
+            future = executor.submit(_transcode, kind, mode, src, dst)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                self._reset_executor(generation)
+                raise TimeoutError(f"transcode {kind} timed out after {self.timeout}s: {src}")
+            except BrokenProcessPool:
+                if generation == self._generation:
+                    # 不是超时重建导致的（如工作进程崩溃），同样重建后报错
+                    self._reset_executor(generation)
+                    raise
+                # 其他任务超时重建了进程池，本任务被连带终止，在新进程池中重新提交
+                logger.info(f"transcode {kind} interrupted by a pool reset, resubmitting: {src}")
+        raise TimeoutError(f"transcode {kind} interrupted by repeated pool resets: {src}")
+
+    def _get_executor(self) -> Tuple[ProcessPoolExecutor, int]:
+        with self._lock:
+            if self._executor is None:
+                # 收发线程众多，fork 当前进程容易继承到被占用的锁
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context(method),
+                                                     initializer=_init_worker)
+            return self._executor, self._generation
+
+    def close(self):
+        """结束转码进程池，等待进行中的转码完成"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _reset_executor(self, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                # 已被其他任务重建过
+                return
+            executor, self._executor = self._executor, None
+            self._generation += 1
+        if executor is None:
+            return
+        # 卡住的转码无法通过公开接口取消，结束工作进程所在的进程组，连同它启动的 ffmpeg
+        for process in list(getattr(executor, "_processes", {}).values()):
+            try:
+                if hasattr(os, "killpg") and os.getpgid(process.pid) == process.pid:
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.terminate()
+            except (OSError, ValueError):
+                pass
+        executor.shutdown(wait=False)
+
+    def _prune(self):
+        files = []
+        total = 0
+        for path in self.cache_dir.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.cache_size:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
@@ -1,11 +1,13 @@
 import logging
 import tempfile
 import threading
+import subprocess
 import requests as requests
 import re
 import json
 import yaml
-from typing import Dict , Any
+from typing import Dict , Any , Tuple
+import functools
 import pilk
 import pydub
 import os
@@ -51,73 +53,120 @@ def download_file(url: str, retry: int = 3) -> tempfile:
             break
     return file
 
-def wechatimagedecode( file : str) -> tempfile:
-    """
-    代码来源 https://github.com/zhangxiaoyang/WechatImageDecoder
-    """
-    def do_magic(header_code, buf):
-        return header_code ^ list(buf)[0] if buf else 0x00
-    
-    def decode(magic, buf):
-        return bytearray([b ^ magic for b in list(buf)])
-
-    def guess_encoding(buf):
-        headers = {
-            'jpg': (0xff, 0xd8),
-            'png': (0x89, 0x50),
-            'gif': (0x47, 0x49),
-        }
-        for encoding in headers:
-            header_code, check_code = headers[encoding] 
-            magic = do_magic(header_code, buf)
-            _, code = decode(magic, buf[:2])
-            if check_code == code:
-                return (encoding, magic)
-        return None
+# 图片格式 -> 解密后前两个字节
+WECHAT_IMAGE_HEADERS = {
+    'jpg': (0xff, 0xd8),
+    'png': (0x89, 0x50),
+    'gif': (0x47, 0x49),
+    'webp': (0x52, 0x49),   # RIFF....WEBP
+    'bmp': (0x42, 0x4d),
+}
+# 新版微信的 .dat 为 AES 加密（文件头 V1 / V2），依赖中没有 AES 实现，两种都不解密，跳过并记录版本
+WECHAT_IMAGE_AES_HEADERS = (b'\x07\x08V1\x08\x07', b'\x07\x08V2\x08\x07')
+IMAGE_DECODE_CHUNK_SIZE = 1024 * 1024
 
-    with open(file , 'rb') as f:
-        buf = bytearray(f.read())
-    file_type, magic = guess_encoding(buf)
+def guess_image_xor_key(header : bytes) -> Tuple[str, int]:
+    """
+    根据文件前两个字节推断图片格式与异或密钥
+    :return: (格式, 密钥)
+    """
+    if header.startswith(WECHAT_IMAGE_AES_HEADERS):
+        # 调用方记录警告时会带上版本，便于判断是否需要在手机端查看
+        raise ValueError(f"AES encrypted WeChat image (format {header[2:4].decode()}) is not supported, skipped")
+    if len(header) < 2:
+        raise ValueError("WeChat image is too short")
+    for encoding, (header_code, check_code) in WECHAT_IMAGE_HEADERS.items():
+        magic = header_code ^ header[0]
+        if header[1] ^ magic == check_code:
+            return encoding, magic
+    raise ValueError("Unknown WeChat image format")
 
-    ret_file = tempfile.NamedTemporaryFile()
-    with open(ret_file.name , 'wb') as f:
-        f.write(decode(magic, buf))
-    f.close()
-    return ret_file
+@functools.lru_cache(maxsize=256)
+def xor_translation_table(magic : int) -> bytes:
+    return bytes(b ^ magic for b in range(256))
 
-def load_local_file_to_temp(file : str) -> tempfile:
+def wechatimagedecode( file : str) -> tempfile:
     """
-    从本地文件读取文件到临时文件
+    解密微信 .dat 图片，按块通过 256 字节转换表异或后直接写入临时文件
+    原理参考 https://github.com/zhangxiaoyang/WechatImageDecoder
     """
     ret_file = tempfile.NamedTemporaryFile()
     with open(file , 'rb') as f:
-        ret_file.write(f.read())
-    f.close()
+        header = f.read(len(WECHAT_IMAGE_AES_HEADERS[0]))
+        file_type, magic = guess_image_xor_key(header)
+        table = xor_translation_table(magic)
+        ret_file.write(header.translate(table))
+        while True:
+            chunk = f.read(IMAGE_DECODE_CHUNK_SIZE)
+            if not chunk:
+                break
+            ret_file.write(chunk.translate(table))
+    ret_file.flush()
+    ret_file.seek(0)
     return ret_file
 
-def load_temp_file_to_local(file : tempfile , path : str) -> None:
+def convert_silk_to_ogg_file(src : str, dst : str) -> None:
     """
-    从临时文件写到本地
+    将 silk 文件转换为 ogg(opus) 文件，输入输出均为路径
     """
-    with open(path , 'wb') as f:
-        f.write(file.read())
-    f.close()
+    with open(src, 'rb') as f:
+        silk_header = f.read(10)
+    if b"#!SILK_V3" not in silk_header:
+        raise ValueError(f"{src} is not a silk file")
+    with tempfile.NamedTemporaryFile() as pcm:
+        pilk.decode(src, pcm.name)
+        pydub.AudioSegment.from_raw(file= pcm , sample_width=2, frame_rate=24000, channels=1) \
+            .export( dst , format="ogg", codec="libopus",
+                    parameters=['-vbr', 'on'])
 
-def convert_silk_to_mp3(file : tempfile) -> tempfile:
+def convert_silk_to_ogg_stream(src : str, dst : str) -> None:
     """
-    将silk文件转换为mp3文件
+    将 silk 文件转换为 ogg(opus) 文件，不落地中间文件：
+    pilk 解码出的 PCM 写入命名管道，ffmpeg 从管道读取并直接编码写入 dst
+    pilk 解码期间持有 GIL，因此不能由本进程的其他线程读取管道或 ffmpeg 的输出
     """
-    f = tempfile.NamedTemporaryFile()
-    file.seek(0)
-    silk_header = file.read(10)
-    file.seek(0)
-    if b"#!SILK_V3" in silk_header:
-        pilk.decode(file.name, f.name)
-        file.close()
-        pydub.AudioSegment.from_raw(file= f , sample_width=2, frame_rate=24000, channels=1) \
-            .export( f , format="ogg", codec="libopus",
-                    parameters=['-vbr', 'on'])
-    return f
+    with open(src, 'rb') as f:
+        silk_header = f.read(10)
+    if b"#!SILK_V3" not in silk_header:
+        raise ValueError(f"{src} is not a silk file")
+
+    with tempfile.TemporaryDirectory() as fifo_dir:
+        fifo = os.path.join(fifo_dir, "pcm")
+        os.mkfifo(fifo)
+        proc = subprocess.Popen(
+            [pydub.AudioSegment.converter, "-hide_banner", "-loglevel", "error",
+             "-f", "s16le", "-ar", "24000", "-ac", "1", "-i", fifo,
+             "-c:a", "libopus", "-vbr", "on", "-f", "ogg", "-y", dst],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        decoded = threading.Event()
+
+        def watchdog():
+            proc.wait()
+            if decoded.is_set():
+                return
+            # ffmpeg 在打开管道前退出时 pilk 会阻塞在打开管道上。由外部进程打开一次读端后退出，
+            # 使 pilk 后续写入以 EPIPE 失败返回；pilk 持有 GIL，本进程内的线程无法代劳
+            unblock = subprocess.Popen(["sh", "-c", 'exec 3<"$0"', fifo])
+            decoded.wait()
+            unblock.kill()
+            unblock.wait()
+
+        threading.Thread(target=watchdog, daemon=True).start()
+        try:
+            pilk.decode(src, fifo)
+        finally:
+            decoded.set()
+        err = proc.stderr.read()
+        proc.wait()
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {proc.returncode}: {err.decode(errors='ignore').strip()}")
+
+def convert_ogg_to_mp3_file(src : str, dst : str) -> None:
+    """
+    将 ogg 文件转换为 mp3 文件，输入输出均为路径
+    """
+    pydub.AudioSegment.from_ogg(src).export(dst, format="mp3")
 
 
 WC_EMOTICON_CONVERSION = {
@@ -245,3 +294,52 @@ WC_EMOTICON_CONVERSION = {
     '[生病]': '😷', '[Sick]': '😷',
     '[笑脸]': '😁', '[Happy]': '😁',
 }
+
+
+class EmoticonTranslator:
+    """
+    微信表情代码与 emoji 互转，对照表只在构建时编译一次。
+    - 收：按 [xxx] 切分后查表，每条消息只扫描一遍；
+    - 发：按长度降序的 emoji 分支正则切分后查表，每个字符后的变体选择符 U+FE0F 可有可无。
+    """
+
+    def __init__(self, conversion : Dict[str, str]):
+        self.to_emoji = dict(conversion)
+        self.to_code = {}
+        for code, emoji in conversion.items():
+            # 优先使用中文代码，中文版微信只识别中文表情代码
+            if emoji not in self.to_code or (self.to_code[emoji].isascii() and not code.isascii()):
+                self.to_code[emoji] = code
+        for emoji, code in list(self.to_code.items()):
+            # 发送方可能带或不带变体选择符，如 ❤ / ❤️、🤦‍♂ / 🤦‍♂️，正则两者都匹配，去掉后查表
+            self.to_code.setdefault(emoji.replace('\ufe0f', ''), code)
+        longest = max(map(len, self.to_emoji), default=2)
+        self._code_pattern = re.compile(r'(\[[^\[\]]{1,%d}\])' % (longest - 2))
+        emojis = sorted((e for e in self.to_code if e and '\ufe0f' not in e), key=len, reverse=True)
+        self._emoji_pattern = re.compile('(%s)' % '|'.join(
+            ''.join(re.escape(c) + '\ufe0f?' for c in emoji) for emoji in emojis))
+
+    def wechat_to_emoji(self, text : str) -> str:
+        """[微笑] -> 😃，未知代码原样保留"""
+        if not text or '[' not in text:
+            return text
+        parts = self._code_pattern.split(text)
+        if len(parts) == 1:
+            return text
+        get = self.to_emoji.get
+        parts[1::2] = [get(code, code) for code in parts[1::2]]
+        return ''.join(parts)
+
+    def emoji_to_wechat(self, text : str) -> str:
+        """😃 -> [微笑]"""
+        if not text or text.isascii():
+            return text
+        parts = self._emoji_pattern.split(text)
+        if len(parts) == 1:
+            return text
+        to_code = self.to_code
+        parts[1::2] = [to_code[emoji.replace('\ufe0f', '')] for emoji in parts[1::2]]
+        return ''.join(parts)
+
+
+EMOTICON_TRANSLATOR = EmoticonTranslator(WC_EMOTICON_CONVERSION)
@@ -0,0 +1,120 @@
+# coding: utf-8
+import logging
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+RAW = b"r"
+DEFLATE = b"z"
+
+
+class XmlSpool:
+    """
+    入站消息原始 xml 的暂存，按消息 ID 存取，供引用回复时构造 refermsg：
+    - 内存中按 LRU 保留 zlib 压缩后的内容，总大小不超过 memory_limit；
+    - 淘汰的条目写入 SQLite，最多保留 disk_entries 条，更早的直接删除；
+    - 每 report_every 条记录一次原文与实际占用的大小。
+    """
+
+    compress_min: int = 128         # 更短的内容压缩后往往更大，原样保存
+    level: int = 6
+
+    def __init__(self, path: Union[str, Path], memory_limit: int = 16 * 1024 * 1024,
+                 disk_entries: int = 100000, report_every: int = 10000):
+        self.memory_limit = memory_limit
+        self.disk_entries = disk_entries
+        self.report_every = report_every
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")      # 只是缓存，丢失不影响收发
+        self._db.execute("CREATE TABLE IF NOT EXISTS xml (key TEXT PRIMARY KEY, data BLOB NOT NULL)")
+
+        self.puts = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.spilled = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def put(self, key: str, xml: str) -> str:
+        raw = xml.encode("utf-8")
+        data = RAW + raw
+        if len(raw) >= self.compress_min:
+            compressed = zlib.compress(raw, self.level)
+            if len(compressed) < len(raw):
+                data = DEFLATE + compressed
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old)
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.memory_limit and len(self._memory) > 1:
+                self._spill(*self._memory.popitem(last=False))
+            self.puts += 1
+            self.raw_bytes += len(raw)
+            self.stored_bytes += len(data)
+            if self.report_every and self.puts % self.report_every == 0:
+                self._report()
+        return key
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+            else:
+                row = self._db.execute("SELECT data FROM xml WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                data = row[0]
+                self.disk_hits += 1
+        if data[:1] == DEFLATE:
+            return zlib.decompress(data[1:]).decode("utf-8")
+        return data[1:].decode("utf-8")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "raw_bytes": self.raw_bytes,
+                "stored_bytes": self.stored_bytes,
+                "spilled": self.spilled,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _spill(self, key: str, data: bytes):
+        self._memory_bytes -= len(data)
+        try:
+            self._db.execute("INSERT OR REPLACE INTO xml (key, data) VALUES (?, ?)", (key, data))
+            self.spilled += 1
+            if self.spilled % 1000 == 0:
+                self._db.execute("DELETE FROM xml WHERE rowid <= (SELECT MAX(rowid) FROM xml) - ?", (self.disk_entries,))
+        except sqlite3.Error as e:
+            logger.warning(f"xml spool: failed to spill {key}: {e}")
+
+    def _report(self):
+        ratio = self.stored_bytes / self.raw_bytes if self.raw_bytes else 0
+        logger.info(f"xml spool: {self.puts} 条消息，原文 {self.raw_bytes / 1048576:.1f}MB，"
+                    f"压缩后 {self.stored_bytes / 1048576:.1f}MB ({ratio:.0%})，"
+                    f"内存 {self._memory_bytes / 1048576:.1f}MB / {len(self._memory)} 条，落盘 {self.spilled} 条")